@@ -3,12 +3,48 @@ import requests
 import firebase_admin
 from firebase_admin import credentials, firestore
 import pandas as pd
+import numpy as np
 import uuid
 import time
+import datetime
+import functools
+import contextvars
 import os, json
+import sys
+import argparse
+import base64
+import hashlib
+import hmac
+import html
+import ipaddress
 import unicodedata
-
-TOKEN_FILE = "session_token.json"
+import bisect
+import heapq
+import random
+import re
+import struct
+import zlib
+import gzip
+import io
+import logging
+import tempfile
+import threading
+import atexit
+import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+log = logging.getLogger("brainrots")
+
+# La sesión viaja en una cookie firmada, así que cualquier proceso detrás del
+# balanceador puede restaurarla sin estado local. La cookie la escribe
+# JavaScript (no puede ser HttpOnly), así que sólo lleva uid, correo,
+# caducidad y un id de sesión; los tokens de Firebase se guardan en la caché
+# compartida bajo ese id y se borran al cerrar sesión.
+SESION_COOKIE = "brainrots_sesion"
+SESION_DURACION = 30 * 86400
 
 RARITY_BADGE_STYLE = """
 <style>
@@ -178,11 +214,15 @@ def option_display(option: str) -> str:
 
 
 def rarity_badge_html(rarity: str) -> str:
-    """Devuelve una insignia HTML para la rareza indicada."""
+    """Devuelve una insignia HTML para la rareza indicada.
+
+    La clase CSS sólo se arma con las rarezas conocidas y el texto se escapa:
+    la insignia también se sirve en las instantáneas públicas.
+    """
     if not rarity:
         return ""
-    slug = rarity.lower().replace(" ", "-")
-    return f"<span class='rarity-badge rarity-{slug}'>{rarity}</span>"
+    slug = rarity.lower().replace(" ", "-") if rarity in RAREZAS else "desconocida"
+    return f"<span class='rarity-badge rarity-{slug}'>{html.escape(str(rarity))}</span>"
 
 
 COLOR_BADGE_CLASS_MAP = {
@@ -202,57 +242,104 @@ def color_badge_html(color: str) -> str:
     if not color:
         color = "-"
     css_class = COLOR_BADGE_CLASS_MAP.get(color, "color-ninguno")
-    return f"<span class='color-badge {css_class}'>{color}</span>"
+    return f"<span class='color-badge {css_class}'>{html.escape(str(color))}</span>"
 
 def apply_theme():
     st.markdown(THEME_STYLE_TEMPLATE.format(**DEFAULT_THEME), unsafe_allow_html=True)
 
 
 
-def _write_token_file(data):
+def _session_key():
+    """Clave de firma: ``[sesion] clave`` en secrets o, si falta, la de la cuenta de servicio."""
+    clave = st.secrets.get("sesion", {}).get("clave") or st.secrets["FIREBASE_KEY"].get("private_key", "")
+    return hashlib.sha256(str(clave).encode("utf-8")).digest()
+
+
+def sign_session(data):
+    cuerpo = base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).decode().rstrip("=")
+    firma = hmac.new(_session_key(), cuerpo.encode(), hashlib.sha256).hexdigest()
+    return f"{cuerpo}.{firma}"
+
+
+def read_session(token):
+    """Devuelve los datos de una cookie de sesión válida y vigente, o None."""
+    if not isinstance(token, str):
+        return None
+    cuerpo, _, firma = token.partition(".")
+    esperada = hmac.new(_session_key(), cuerpo.encode(), hashlib.sha256).hexdigest()
+    if not cuerpo or not hmac.compare_digest(firma, esperada):
+        return None
     try:
-        with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
-    except OSError as exc:
-        st.warning(f"No se pudo guardar la sesión localmente: {exc}")
+        data = json.loads(base64.urlsafe_b64decode(cuerpo + "=" * (-len(cuerpo) % 4)))
+    except ValueError:
+        return None
+    return data if data.get("exp", 0) > time.time() else None
 
 
 def save_session_token(uid, email, id_token=None, refresh_token=None):
-    """Guarda la sesión en memoria y en disco para persistir entre recargas."""
+    """Guarda la sesión en memoria y deja pendiente escribirla en la cookie del navegador."""
+    sid = uuid.uuid4().hex
     user_data = {
         "uid": uid,
         "email": email,
+        "sid": sid,
         "id_token": id_token,
         "refresh_token": refresh_token,
     }
     st.session_state["user"] = user_data
-    _write_token_file(user_data)
+    st.session_state.pop("sesion_cerrada", None)
+    cache_set_json(f"sesion:{sid}", {"id_token": id_token, "refresh_token": refresh_token}, SESION_DURACION)
+    st.session_state["cookie_sesion"] = sign_session(
+        {"uid": uid, "email": email, "sid": sid, "exp": int(time.time()) + SESION_DURACION}
+    )
 
 
 def load_session_token():
-    """Carga la sesión existente desde memoria o desde archivo."""
+    """Carga la sesión existente desde memoria o desde la cookie firmada."""
     if "user" in st.session_state:
         return True
-
-    if os.path.exists(TOKEN_FILE):
-        try:
-            with open(TOKEN_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            st.session_state["user"] = data
-            return True
-        except (OSError, json.JSONDecodeError) as exc:
-            st.warning(f"No se pudo cargar la sesión previa: {exc}")
-    return False
+    if st.session_state.get("sesion_cerrada"):
+        return False
+
+    data = read_session(st.context.cookies.get(SESION_COOKIE))
+    if data is None or not data.get("sid"):
+        return False
+    tokens = cache_get_json(f"sesion:{data['sid']}") or {}
+    if tokens.get("cerrada"):
+        return False
+    st.session_state["user"] = {
+        "uid": data.get("uid"),
+        "email": data.get("email"),
+        "sid": data["sid"],
+        "id_token": tokens.get("id_token"),
+        "refresh_token": tokens.get("refresh_token"),
+    }
+    return True
 
 
 def clear_session_token():
-    """Elimina la sesión activa tanto en memoria como en disco."""
-    st.session_state.pop("user", None)
-    if os.path.exists(TOKEN_FILE):
-        try:
-            os.remove(TOKEN_FILE)
-        except OSError as exc:
-            st.warning(f"No se pudo eliminar el archivo de sesión: {exc}")
+    """Elimina la sesión activa en memoria y borra la cookie del navegador."""
+    user = st.session_state.pop("user", None) or {}
+    if user.get("sid"):
+        # Se marca cerrada en vez de borrarla para que la cookie deje de
+        # servir también en otras pestañas y procesos.
+        cache_set_json(f"sesion:{user['sid']}", {"cerrada": True}, SESION_DURACION)
+    # st.context.cookies conserva la cookie con la que se abrió la conexión.
+    st.session_state["sesion_cerrada"] = True
+    st.session_state["cookie_sesion"] = ""
+
+
+def sync_session_cookie():
+    """Escribe en el navegador la cookie pendiente (vacía = borrarla)."""
+    if "cookie_sesion" not in st.session_state:
+        return
+    valor = st.session_state.pop("cookie_sesion")
+    duracion = SESION_DURACION if valor else 0
+    st.iframe(
+        f"<script>window.parent.document.cookie = "
+        f"'{SESION_COOKIE}={valor}; path=/; max-age={duracion}; SameSite=Lax';</script>",
+        height=1,
+    )
 # ============================
 # CONFIGURACIÓN FIREBASE
 # ============================
@@ -311,1050 +398,5062 @@ def confirm_deletion(state_key, message):
     return confirmed_value
 
 
+def parse_num(texto):
+    """Interpreta cantidades como '10M', '$2.5B/s' o '1500'; devuelve None si no es válida."""
+    if texto is None:
+        return None
+    limpio = str(texto).strip().upper().replace("$", "").replace("/S", "").replace(",", "").replace(" ", "")
+    if not limpio:
+        return None
+    multiplicador = {"K": 1_000, "M": 1_000_000, "B": 1_000_000_000}.get(limpio[-1])
+    if multiplicador:
+        limpio = limpio[:-1]
+    try:
+        valor = float(limpio) * (multiplicador or 1)
+    except ValueError:
+        return None
+    return valor if valor >= 0 else None
+
+
+FILTROS_POR_DEFECTO = {
+    "orden": "Total ↓",
+    "cuenta": "Todas",
+    "rarezas": [],
+    "colores": [],
+    "mutaciones": [],
+    "mutaciones_modo": "Todas",
+    "total_min": "",
+    "total_max": "",
+    "busqueda": "",
+}
+
+
+@st.fragment(run_every=1.0)
+def save_status(uid, perfil):
+    """Indicador de guardado que se refresca solo mientras hay cambios en la cola."""
+    error = write_error(uid, perfil)
+    if error:
+        st.error(f"⚠️ Los cambios están guardados, pero no se pudo actualizar el resumen del perfil ({error}). Se reintentará automáticamente.")
+    elif pending_write_count(uid, perfil):
+        st.caption("💾 Actualizando el resumen…")
+    else:
+        st.rerun()
+
+
+@st.fragment(run_every=1.0)
+def restore_status(uid):
+    """Indicador de la restauración en segundo plano; al terminar recarga la página para mostrar el resultado."""
+    if st.session_state["respaldo_restauracion"]["futuro"].done():
+        st.rerun()
+    st.caption("♻️ Restaurando perfiles…")
+
+
 def get_inventory_filters(perfil):
     """Recupera (o inicializa) las preferencias de filtros para el perfil indicado."""
     filtros_por_perfil = st.session_state.setdefault("inventario_filtros", {})
-    return filtros_por_perfil.setdefault(perfil, {"orden": "Total ↓", "cuenta": "Todas"})
+    filtros = filtros_por_perfil.setdefault(perfil, {})
+    for campo, valor in FILTROS_POR_DEFECTO.items():
+        filtros.setdefault(campo, list(valor) if isinstance(valor, list) else valor)
+    return filtros
 
 # ============================
-# FUNCIONES DE AUTENTICACIÓN
+# ÍNDICE DE FILTROS DEL INVENTARIO
 # ============================
 
-def signup(email, password):
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={WEB_API_KEY}"
-    payload = {"email": email, "password": password, "returnSecureToken": True}
-    res = requests.post(url, data=payload)
-    return res.json()
+RAREZAS = ["Común", "Raro", "Épico", "Legendario", "Mítico", "Brainrot God", "Secreto", "OG"]
 
-def login(email, password):
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={WEB_API_KEY}"
-    payload = {"email": email, "password": password, "returnSecureToken": True}
-    res = requests.post(url, data=payload)
-    return res.json()
+
+def _bit_positions(mask):
+    """Devuelve las posiciones de los bits activos de un bitmap, de menor a mayor."""
+    bits = bin(mask)[:1:-1]
+    posiciones = []
+    pos = bits.find("1")
+    while pos != -1:
+        posiciones.append(pos)
+        pos = bits.find("1", pos + 1)
+    return posiciones
+
+
+class InventoryIndex:
+    """Índice invertido del inventario con bitmaps sobre enteros de Python.
+
+    El bit ``i`` de cada bitmap corresponde a ``items[i]`` y los items están
+    ordenados por ``Total`` ascendente, de modo que un rango de ingresos es una
+    máscara contigua y combinar criterios se reduce a ``&`` y ``|``.
+    """
+
+    def __init__(self, brainrots):
+        self.items = sorted(brainrots, key=lambda b: b.get("Total") or 0)
+        self.totales = [b.get("Total") or 0 for b in self.items]
+        self.todos = (1 << len(self.items)) - 1
+        self.por_calidad = {}
+        self.por_color = {}
+        self.por_mutacion = {}
+        self.por_cuenta = {}
+        self.por_nombre = {}
+        for pos, b in enumerate(self.items):
+            bit = 1 << pos
+            self._marcar(self.por_calidad, b.get("Calidad") or "Común", bit)
+            self._marcar(self.por_color, b.get("Color") or "-", bit)
+            self._marcar(self.por_cuenta, b.get("Cuenta") or "(ninguna)", bit)
+            self._marcar(self.por_nombre, normalize_text(b.get("Brainrot", "")), bit)
+            for mutacion in set(b.get("Mutaciones") or []):
+                self._marcar(self.por_mutacion, mutacion, bit)
+
+    @staticmethod
+    def _marcar(indice, clave, bit):
+        indice[clave] = indice.get(clave, 0) | bit
+
+    @staticmethod
+    def _union(indice, claves):
+        mask = 0
+        for clave in claves:
+            mask |= indice.get(clave, 0)
+        return mask
+
+    def rango_total(self, minimo=None, maximo=None):
+        """Máscara de los items cuyo Total está en [minimo, maximo]."""
+        lo = bisect.bisect_left(self.totales, minimo) if minimo is not None else 0
+        hi = bisect.bisect_right(self.totales, maximo) if maximo is not None else len(self.totales)
+        if hi <= lo:
+            return 0
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+    def buscar_nombre(self, texto):
+        """Máscara de los items cuyo nombre contiene el texto (sin acentos ni mayúsculas)."""
+        consulta = normalize_text(texto.strip())
+        if not consulta:
+            return self.todos
+        return self._union(self.por_nombre, [n for n in self.por_nombre if consulta in n])
+
+    def filtrar(
+        self,
+        rarezas=(),
+        colores=(),
+        mutaciones=(),
+        mutaciones_modo="Todas",
+        cuenta="Todas",
+        total_min=None,
+        total_max=None,
+        busqueda="",
+    ):
+        """Combina los criterios (OR dentro de cada uno, AND entre ellos) y devuelve los items."""
+        mask = self.todos
+        if rarezas:
+            mask &= self._union(self.por_calidad, rarezas)
+        if colores:
+            mask &= self._union(self.por_color, colores)
+        if mutaciones:
+            if mutaciones_modo == "Todas":
+                for mutacion in mutaciones:
+                    mask &= self.por_mutacion.get(mutacion, 0)
+            else:
+                mask &= self._union(self.por_mutacion, mutaciones)
+        if cuenta and cuenta != "Todas":
+            mask &= self.por_cuenta.get(cuenta, 0)
+        if total_min is not None or total_max is not None:
+            mask &= self.rango_total(total_min, total_max)
+        if busqueda:
+            mask &= self.buscar_nombre(busqueda)
+        return [self.items[pos] for pos in _bit_positions(mask)]
+
+
+ORDENES_INVENTARIO = ["Total ↓", "Total ↑", "Cuenta", "Brainrot", "Cuenta + Total ↓"]
+
+
+def sort_inventory(items, orden):
+    """Ordena una lista de pilas según una de ORDENES_INVENTARIO (orden estable)."""
+    if orden == "Total ↓":
+        return sorted(items, key=lambda b: b.get("Total") or 0, reverse=True)
+    if orden == "Total ↑":
+        return sorted(items, key=lambda b: b.get("Total") or 0)
+    if orden == "Cuenta":
+        return sorted(items, key=lambda b: b.get("Cuenta") or "")
+    if orden == "Brainrot":
+        return sorted(items, key=lambda b: b.get("Brainrot") or "")
+    if orden == "Cuenta + Total ↓":
+        return sorted(items, key=lambda b: (b.get("Cuenta") or "", -(b.get("Total") or 0)))
+    return list(items)
+
+
+def get_inventory_index(perfil, brainrots):
+    """Devuelve el índice del perfil, reconstruyéndolo sólo si el inventario o el catálogo cambiaron."""
+    campos = ("id", "Brainrot", "Calidad", "Color", "Cuenta", "Total", "Cantidad")
+    firma = hash((
+        current_catalog()["version"],
+        tuple(tuple(b.get(c) for c in campos) + (tuple(b.get("Mutaciones") or ()),) for b in brainrots),
+    ))
+    indices = st.session_state.setdefault("inventario_indices", {})
+    cacheado = indices.get(perfil)
+    if cacheado and cacheado[0] == firma:
+        return cacheado[1]
+    indice = InventoryIndex(brainrots)
+    indices[perfil] = (firma, indice)
+    return indice
+
+
+def bind_filter_widget(widget_key, filtros, campo, opciones=None):
+    """Inicializa el estado de un widget de filtro con la preferencia guardada del perfil."""
+    if widget_key not in st.session_state:
+        st.session_state[widget_key] = filtros.get(campo, FILTROS_POR_DEFECTO.get(campo))
+    valor = st.session_state[widget_key]
+    if opciones is not None:
+        if isinstance(valor, list):
+            st.session_state[widget_key] = [v for v in valor if v in opciones]
+        elif valor not in opciones:
+            st.session_state[widget_key] = opciones[0]
 
 # ============================
-# FUNCIONES DE PERFILES
+# APILADO DE BRAINROTS IDÉNTICOS
 # ============================
 
-def list_profiles(uid):
+def new_item_id():
+    """Id interno corto para una entrada del inventario (único dentro del perfil)."""
+    return uuid.uuid4().hex[:12]
+
+
+def item_count(brainrot):
+    """Número de copias que representa una entrada del inventario."""
     try:
-        col = db.collection("perfiles").document(uid).collection("data").stream()
-        return [doc.id for doc in col]
-    except Exception as e:
-        st.error(f"Error listando perfiles: {e}")
-        return []
+        return max(int(brainrot.get("Cantidad", 1) or 1), 1)
+    except (TypeError, ValueError):
+        return 1
 
-def create_profile(uid, name):
-    db.collection("perfiles").document(uid).collection("data").document(name).set({
-        "brainrots": [],
-        "cuentas": []
-    })
 
-def delete_profile(uid, name):
-    db.collection("perfiles").document(uid).collection("data").document(name).delete()
+def item_income(brainrot):
+    """Ingreso total ($/s) de una pila: Total por copia multiplicado por la cantidad."""
+    return (brainrot.get("Total") or 0) * item_count(brainrot)
 
-def load_data(uid, perfil):
-    doc = db.collection("perfiles").document(uid).collection("data").document(perfil).get()
-    if doc.exists:
-        data = doc.to_dict()
-        return data.get("brainrots", []), data.get("cuentas", [])
-    return [], []
-
-def save_data(uid, perfil, brainrots, cuentas):
-    db.collection("perfiles").document(uid).collection("data").document(perfil).set({
-        "brainrots": brainrots,
-        "cuentas": cuentas
-    })
+
+def stack_key(brainrot):
+    """Clave que identifica copias idénticas (mismo Brainrot, color, mutaciones y cuenta)."""
+    return (
+        brainrot.get("Brainrot"),
+        brainrot.get("Color") or "-",
+        tuple(sorted(brainrot.get("Mutaciones") or [])),
+        brainrot.get("Cuenta") or "(ninguna)",
+    )
+
+
+def merge_stacks(brainrots):
+    """Fusiona las copias idénticas en una sola entrada con ``Cantidad``.
+
+    Devuelve la lista resultante y si hubo cambios. Se conserva el id de la
+    primera copia de cada pila.
+    """
+    pilas = {}
+    resultado = []
+    cambios = False
+    for brainrot in brainrots:
+        clave = stack_key(brainrot)
+        existente = pilas.get(clave)
+        if existente is None:
+            pilas[clave] = brainrot
+            resultado.append(brainrot)
+        else:
+            existente["Cantidad"] = item_count(existente) + item_count(brainrot)
+            cambios = True
+    return resultado, cambios
+
+
+def add_to_stack(brainrots, nuevo):
+    """Agrega ``nuevo`` al inventario sumándolo a su pila si ya existe una idéntica."""
+    clave = stack_key(nuevo)
+    for brainrot in brainrots:
+        if stack_key(brainrot) == clave:
+            brainrot["Cantidad"] = item_count(brainrot) + item_count(nuevo)
+            return brainrot
+    nuevo["Cantidad"] = item_count(nuevo)
+    brainrots.append(nuevo)
+    return nuevo
+
+
+def split_stack(brainrots, brainrot_id, cantidad):
+    """Separa ``cantidad`` copias de una pila en una entrada nueva y la devuelve.
+
+    Si se pide la pila completa devuelve la misma entrada sin dividirla.
+    """
+    for brainrot in brainrots:
+        if brainrot["id"] == brainrot_id:
+            disponibles = item_count(brainrot)
+            cantidad = min(max(int(cantidad), 1), disponibles)
+            if cantidad == disponibles:
+                return brainrot
+            brainrot["Cantidad"] = disponibles - cantidad
+            separada = dict(brainrot, id=new_item_id(), Cantidad=cantidad)
+            separada["Mutaciones"] = list(brainrot.get("Mutaciones") or [])
+            brainrots.append(separada)
+            return separada
+    return None
+
+
+def remove_from_stack(brainrots, brainrot_id, cantidad=1):
+    """Quita ``cantidad`` copias de una pila; si no quedan copias elimina la entrada."""
+    separada = split_stack(brainrots, brainrot_id, cantidad)
+    if separada is None:
+        return brainrots
+    return [b for b in brainrots if b is not separada]
+
+
+def move_from_stack(brainrots, brainrot_id, cantidad, cuenta):
+    """Mueve ``cantidad`` copias de una pila a otra cuenta, fusionando con la pila destino."""
+    separada = split_stack(brainrots, brainrot_id, cantidad)
+    if separada is None:
+        return brainrots
+    separada["Cuenta"] = cuenta
+    resultado, _ = merge_stacks(brainrots)
+    return resultado
 
 # ============================
-# INTERFAZ STREAMLIT
+# CUENTAS
 # ============================
 
-st.title("📒 Inventario de Brainrots")
+# Las cuentas de un perfil son entidades {"id", "nombre"} con un id estable:
+# los Brainrots guardados apuntan al id, así que renombrar una cuenta sólo
+# cambia su entrada y el nombre se resuelve al leer el inventario. En memoria
+# cada Brainrot conserva el nombre ya resuelto en "Cuenta".
+
+def account_entities(cuentas):
+    """Normaliza una lista de cuentas; las listas antiguas de nombres usan su posición como id."""
+    return [
+        dict(cuenta) if isinstance(cuenta, dict) else {"id": i, "nombre": cuenta}
+        for i, cuenta in enumerate(cuentas)
+    ]
+
+
+def account_names(cuentas):
+    return [cuenta["nombre"] for cuenta in cuentas]
+
+
+def find_account(cuentas, nombre):
+    for cuenta in cuentas:
+        if cuenta["nombre"] == nombre:
+            return cuenta
+    return None
+
+
+def new_account_id(cuentas):
+    return max((cuenta["id"] for cuenta in cuentas), default=-1) + 1
 
 # ============================
-# 🖥️ INTERFAZ LOGIN / SIGNUP
+# OPTIMIZADOR DE CUENTAS
 # ============================
 
-if not load_session_token():
-    tabs = st.tabs(["🔑 Iniciar sesión", "🆕 Registrarse"])
-
-    with tabs[0]:
-        email = st.text_input("Correo", key="login_email_input")
-        password = st.text_input("Contraseña", type="password", key="login_pass_input")
-        if st.button("Entrar", key="login_button"):
-            user = login(email, password)
-            if "error" in user:
-                st.error(user["error"]["message"])
-            else:
-                save_session_token(
-                    user.get("localId"),
-                    user.get("email"),
-                    user.get("idToken"),
-                    user.get("refreshToken"),
-                )
-                st.success(f"✅ Sesión iniciada: {user['email']}")
-                st.rerun()
+# Cada cuenta tiene un número de espacios en su base y sólo generan ingreso las
+# mejores copias que caben en ellos. Los Brainrots sin cuenta no generan nada.
+
+def current_income(brainrots, espacios):
+    """Ingreso actual: en cada cuenta cuentan sus ``espacios[cuenta]`` copias de mayor Total."""
+    por_cuenta = {}
+    for brainrot in brainrots:
+        por_cuenta.setdefault(brainrot.get("Cuenta") or "(ninguna)", []).append(brainrot)
+    total = 0
+    for cuenta, libres in espacios.items():
+        for brainrot in sorted(por_cuenta.get(cuenta, []), key=lambda b: b.get("Total", 0), reverse=True):
+            if libres <= 0:
+                break
+            usadas = min(libres, item_count(brainrot))
+            total += usadas * brainrot.get("Total", 0)
+            libres -= usadas
+    return total
 
-    with tabs[1]:
-        new_email = st.text_input("Correo nuevo", key="signup_email_input")
-        new_pass = st.text_input("Contraseña nueva", type="password", key="signup_pass_input", placeholder="Mínimo 6 caracteres")
-        if st.button("Crear cuenta", key="signup_button"):
-            user = signup(new_email, new_pass)
-            if "error" in user:
-                st.error(user["error"]["message"])
-            else:
-                st.success(f"✅ Cuenta creada: {new_email}. Ahora puedes iniciar sesión.")
 
-else:
-    st.success(f"✅ Bienvenido {st.session_state['user']['email']}")
+def optimize_loadout(brainrots, espacios):
+    """Reparte las copias entre las cuentas para maximizar el ingreso con el mínimo de movimientos.
 
+    Como el Total de una copia no depende de la cuenta, el óptimo es colocar
+    las S copias de mayor Total (S = suma de espacios): cambiar cualquiera de
+    ellas por otra de fuera no puede subir el ingreso. Entre las copias
+    empatadas en el umbral se prefieren las que ya están en una cuenta con
+    espacio, y cada cuenta conserva todas las elegidas que le caben, así que
+    sólo se mueven las que no pueden quedarse donde están.
 
-    # ============================
-    # PESTAÑAS PRINCIPALES
-    # ============================
-    pestañas = st.tabs(["👤 Perfiles", "📦 Inventario", "⚙️ Opciones"])
+    Devuelve ``(movimientos, ingreso)`` con movimientos
+    ``[(brainrot, cantidad, cuenta_destino)]``.
+    """
+    capacidad = {cuenta: max(int(n), 0) for cuenta, n in espacios.items()}
+    total_espacios = sum(capacidad.values())
+    pilas = sorted(brainrots, key=lambda b: b.get("Total", 0), reverse=True)
+
+    umbral = None
+    acumuladas = 0
+    for pila in pilas:
+        acumuladas += item_count(pila)
+        if acumuladas >= total_espacios:
+            umbral = pila.get("Total", 0)
+            break
+
+    elegidas = {}
+    ocupadas = dict.fromkeys(capacidad, 0)
+    empatadas = []
+    restantes = total_espacios
+    for pila in pilas:
+        total = pila.get("Total", 0)
+        if umbral is not None and total < umbral:
+            break
+        if umbral is not None and total == umbral:
+            empatadas.append(pila)
+            continue
+        elegidas[pila["id"]] = item_count(pila)
+        restantes -= item_count(pila)
+        cuenta = pila.get("Cuenta") or "(ninguna)"
+        if cuenta in ocupadas:
+            ocupadas[cuenta] += item_count(pila)
+
+    empatadas.sort(key=lambda b: capacidad.get(b.get("Cuenta"), 0) - ocupadas.get(b.get("Cuenta"), 0), reverse=True)
+    for pila in empatadas:
+        if restantes <= 0:
+            break
+        cuenta = pila.get("Cuenta") or "(ninguna)"
+        libres = max(capacidad.get(cuenta, 0) - ocupadas.get(cuenta, 0), 0)
+        cantidad = min(item_count(pila), restantes, libres) if libres else 0
+        if cantidad:
+            elegidas[pila["id"]] = cantidad
+            ocupadas[cuenta] += cantidad
+            restantes -= cantidad
+    for pila in empatadas:
+        if restantes <= 0:
+            break
+        cantidad = min(item_count(pila) - elegidas.get(pila["id"], 0), restantes)
+        if cantidad > 0:
+            elegidas[pila["id"]] = elegidas.get(pila["id"], 0) + cantidad
+            cuenta = pila.get("Cuenta") or "(ninguna)"
+            if cuenta in ocupadas:
+                ocupadas[cuenta] += cantidad
+            restantes -= cantidad
+
+    # Cada cuenta se queda con las elegidas que le caben; el resto se mueve.
+    por_id = {b["id"]: b for b in brainrots}
+    libres = dict(capacidad)
+    pendientes = []
+    for pila in sorted((por_id[i] for i in elegidas), key=lambda b: b.get("Total", 0), reverse=True):
+        cuenta = pila.get("Cuenta") or "(ninguna)"
+        quedan = min(elegidas[pila["id"]], libres.get(cuenta, 0))
+        if quedan:
+            libres[cuenta] -= quedan
+        if elegidas[pila["id"]] > quedan:
+            pendientes.append((pila, elegidas[pila["id"]] - quedan))
+
+    movimientos = []
+    destinos = [cuenta for cuenta in capacidad if libres[cuenta] > 0]
+    for pila, cantidad in pendientes:
+        while cantidad:
+            destino = destinos[0]
+            n = min(cantidad, libres[destino])
+            movimientos.append((pila, n, destino))
+            libres[destino] -= n
+            cantidad -= n
+            if not libres[destino]:
+                destinos.pop(0)
+
+    ingreso = sum(por_id[i].get("Total", 0) * n for i, n in elegidas.items())
+    return movimientos, ingreso
 
-    # ============================
-    # 👤 GESTIÓN DE PERFILES
-    # ============================
-    with pestañas[0]:
-        with st.container(border=True):
-            st.subheader("👤 Gestión de Perfiles")
-            
-            perfil_actual = None
-            uid = st.session_state["user"]["uid"]
-            perfiles = list_profiles(uid)
+# ============================
+# SIMULADOR DE MEJORAS
+# ============================
 
-            if perfiles:
-                perfil_actual = st.selectbox("Selecciona un perfil", ["(ninguno)"] + perfiles)
-            else:
-                st.info("No tienes perfiles creados todavía.")
+# calcular_total suma al ingreso base un bono (multiplicador - 1) por el color y
+# por cada mutación, así que la ganancia de una mejora es base * diferencia de
+# bonos. Se calcula para todas las pilas y todas las mejoras a la vez con una
+# matriz pilas x mejoras.
 
-            nuevo_perfil = st.text_input("Nombre de nuevo perfil")
-            if st.button("➕ Crear perfil"):
-                if nuevo_perfil:
-                    create_profile(uid, nuevo_perfil)
-                    st.success(f"Perfil '{nuevo_perfil}' creado.")
-                    st.rerun()
+def upgrade_candidates():
+    """Mejoras posibles: ``[(nombre, tipo, bono)]`` con tipo "Mutación" o "Color"."""
+    catalogo = current_catalog()
+    mutaciones = [(m, "Mutación", max(b - 1, 0)) for m, b in catalogo["mutaciones"].items()]
+    colores = [(c, "Color", max(b - 1, 0)) for c, b in catalogo["colores"].items() if c != "-"]
+    return mutaciones + colores
 
-            if perfil_actual and perfil_actual != "(ninguno)":
-                if st.button(f"🗑️ Borrar perfil '{perfil_actual}'"):
-                    st.session_state["confirm_delete_profile"] = perfil_actual
-
-                if "confirm_delete_profile" in st.session_state:
-                    perfil_to_delete = st.session_state["confirm_delete_profile"]
-                    confirmed = confirm_deletion(
-                        "confirm_delete_profile",
-                        f"⚠️ ¿Seguro que deseas borrar el perfil '{perfil_to_delete}'? Esta acción no se puede deshacer.",
-                    )
-                    if confirmed:
-                        delete_profile(uid, perfil_to_delete)
-                        st.success(f"Perfil '{perfil_to_delete}' borrado.")
-                        st.rerun()
 
-    # ============================
-    # INVENTARIO DE BRAINROTS
-    # ============================
-    with pestañas[1]:
-         if "user" in st.session_state and st.session_state["user"]:
-            if perfil_actual and perfil_actual != "(ninguno)":
-                brainrots, cuentas = load_data(uid, perfil_actual)
-
-                st.subheader(f"📦 Inventario — Perfil: {perfil_actual}")
-
-                    # ----------------------------
-                    # Gestión de cuentas
-                    # ----------------------------
-                with st.container(border=True):
-                    st.markdown("### 🏷️ Gestión de cuentas")
-                    nueva_cuenta = st.text_input("Nombre de nueva cuenta")
-                    if st.button("➕ Agregar cuenta"):
-                        if nueva_cuenta and nueva_cuenta not in cuentas:
-                            cuentas.append(nueva_cuenta)
-                            save_data(uid, perfil_actual, brainrots, cuentas)
-                            st.success(f"Cuenta '{nueva_cuenta}' añadida.")
-                            st.rerun()
+def simulate_upgrades(brainrots, mejoras=None, k=10):
+    """Devuelve las ``k`` mejores ``(brainrot, mejora, tipo, ganancia_por_copia)`` ordenadas por ganancia.
 
-                    if cuentas:
-                        cuenta_borrar = st.selectbox("Selecciona una cuenta para borrar", ["(ninguna)"] + cuentas)
-                        if st.button("🗑️ Borrar cuenta") and cuenta_borrar != "(ninguna)":
-                            st.session_state["confirm_delete_account"] = cuenta_borrar
-
-                        if "confirm_delete_account" in st.session_state:
-                            cuenta_to_delete = st.session_state["confirm_delete_account"]
-                            confirmed_account = confirm_deletion(
-                                "confirm_delete_account",
-                                f"⚠️ ¿Seguro que deseas borrar la cuenta '{cuenta_to_delete}'? Los brainrots asociados quedarán sin cuenta.",
-                            )
-                            if confirmed_account:
-                                cuentas = [c for c in cuentas if c != confirmed_account]
-                                for b in brainrots:
-                                    if b["Cuenta"] == confirmed_account:
-                                        b["Cuenta"] = "(ninguna)"
-                                save_data(uid, perfil_actual, brainrots, cuentas)
-                                st.success(f"Cuenta '{confirmed_account}' borrada.")
-                                st.rerun()
-
-                    # ----------------------------
-                    # Agregar Brainrot
-                    # ----------------------------
-                with st.container(border=True):
-                    st.markdown("### ➕ Agregar Brainrot")
-
-                    
-                    BRAINROT_BASES = {
-                        "Noobini Pizzanini": 1,
-    "Lirilì Larilà": 3,
-    "Tim Cheese": 5,
-    "Fluriflura": 7,
-    "Talpa Di Fero": 9,
-    "Svinina Bombardino": 10,
-    "Raccooni Jandelini": 12,
-    "Pipi Kiwi": 13,
-    "Pipi Corni": 14,
-    "Trippi Troppi": 15,
-    "Gangster Footera": 30,
-    "Bandito Bobritto": 35,
-    "Boneca Ambalabu": 40,
-    "Cacto Hipopotamo": 50,
-    "Ta Ta Ta Ta Sahur": 55,
-    "Tric-Trac-Baraboom": 65,
-    "Pipi Avocado": 70,
-    "Cappuccino Assassino": 75,
-    "Bandito Axolito": 90,
-    "Brr Brr Patapim": 100,
-    "Avocadini Antilopini": 115,
-    "Bambini Crostini": 120,
-    "Trulimero Trulicina": 125,
-    "Malame Amarele": 140,
-    "Bananita Dolphinita": 150,
-    "Perochello Lemonchello": 160,
-    "Brri Brri Bicus Dicus Bombicus": 175,
-    "Burbaloni Loliloli": 200,
-    "Ti Ti Ti Sahur": 225,
-    "Avocadini Guffo": 225,
-    "Mangolini Parrocini": 235,
-    "Salamino Penguino": 250,
-    "Penguino Cocosino": 300,
-    "Chimpanzini Bananini": 300,
-    "Tirilikalika Tirilikalako": 450,
-    "Ballerina Cappuccina": 500,
-    "Chef Crabracadabra": 600,
-    "Lionel Cactuseli": 650,
-    "Glorbo Fruttodrillo": 750,
-    "Quivioli Ameleonni": 900,
-    "Blueberrinni Octopusini": 1000,
-    "Caramello Filtrello": 1000,
-    "Pipi Potato": 1100,
-    "Strawberelli Flamingelli": 1100,
-    "Cocosini Mama": 1200,
-    "Pandaccini Bananini": 1200,
-    "Pi Pi Watermelon": 1300,
-    "Signore Carapace": 1300,
-    "Sigma Boy": 1300,
-    "Frigo Camelo": 1400,
-    "Sigma Girl": 1800,
-    "Orangutini Ananassini": 2000,
-    "Rhino Toasterino": 2100,
-    "Bombardiro Crocodilo": 2500,
-    "Bruto Gialutto": 3000,
-    "Spioniro Golubiro": 3500,
-    "Bombombini Gusini": 5000,
-    "Zibra Zubra Zibralini": 6000,
-    "Tigrilini Watermelini": 6500,
-    "Avocadorilla": 7000,
-    "Cavallo Virtuoso": 7500,
-    "Gorillo Subwoofero": 7700,
-    "Gorillo Watermelondrillo": 8000,
-    "Tob Tobi Tobi": 8500,
-    "Lerulerulerule": 8700,
-    "Ganganzelli Trulala": 9000,
-    "Te Te Te Sahur": 9500,
-    "Rhino Helicopterino": 11000,
-    "Tracoducotulu Delapeladustuz": 12000,
-    "Los Noobinis": 12500,
-    "Carloo": 13500,
-    "Carrotini Brainini": 15000,
-    "Elefanto Frigo": 14000,
-    "Cocofanto Elefanto": 17500,
-    "Antonio": 18500,
-    "Girafa Celestre": 20000,
-    "Gattatino Nyanino": 35000,
-    "Chihuanini Taconini": 45000,
-    "Tralalero Tralala": 50000,
-    "Matteo": 50000,
-    "Los Crocodillitos": 55000,
-    "Tigroligre Frutonni": 60000,
-    "Espresso Signora": 70000,
-    "Uncilto Samito": 75000,
-    "Tipi Topi Taco": 75000,
-    "Odin Din Din Dun": 75000,
-    "Alessio": 85000,
-    "Tukanno Bananno": 100000,
-    "Orcalero Orcala": 100000,
-    "Tralalita Tralala": 100000,
-    "Extinct Ballerina": 125000,
-    "Urubini Flamenguini": 150000,
-    "Capi Taco": 155000,
-    "Gattito Tacoto": 160000,
-    "Trenostruzzo Turbo 3000": 150000,
-    "Trippi Troppi Troppa Trippa": 175000,
-    "Las Cappuchinas": 185000,
-    "Ballerino Lololo": 200000,
-    "Bulbito Bandito Traktorito": 205000,
-    "Los Bombinitos": 220000,
-    "Los Tungtungtungcitos": 210000,
-    "Pakrahmatmamat": 215000,
-    "Piccione Macchina": 225000,
-    "Brr es Teh Patipum": 225000,
-    "Bombardini Tortini": 225000,
-    "Tractoro Dinosauro": 230000,
-    "Los Orcalitos": 235000,
-    "Crabbo Limonetta": 235000,
-    "Orcalita Orcala": 240000,
-    "Cacasito Satalito": 240000,
-    "Tartaruga Cisterna": 250000,
-    "Los Tipi Tacos": 260000,
-    "Dug dug dug": 255000,
-    "Piccionetta Machina": 270000,
-    "Mastodontico Telepiedone": 275000,
-    "Anpali Babel": 280000,
-    "Belula Beluga": 290000,
-    "Bisonte Giuppitere": 300000,
-    "Los Matteos": 300000,
-    "Karkerkar Kurkur": 300000,
-    "La Vacca Saturno Saturnita": 300000,
-    "Trenostruzzo Turbo 4000": 310000,
-    "Torrtuginni Dragonfrutini": 350000,
-    "Sammyini Spyderini": 325000,
-    "Dul Dul Dul": 375000,
-    "Blackhole Goat": 400000,
-    "Chachechi": 400000,
-    "Agarrini La Palini": 425000,
-    "Fragola La La La": 450000,
-    "Extinct Tralalero": 450000,
-    "La Cucaracha": 475000,
-    "Los Tralaleritos": 500000,
-    "Los Spyderinis": 550000,
-    "Guerriro Digitale": 550000,
-    "La Karkerkar Combinasion": 600000,
-    "Extinct Matteo": 625000,
-    "Las Tralaleritas": 650000,
-    "Job Job Job Sahur": 700000,
-    "Las Vaquitas Saturnitas": 750000,
-    "Graipuss Medussi": 1000000,
-    "Nooo My Hotspot": 1500000,
-    "To to to Sahur": 2200000,
-    "La Sahur Combinasion": 2000000,
-    "Pot Hotspot": 2500000,
-    "Quesadilla Crocodila": 3000000,
-    "La Extinct Grande": 3250000,
-    "Chicleteira Bicicleteira": 3500000,
-    "Los Nooo My Hotspotsitos": 5500000,
-    "Los Chicleteiras": 7000000,
-    "67": 7500000,
-    "La Grande Combinasion": 10000000,
-    "Mariachi Corazoni": 12500000,
-    "Los Combinasionas": 15000000,
-    "Nuclearo Dinossauro": 15000000,
-    "Tacorita Bicicleta": 16500000,
-    "Las Sis": 17500000,
-    "Los Hotspotsitos": 20000000,
-    "Celularcini Viciosini": 22500000,
-    "Los Bros": 24000000,
-    "Tralaledon": 27500000,
-    "Esok Sekolah": 30000000,
-    "Los Tacoritas": 32000000,
-    "Ketupat Kepat": 35000000,
-    "Tictac Sahur": 37500000,
-    "La Supreme Combinasion": 40000000,
-    "Ketchuru and Musturu": 42500000,
-    "Garama and Madundung": 50000000,
-    "Spaghetti Tualetti": 60000000,
-    "Dragon Cannelloni": 100000000,
-    "Strawberry Elephant": 300000000,
-}
-    
-
-                    BRAINROT_RARITIES = {
-                        "Noobini Pizzanini": "Común",
-                        "Lirilì Larilà": "Común",
-                        "Tim Cheese": "Común",
-                        "Fluriflura": "Común",
-                        "Talpa Di Fero": "Común",
-                        "Svinina Bombardino": "Común",
-                        "Raccooni Jandelini": "Común",
-                        "Pipi Kiwi": "Común",
-                        "Pipi Corni": "Común",
-                        "Trippi Troppi": "Raro",
-                        "Gangster Footera": "Raro",
-                        "Bandito Bobritto": "Raro",
-                        "Boneca Ambalabu": "Raro",
-                        "Cacto Hipopotamo": "Raro",
-                        "Ta Ta Ta Ta Sahur": "Raro",
-                        "Tric-Trac-Baraboom": "Raro",
-                        "Pipi Avocado": "Raro",
-                        "Cappuccino Assassino": "Épico",
-                        "Bandito Axolito": "Épico",
-                        "Brr Brr Patapim": "Épico",
-                        "Avocadini Antilopini": "Épico",
-                        "Bambini Crostini": "Épico",
-                        "Trulimero Trulicina": "Épico",
-                        "Malame Amarele": "Épico",
-                        "Bananita Dolphinita": "Épico",
-                        "Perochello Lemonchello": "Épico",
-                        "Brri Brri Bicus Dicus Bombicus": "Épico",
-                        "Burbaloni Loliloli": "Legendario",
-                        "Ti Ti Ti Sahur": "Épico",
-                        "Avocadini Guffo": "Épico",
-                        "Mangolini Parrocini": "Épico",
-                        "Salamino Penguino": "Épico",
-                        "Penguino Cocosino": "Épico",
-                        "Chimpanzini Bananini": "Legendario",
-                        "Tirilikalika Tirilikalako": "Legendario",
-                        "Ballerina Cappuccina": "Legendario",
-                        "Chef Crabracadabra": "Legendario",
-                        "Lionel Cactuseli": "Legendario",
-                        "Glorbo Fruttodrillo": "Legendario",
-                        "Quivioli Ameleonni": "Legendario",
-                        "Blueberrinni Octopusini": "Legendario",
-                        "Caramello Filtrello": "Legendario",
-                        "Pipi Potato": "Legendario",
-                        "Strawberelli Flamingelli": "Legendario",
-                        "Cocosini Mama": "Legendario",
-                        "Pandaccini Bananini": "Legendario",
-                        "Pi Pi Watermelon": "Legendario",
-                        "Signore Carapace": "Legendario",
-                        "Sigma Boy": "Legendario",
-                        "Frigo Camelo": "Mítico",
-                        "Sigma Girl": "Mítico",
-                        "Orangutini Ananassini": "Mítico",
-                        "Rhino Toasterino": "Mítico",
-                        "Bombardiro Crocodilo": "Mítico",
-                        "Bruto Gialutto": "Mítico",
-                        "Spioniro Golubiro": "Mítico",
-                        "Bombombini Gusini": "Mítico",
-                        "Zibra Zubra Zibralini": "Mítico",
-                        "Tigrilini Watermelini": "Mítico",
-                        "Avocadorilla": "Mítico",
-                        "Cavallo Virtuoso": "Mítico",
-                        "Gorillo Subwoofero": "Mítico",
-                        "Gorillo Watermelondrillo": "Mítico",
-                        "Tob Tobi Tobi": "Mítico",
-                        "Lerulerulerule": "Mítico",
-                        "Ganganzelli Trulala": "Mítico",
-                        "Te Te Te Sahur": "Mítico",
-                        "Rhino Helicopterino": "Mítico",
-                        "Tracoducotulu Delapeladustuz": "Mítico",
-                        "Los Noobinis": "Mítico",
-                        "Carloo": "Mítico",
-                        "Carrotini Brainini": "Mítico",
-                        "Elefanto Frigo": "Mítico",
-                        "Cocofanto Elefanto": "Brainrot God",
-                        "Antonio": "Brainrot God",
-                        "Girafa Celestre": "Brainrot God",
-                        "Gattatino Nyanino": "Brainrot God",
-                        "Chihuanini Taconini": "Brainrot God",
-                        "Tralalero Tralala": "Brainrot God",
-                        "Matteo": "Brainrot God",
-                        "Los Crocodillitos": "Brainrot God",
-                        "Tigroligre Frutonni": "Brainrot God",
-                        "Espresso Signora": "Brainrot God",
-                        "Uncilto Samito": "Brainrot God",
-                        "Tipi Topi Taco": "Brainrot God",
-                        "Odin Din Din Dun": "Brainrot God",
-                        "Alessio": "Brainrot God",
-                        "Tukanno Bananno": "Brainrot God",
-                        "Orcalero Orcala": "Brainrot God",
-                        "Tralalita Tralala": "Brainrot God",
-                        "Extinct Ballerina": "Brainrot God",
-                        "Urubini Flamenguini": "Brainrot God",
-                        "Capi Taco": "Brainrot God",
-                        "Gattito Tacoto": "Brainrot God",
-                        "Trenostruzzo Turbo 3000": "Brainrot God",
-                        "Trippi Troppi Troppa Trippa": "Brainrot God",
-                        "Las Cappuchinas": "Brainrot God",
-                        "Ballerino Lololo": "Brainrot God",
-                        "Bulbito Bandito Traktorito": "Brainrot God",
-                        "Los Bombinitos": "Brainrot God",
-                        "Los Tungtungtungcitos": "Brainrot God",
-                        "Pakrahmatmamat": "Brainrot God",
-                        "Piccione Macchina": "Brainrot God",
-                        "Brr es Teh Patipum": "Brainrot God",
-                        "Bombardini Tortini": "Brainrot God",
-                        "Tractoro Dinosauro": "Brainrot God",
-                        "Los Orcalitos": "Brainrot God",
-                        "Crabbo Limonetta": "Brainrot God",
-                        "Orcalita Orcala": "Brainrot God",
-                        "Cacasito Satalito": "Brainrot God",
-                        "Tartaruga Cisterna": "Brainrot God",
-                        "Los Tipi Tacos": "Brainrot God",
-                        "Dug dug dug": "Brainrot God",
-                        "Piccionetta Machina": "Brainrot God",
-                        "Mastodontico Telepiedone": "Brainrot God",
-                        "Anpali Babel": "Brainrot God",
-                        "Belula Beluga": "Brainrot God",
-                        "Bisonte Giuppitere": "Secreto",
-                        "Los Matteos": "Secreto",
-                        "Karkerkar Kurkur": "Secreto",
-                        "La Vacca Saturno Saturnita": "Secreto",
-                        "Trenostruzzo Turbo 4000": "Secreto",
-                        "Torrtuginni Dragonfrutini": "Secreto",
-                        "Sammyini Spyderini": "Secreto",
-                        "Dul Dul Dul": "Secreto",
-                        "Blackhole Goat": "Secreto",
-                        "Chachechi": "Secreto",
-                        "Agarrini La Palini": "Secreto",
-                        "Fragola La La La": "Secreto",
-                        "Extinct Tralalero": "Secreto",
-                        "La Cucaracha": "Secreto",
-                        "Los Tralaleritos": "Secreto",
-                        "La Karkerkar Combinasion": "Secreto",
-                        "Extinct Matteo": "Secreto",
-                        "Los Spyderinis": "Secreto",
-                        "Guerriro Digitale": "Secreto",
-                        "Las Tralaleritas": "Secreto",
-                        "Job Job Job Sahur": "Secreto",
-                        "Las Vaquitas Saturnitas": "Secreto",
-                        "Graipuss Medussi": "Secreto",
-                        "Nooo My Hotspot": "Secreto",
-                        "To to to Sahur": "Secreto",
-                        "La Sahur Combinasion": "Secreto",
-                        "Pot Hotspot": "Secreto",
-                        "Quesadilla Crocodila": "Secreto",
-                        "La Extinct Grande": "Secreto",
-                        "Chicleteira Bicicleteira": "Secreto",
-                        "Los Nooo My Hotspotsitos": "Secreto",
-                        "Los Chicleteiras": "Secreto",
-                        "67": "Secreto",
-                        "La Grande Combinasion": "Secreto",
-                        "Mariachi Corazoni": "Secreto",
-                        "Los Combinasionas": "Secreto",
-                        "Nuclearo Dinossauro": "Secreto",
-                        "Tacorita Bicicleta": "Secreto",
-                        "Las Sis": "Secreto",
-                        "Los Hotspotsitos": "Secreto",
-                        "Celularcini Viciosini": "Secreto",
-                        "Los Bros": "Secreto",
-                        "Tralaledon": "Secreto",
-                        "Esok Sekolah": "Secreto",
-                        "Los Tacoritas": "Secreto",
-                        "Ketupat Kepat": "Secreto",
-                        "Tictac Sahur": "Secreto",
-                        "La Supreme Combinasion": "Secreto",
-                        "Ketchuru and Musturu": "Secreto",
-                        "Garama and Madundung": "Secreto",
-                        "Spaghetti Tualetti": "Secreto",
-                        "Dragon Cannelloni": "Secreto",
-                        "Strawberry Elephant": "OG",
-                    }
+    ``mejoras`` limita los nombres de mejora a considerar (por defecto todas).
+    Añadir una mutación que ya tiene o un color que no sube el bono no cuenta.
+    """
+    candidatas = [c for c in upgrade_candidates() if mejoras is None or c[0] in mejoras]
+    if not brainrots or not candidatas:
+        return []
+    bonos = np.array([bono for _, _, bono in candidatas])
+    es_color = np.array([tipo == "Color" for _, tipo, _ in candidatas])
+    columna = {nombre: j for j, (nombre, _, _) in enumerate(candidatas)}
+
+    catalogo = current_catalog()
+    n = len(brainrots)
+    bono_color = np.zeros(n)
+    factor = np.ones(n)
+    tiene = np.zeros((n, len(candidatas)), dtype=bool)
+    for i, brainrot in enumerate(brainrots):
+        bono_color[i] = max(catalogo["colores"].get(brainrot.get("Color") or "-", 1) - 1, 0)
+        factor[i] += bono_color[i]
+        for mutacion in brainrot.get("Mutaciones") or []:
+            factor[i] += max(catalogo["mutaciones"].get(mutacion, 1) - 1, 0)
+            if mutacion in columna:
+                tiene[i, columna[mutacion]] = True
+    totales = np.array([float(b.get("Total", 0)) for b in brainrots])
+    base = totales / factor
+
+    ganancia = np.where(es_color, bonos - bono_color[:, None], bonos) * base[:, None]
+    ganancia[tiene | (ganancia <= 0)] = 0
+    plano = ganancia.ravel()
+    k = min(k, int(np.count_nonzero(plano)))
+    if k <= 0:
+        return []
+    mejores = np.argpartition(plano, -k)[-k:]
+    mejores = mejores[np.argsort(plano[mejores])[::-1]]
+    resultado = []
+    for indice in mejores:
+        i, j = divmod(int(indice), len(candidatas))
+        nombre, tipo, _ = candidatas[j]
+        resultado.append((brainrots[i], nombre, tipo, float(plano[indice])))
+    return resultado
 
-                    BRAINROTS = {
-                        nombre: {
-                            "income": base,
-                            "quality": BRAINROT_RARITIES.get(nombre, "Común"),
-                        }
-                        for nombre, base in BRAINROT_BASES.items()
-                    }
+# ============================
+# CATÁLOGO DE BRAINROTS
+# ============================
 
-                    faltantes_calidad = False
-                    for brainrot in brainrots:
-                        if "Calidad" not in brainrot:
-                            info = BRAINROTS.get(brainrot.get("Brainrot"))
-                            brainrot["Calidad"] = info["quality"] if info else "Común"
-                            faltantes_calidad = True
-
-                    if faltantes_calidad:
-                        save_data(uid, perfil_actual, brainrots, cuentas)
-                        
-
-                    COLORES = {
-    "-": 0,
-    "🟡 Dorado": 1.25,
-    "💎 Diamante": 1.5,
-    "🩸 Luna Roja": 2,
-    "🍬 Candy": 4,
-    "🌋 Lava": 6,
-    "🌌 Galaxy": 7,
-    "🌈 Rainbow": 10
-}
+# El catálogo vive en catalogo.json (o en BRAINROT_CATALOGO) y, opcionalmente,
+# en el documento configuracion/catalogo de Firestore con el mismo formato; se
+# usa la versión más alta. Se revisa como mucho cada CATALOGO_REVISION segundos
+# y la versión nueva se reemplaza de una vez para todo el proceso; cada rerun
+# toma la vigente sin volver a leerla.
+#
+# Los ids de catálogo se guardan en Firestore (ver encode_inventory), así que
+# una versión nueva puede cambiar ingresos y calidades o agregar entradas con
+# ids nuevos, pero no quitar ni renombrar ids existentes.
+CATALOGO_ARCHIVO = os.environ.get(
+    "BRAINROT_CATALOGO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalogo.json")
+)
+CATALOGO_REVISION = 30
+
+
+def parse_catalog(data):
+    """Construye las tablas del catálogo a partir de su JSON; lanza ValueError si no es válido."""
+    def por_id(entradas, campo, limite):
+        nombres = {}
+        for entrada in entradas:
+            i = int(entrada[campo])
+            if not 0 <= i < limite or i in nombres or entrada["nombre"] in nombres.values():
+                raise ValueError(f"Catálogo: {campo} {i} ('{entrada['nombre']}') repetido o fuera de rango.")
+            nombres[i] = entrada["nombre"]
+        return [nombres.get(i) for i in range(max(nombres, default=-1) + 1)]
+
+    brainrots = por_id(data["brainrots"], "id", 1 << 16)
+    colores = por_id(data["colores"], "id", 1 << 8)
+    mutaciones = por_id(data["mutaciones"], "bit", 64)
+    return {
+        "version": int(data["version"]),
+        "brainrots": {
+            b["nombre"]: {"income": b["ingreso"], "quality": b.get("calidad", "Común")} for b in data["brainrots"]
+        },
+        "colores": {c["nombre"]: c["multiplicador"] for c in sorted(data["colores"], key=lambda c: c["id"])},
+        "mutaciones": {m["nombre"]: m["multiplicador"] for m in sorted(data["mutaciones"], key=lambda m: m["bit"])},
+        "brainrot_nombres": brainrots,
+        "color_nombres": colores,
+        "mutacion_nombres": mutaciones,
+        "brainrot_ids": {nombre: i for i, nombre in enumerate(brainrots) if nombre is not None},
+        "color_ids": {nombre: i for i, nombre in enumerate(colores) if nombre is not None},
+        "mutacion_bits": {nombre: i for i, nombre in enumerate(mutaciones) if nombre is not None},
+    }
 
-                    MUTACIONES = {
-    "🌧️ Lluvia": 1.5,
-    "❄️ Nieve": 2,
-    "🌮 Taco": 3,
-    "🛸 Alien": 3,
-    "✨ Lluvia de Estrellas": 3.5,
-    "🦈 Aleta": 4,
-    "🪐 Galáctico": 4,
-    "🍬 Chicle": 4,
-    "💣 Bombardiro": 4,
-    "🔟 10B": 4,
-    "☠️ Extinto": 4,
-    "🎩 Sombrero (Matteo)": 4.5,
-    "🕷️ Araña (Spyderini)": 4.5,
-    "🥁 Ataque Tung Tung": 5,
-    "🦀 Cangrejo": 5,
-    "🌐 Glitch": 5,
-    "🎶 Concierto": 5,
-    "🌯🤠 Sombrero Mexico": 5,
-    "🇧🇷 Brasil": 5,
-    "🚲🍭 Chicletera": 6,
-    "🔥 Fuego": 6,
-    "🐱 Nyan Cat": 6,
-    "🎆 4 de Julio": 6,
-    "⚡🐲 Dragón Rayo": 6,
-    "🍓 Fresa": 8,
-}
 
+def check_catalog_upgrade(actual, nuevo):
+    """Comprueba que ``nuevo`` conserva todos los ids de ``actual`` con el mismo nombre."""
+    for tabla in ("brainrot_nombres", "color_nombres", "mutacion_nombres"):
+        for i, nombre in enumerate(actual[tabla]):
+            if nombre is not None and (i >= len(nuevo[tabla]) or nuevo[tabla][i] != nombre):
+                raise ValueError(f"Catálogo v{nuevo['version']}: no conserva '{nombre}' (id {i}).")
+
+
+@st.cache_resource
+def _catalog_store():
+    """Catálogo vigente compartido por todas las sesiones del proceso."""
+    return {"lock": threading.Lock(), "catalogo": None, "mtime": None, "revisado": 0.0, "error": None}
+
+
+def _catalog_from_file(store):
+    """JSON del archivo si cambió desde la última revisión."""
+    mtime = os.path.getmtime(CATALOGO_ARCHIVO)
+    if mtime == store["mtime"]:
+        return None
+    with open(CATALOGO_ARCHIVO, encoding="utf-8") as f:
+        data = json.load(f)
+    store["mtime"] = mtime
+    return data
+
+
+def _catalog_from_firestore(store):
+    """JSON del documento de Firestore si tiene una versión más alta que la vigente."""
+    ref = db.collection("configuracion").document("catalogo")
+    actual = store["catalogo"]["version"] if store["catalogo"] else -1
+    version = ref.get(field_paths=["version"])
+    if not version.exists or (version.to_dict() or {}).get("version", -1) <= actual:
+        return None
+    return ref.get().to_dict()
+
+
+def current_catalog():
+    """Devuelve el catálogo vigente, cargando una versión nueva si apareció."""
+    store = _catalog_store()
+    if store["catalogo"] is not None and time.time() - store["revisado"] < CATALOGO_REVISION:
+        return store["catalogo"]
+    with store["lock"]:
+        if store["catalogo"] is not None and time.time() - store["revisado"] < CATALOGO_REVISION:
+            return store["catalogo"]
+        store["revisado"] = time.time()
+        store["error"] = None
+        for fuente in (_catalog_from_file, _catalog_from_firestore):
+            try:
+                data = fuente(store)
+                if data is None:
+                    continue
+                nuevo = parse_catalog(data)
+                actual = store["catalogo"]
+                if actual is None or nuevo["version"] > actual["version"]:
+                    if actual is not None:
+                        check_catalog_upgrade(actual, nuevo)
+                    store["catalogo"] = nuevo
+            except Exception as e:
+                store["error"] = f"{fuente.__name__}: {e}"
+        if store["catalogo"] is None:
+            raise RuntimeError(f"No se pudo cargar el catálogo de Brainrots ({store['error']}).")
+        return store["catalogo"]
+
+
+# Copias del catálogo para la interfaz de este rerun. Lo que puede correr
+# fuera del rerun que lo definió (la API, los hilos de escritura, las cachés
+# del proceso) llama a current_catalog() en el momento de usarlo.
+CATALOGO = current_catalog()
+BRAINROTS = CATALOGO["brainrots"]
+COLORES = CATALOGO["colores"]
+MUTACIONES = CATALOGO["mutaciones"]
+
+
+def fill_qualities(brainrots):
+    """Completa la Calidad que falte según el catálogo; devuelve si cambió algo."""
+    cambios = False
+    catalogo = current_catalog()
+    for brainrot in brainrots:
+        if "Calidad" not in brainrot:
+            info = catalogo["brainrots"].get(brainrot.get("Brainrot"))
+            brainrot["Calidad"] = info["quality"] if info else "Común"
+            cambios = True
+    return cambios
+
+
+def recompute_totals(brainrots):
+    """Recalcula el Total de cada pila con el ingreso y multiplicadores del catálogo vigente.
+
+    Las pilas de Brainrots que ya no están en el catálogo se dejan igual.
+    Devuelve si cambió algo.
+    """
+    cambios = False
+    catalogo = current_catalog()
+    for brainrot in brainrots:
+        info = catalogo["brainrots"].get(brainrot.get("Brainrot"))
+        if info is None:
+            continue
+        total = calcular_total(
+            info["income"],
+            catalogo["colores"].get(brainrot.get("Color") or "-", 1),
+            [catalogo["mutaciones"].get(m, 1) for m in brainrot.get("Mutaciones") or []],
+        )
+        if total != brainrot.get("Total"):
+            brainrot["Total"] = total
+            cambios = True
+    return cambios
 
-                    opciones_personajes = ["(ninguno)"] + [
-                       make_searchable_option(
-                            f"{nombre} — {format_num(data['income'])}",
-                            nombre,
-                            data.get("quality"),
-                        )
-                        for nombre, data in BRAINROTS.items()
-                    ]
-
-                    personaje_opcion = st.selectbox(
-                        "Selecciona un Brainrot",
-                        opciones_personajes,
-                        key=f"seleccion_brainrot_{perfil_actual}",
-                        format_func=option_display,
-                    )
-
-                    personaje = option_display(personaje_opcion)
-                    color = st.selectbox("Color", list(COLORES.keys()))
-                    mutaciones = st.multiselect("Mutaciones", list(MUTACIONES.keys()))
-                    cuenta_sel = st.selectbox("Cuenta", ["(ninguna)"] + cuentas)
-
-                    total_preview = None
-                    nombre_seleccionado = None
-                    datos_brainrot = None
-                    if personaje != "(ninguno)":
-                        nombre_seleccionado = personaje.split(" — ")[0]
-                        datos_brainrot = BRAINROTS[nombre_seleccionado]
-                        base = datos_brainrot["income"]
-                        total_preview = calcular_total(
-                            base,
-                            COLORES[color],
-                            [MUTACIONES[m] for m in mutaciones],
-                        )
-                        st.info(f"Total: {format_num(total_preview)}")
-                    else:
-                        st.info("Selecciona un Brainrot para ver la vista previa del total.")
-
-                    if st.button("Agregar") and nombre_seleccionado:
-                        brainrots.append({
-                            "id": str(uuid.uuid4()),  # ID invisible
-                            "Brainrot": nombre_seleccionado,
-                            "Calidad": datos_brainrot["quality"],
-                            "Color": color,
-                            "Mutaciones": mutaciones,
-                            "Cuenta": cuenta_sel,
-                            "Total": total_preview
-                        })
-                        save_data(uid, perfil_actual, brainrots, cuentas)
-                        st.success(
-                            f"Brainrot '{nombre_seleccionado}' [{datos_brainrot['quality']}] agregado con total {format_num(total_preview)}."
-                        )
-                        st.rerun()
 
-                    if brainrots:
-                        df = pd.DataFrame(brainrots)
+# ============================
+# LÍMITES DE FRECUENCIA
+# ============================
 
-                        filtros = get_inventory_filters(perfil_actual)
+# Cubetas de fichas por proceso: cada clave (IP del cliente para la
+# autenticación y la API, correo intentado para la autenticación, uid para las
+# escrituras) tiene ``capacidad`` fichas que se recargan a ``recarga``
+# por segundo, y una petición sin ficha se rechaza sin tocar la red. Con
+# [limites] compartido = true en secrets además se cuenta cada clave en la
+# caché compartida por ventanas de ``capacidad / recarga`` segundos, para que
+# repartir las peticiones entre procesos no multiplique el límite.
+LIMITES = {
+    "auth": {"capacidad": 5, "recarga": 5 / 60},
+    "auth_correo": {"capacidad": 5, "recarga": 5 / 60},
+    "escritura": {"capacidad": 30, "recarga": 2.0},
+    "api": {"capacidad": 60, "recarga": 1.0},
+}
+LIMITES_MAX_CLAVES = 10_000
 
-                        opciones_orden = ["Total ↓", "Total ↑", "Cuenta", "Brainrot", "Cuenta + Total ↓"]
-                        orden_key = f"orden_{perfil_actual}"
-                        valor_orden_inicial = filtros.get("orden", "Total ↓")
-                        if orden_key not in st.session_state:
-                            st.session_state[orden_key] = valor_orden_inicial
-                        if st.session_state[orden_key] not in opciones_orden:
-                            st.session_state[orden_key] = opciones_orden[0]
 
-                        orden = st.selectbox(
-                            "Ordenar por",
-                            opciones_orden,
-                            key=orden_key
-                        )
-                        filtros["orden"] = orden
-
-                        cuentas_filtro = ["Todas"] + sorted(df["Cuenta"].unique().tolist())
-                        cuenta_key = f"cuenta_filtro_{perfil_actual}"
-                        valor_cuenta_inicial = filtros.get("cuenta", "Todas")
-                        if cuenta_key not in st.session_state:
-                            st.session_state[cuenta_key] = valor_cuenta_inicial
-                        if st.session_state[cuenta_key] not in cuentas_filtro:
-                            st.session_state[cuenta_key] = "Todas"
-
-                        cuenta_filtro = st.selectbox(
-                            "Filtrar por Cuenta",
-                            cuentas_filtro,
-                            key=cuenta_key
-                        )
-                        filtros["cuenta"] = cuenta_filtro
-
-                        if cuenta_filtro != "Todas":
-                            df = df[df["Cuenta"] == cuenta_filtro]
-
-                        if orden == "Total ↓":
-                            df = df.sort_values(by="Total", ascending=False)
-                        elif orden == "Total ↑":
-                            df = df.sort_values(by="Total", ascending=True)
-                        elif orden == "Cuenta":
-                            df = df.sort_values(by="Cuenta")
-                        elif orden == "Brainrot":
-                            df = df.sort_values(by="Brainrot")
-                        elif orden == "Cuenta + Total ↓":
-                            df = df.sort_values(by=["Cuenta", "Total"], ascending=[True, False])
-                            
-                        df["Total"] = df["Total"].apply(format_num)
-                        df = df.drop(columns=["id"], errors="ignore")
-                        if "Calidad" not in df.columns:
-                            df["Calidad"] = df["Brainrot"].map(
-                                lambda nombre: BRAINROTS.get(nombre, {}).get("quality", "Common")
-                            )
-
-                        df["Mutaciones"] = df["Mutaciones"].apply(
-                            lambda mut: ", ".join(mut) if isinstance(mut, list) else mut
-                        )
+class RateLimited(RuntimeError):
+    """Se superó el límite de frecuencia; ``espera`` son los segundos hasta la próxima ficha."""
 
-                        columnas = ["Brainrot", "Calidad", "Cuenta", "Total", "Color", "Mutaciones"]
-                        df = df[[col for col in columnas if col in df.columns]]
+    def __init__(self, mensaje, espera):
+        super().__init__(mensaje)
+        self.espera = espera
 
-                        if df.empty:
-                            st.info("No hay brainrots para mostrar con los filtros seleccionados.")
-                        else:
-                            ensure_rarity_styles()
-                            ensure_color_styles()
-
-                            df_display = df.copy()
-                            df_display["Calidad"] = df_display["Calidad"].apply(rarity_badge_html)
-                            df_display["Mutaciones"] = df_display["Mutaciones"].apply(
-                                lambda valor: valor if valor else "-"
-                            )
-                            df_display["Cuenta"] = df_display["Cuenta"].apply(
-                                lambda valor: valor if valor else "-"
-                            )
-                            if "Color" in df_display:
-                                df_display["Color"] = df_display["Color"].apply(color_badge_html)
-
-                        st.markdown(
-                                df_display.to_html(
-                                    escape=False,
-                                    index=False,
-                                    classes="brainrot-table"
-                                ),
-                                unsafe_allow_html=True,
-                            )
-
-
-
-                        # ----------------------------
-                        # Borrar / Mover Brainrots
-                        # ----------------------------
-                        with st.container(border=True):
-                            st.markdown("### 🗑️ 🔄 Borrar / Mover Brainrots")
-
-                            def brainrot_label(b):
-                                parts = [
-                                    f"{b['Brainrot']}",
-                                    f"Cuenta: {b['Cuenta']}",
-                                    f"Total: {format_num(b['Total'])}"
-                                ]
-                                if b.get("Calidad"):
-                                    parts.append(f"Calidad: {b['Calidad']}")
-                                if b.get("Color") and b["Color"] != "-":
-                                    parts.append(f"Color: {b['Color']}")
-                                if b.get("Mutaciones"):
-                                    parts.append(f"Mutaciones: {', '.join(b['Mutaciones'])}")
-                                return " | ".join(parts), b["id"]
-
-                            brainrot_entries = []
-                            for brainrot in brainrots:
-                                label, brainrot_id = brainrot_label(brainrot)
-                                option_value = make_searchable_option(
-                                    label,
-                                    label,
-                                    brainrot.get("Brainrot", ""),
-                                    brainrot.get("Cuenta", ""),
-                                    brainrot.get("Calidad", ""),
-                                    brainrot.get("Color", ""),
-                                    ", ".join(brainrot.get("Mutaciones", [])),
-                                )
-                                brainrot_entries.append((option_value, label, brainrot_id))
-
-                            opciones_brainrots = ["(ninguno)"] + [entry[0] for entry in brainrot_entries]
-                            ids_map = {entry[1]: entry[2] for entry in brainrot_entries}
-
-                            # Borrar
-                            to_delete_option = st.selectbox(
-                                "Selecciona un Brainrot para borrar",
-                                opciones_brainrots,
-                                format_func=option_display,
-                            )
-                            to_delete = option_display(to_delete_option)
-                            if st.button("🗑️ Borrar Brainrot") and to_delete != "(ninguno)":
-                                brainrot_id = ids_map[to_delete]
-                                brainrots = [b for b in brainrots if b["id"] != brainrot_id]
-                                save_data(uid, perfil_actual, brainrots, cuentas)
-                                st.success("Brainrot borrado.")
-                                st.rerun()
-
-                            # Mover
-                            mover_option = st.selectbox(
-                                "Selecciona un Brainrot para mover",
-                                opciones_brainrots,
-                                format_func=option_display,
-                            )
-                            mover = option_display(mover_option)
-                            nueva_cuenta_sel = st.selectbox("Mover a cuenta", ["(ninguna)"] + cuentas)
-                            if st.button("🔄 Mover Brainrot") and mover != "(ninguno)" and nueva_cuenta_sel != "(ninguna)":
-                                brainrot_id = ids_map[mover]
-                                for b in brainrots:
-                                    if b["id"] == brainrot_id:
-                                        b["Cuenta"] = nueva_cuenta_sel
-                                save_data(uid, perfil_actual, brainrots, cuentas)
-                                st.success(f"Brainrot movido a cuenta '{nueva_cuenta_sel}'.")
-                                st.rerun()
-                    else:
-                        st.info("Debes seleccionar un perfil para ver tu inventario")
-                                
-    with pestañas[2]:
-        with st.container(border=True):
-            st.subheader("⚙️ Opciones")
 
-            if "user" in st.session_state and st.session_state["user"]:
-                if st.button("🚪 Cerrar sesión", key="logout_button"):
-                    clear_session_token()
-                    st.session_state.pop("user", None)
-                    st.success("✅ Sesión cerrada correctamente.")
-                    st.rerun()
+class TokenBucket:
+    def __init__(self, capacidad, recarga):
+        self.capacidad = capacidad
+        self.recarga = recarga
+        self.fichas = float(capacidad)
+        self.actualizado = time.monotonic()
 
-st.divider()
-st.markdown(
-    """
-    <div style='text-align: left;'>
-        <a href="https://www.roblox.com/es/games/109983668079237/Steal-a-Brainrot" target="_blank" rel="noopener noreferrer">
-            🎮 Jugar Steal a Brainrot en Roblox
-        </a>
-    </div>
-    """,
-    unsafe_allow_html=True,
-)
+    def take(self, n=1):
+        """Consume ``n`` fichas si hay; devuelve los segundos de espera (0 si se consumieron)."""
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.actualizado) * self.recarga)
+        self.actualizado = ahora
+        if self.fichas >= n:
+            self.fichas -= n
+            return 0.0
+        return (n - self.fichas) / self.recarga
 
 
+@st.cache_resource
+def _rate_limiter():
+    return {
+        "lock": threading.Lock(),
+        "cubetas": {},
+        "metricas": {tipo: {"permitidas": 0, "rechazadas": 0} for tipo in LIMITES},
+    }
 
 
+def _shared_window_wait(tipo, clave):
+    """Espera según el contador compartido de la ventana actual (0 si hay margen)."""
+    limite = LIMITES[tipo]
+    ventana = limite["capacidad"] / limite["recarga"]
+    inicio = int(time.time() // ventana)
+    cache_clave = f"limite:{tipo}:{clave}:{inicio}"
+    try:
+        usadas = int(shared_cache().incr(cache_clave))
+        if usadas == 1:
+            shared_cache().expire(cache_clave, int(ventana) + 1)
+    except Exception:
+        return 0.0
+    if usadas <= limite["capacidad"]:
+        return 0.0
+    return (inicio + 1) * ventana - time.time()
+
+
+def take_token(tipo, clave):
+    """Consume una ficha de ``tipo`` para ``clave`` o lanza RateLimited."""
+    limiter = _rate_limiter()
+    limite = LIMITES[tipo]
+    with limiter["lock"]:
+        cubetas = limiter["cubetas"]
+        cubeta = cubetas.pop((tipo, clave), None) or TokenBucket(limite["capacidad"], limite["recarga"])
+        cubetas[(tipo, clave)] = cubeta
+        while len(cubetas) > LIMITES_MAX_CLAVES:
+            cubetas.pop(next(iter(cubetas)))
+        espera = cubeta.take()
+    if not espera and st.secrets.get("limites", {}).get("compartido"):
+        espera = _shared_window_wait(tipo, clave)
+    with limiter["lock"]:
+        limiter["metricas"][tipo]["rechazadas" if espera else "permitidas"] += 1
+    if espera:
+        raise RateLimited(f"Demasiadas peticiones seguidas; espera {max(1, round(espera))} s e inténtalo de nuevo.", espera)
+
+
+def rate_limit_metrics():
+    limiter = _rate_limiter()
+    with limiter["lock"]:
+        return pd.DataFrame([
+            {"Límite": tipo, "Claves activas": sum(t == tipo for t, _ in limiter["cubetas"]), **metricas}
+            for tipo, metricas in limiter["metricas"].items()
+        ])
+
+
+# Detrás de un balanceador la conexión la abre el proxy, no el navegador. Con
+# [limites] proxies = ["10.0.0.0/8", ...] en secrets se confía en la cabecera
+# X-Forwarded-For que añaden esos proxies: el cliente es la última dirección
+# de la cadena que no pertenece a ninguno. Si el par directo no es un proxy de
+# confianza la cabecera se ignora, porque cualquiera puede enviarla.
+def _trusted_proxies():
+    redes = []
+    for red in st.secrets.get("limites", {}).get("proxies", []):
+        try:
+            redes.append(ipaddress.ip_network(str(red).strip(), strict=False))
+        except ValueError:
+            continue
+    return redes
 
 
+def forwarded_client(directa, cabeceras):
+    """Dirección del cliente a partir del par directo y de X-Forwarded-For si viene de un proxy de confianza."""
+    proxies = _trusted_proxies()
 
+    def de_confianza(ip):
+        try:
+            direccion = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(direccion in red for red in proxies)
+
+    if not directa or not de_confianza(directa):
+        return directa
+    saltos = [ip.strip() for ip in (cabeceras.get("X-Forwarded-For") or "").split(",") if ip.strip()]
+    for ip in reversed(saltos):
+        if not de_confianza(ip):
+            return ip
+    return saltos[0] if saltos else directa
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_unconfigured_proxy():
+    log.warning(
+        "Conexiones desde localhost con X-Forwarded-For: se limita por la última "
+        "dirección de la cabecera. Declara el proxy en [limites] proxies."
+    )
+
+
+def client_ip():
+    """IP del navegador para los límites por dirección.
+
+    Streamlit devuelve None para las conexiones desde localhost, que es también
+    lo que ve un proxy inverso en la misma máquina. Si ese proxy no está
+    declarado se usa la última dirección de X-Forwarded-For (la que añadió él)
+    avisando en el log, y sin cabecera todas esas conexiones comparten el
+    bucket "desconocida": una sesión nueva no debe estrenar fichas.
+    """
+    try:
+        ip = st.context.ip_address
+        cabeceras = st.context.headers
+    except Exception:
+        ip, cabeceras = None, {}
+    cabeceras = cabeceras or {}
+    ip = forwarded_client(ip or "127.0.0.1", cabeceras)
+    if isinstance(ip, str) and ip and ip not in {"127.0.0.1", "::1"}:
+        return ip
+    saltos = [s.strip() for s in (cabeceras.get("X-Forwarded-For") or "").split(",") if s.strip()]
+    if saltos:
+        _warn_unconfigured_proxy()
+        return saltos[-1]
+    return "desconocida"
+
+
+def take_auth_tokens(email):
+    """Fichas de autenticación por IP del cliente y por correo intentado."""
+    take_token("auth", client_ip())
+    take_token("auth_correo", email.strip().lower())
+
+
+def show_rate_limit(fn):
+    """Muestra como aviso el RateLimited (o el error al guardar un cambio) que lance una sección de la interfaz."""
+    @functools.wraps(fn)
+    def envoltura(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except RateLimited as e:
+            st.warning(f"⏳ {e}")
+        except (BudgetExceeded, SaveFailed) as e:
+            st.error(f"❌ {e}")
+    return envoltura
 
+# ============================
+# FUNCIONES DE AUTENTICACIÓN
+# ============================
 
+def signup(email, password):
+    try:
+        take_auth_tokens(email)
+    except RateLimited as e:
+        return {"error": {"message": str(e)}}
+    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={WEB_API_KEY}"
+    payload = {"email": email, "password": password, "returnSecureToken": True}
+    res = requests.post(url, data=payload)
+    return res.json()
 
+def login(email, password):
+    try:
+        take_auth_tokens(email)
+    except RateLimited as e:
+        return {"error": {"message": str(e)}}
+    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={WEB_API_KEY}"
+    payload = {"email": email, "password": password, "returnSecureToken": True}
+    res = requests.post(url, data=payload)
+    return res.json()
 
+# ============================
+# CODIFICACIÓN COMPACTA DEL INVENTARIO
+# ============================
 
+FORMATO_COMPACTO = 3
+# Cada Brainrot codificado ocupa un registro binario de tamaño fijo con su id
+# de catálogo, color, bitmask de mutaciones, id de cuenta (-1 = "(ninguna)"),
+# Total por copia y Cantidad; los ids internos van aparte como lista de strings.
+# Hasta el formato 2 las cuentas eran una lista de nombres y el registro
+# guardaba su posición, que coincide con el id que les asigna account_entities.
+REGISTRO_COMPACTO = struct.Struct("<HBQhdI")
+
+
+def firestore_size(valor):
+    """Tamaño que Firestore factura por un valor (strings +1 byte, números 8 bytes, etc.)."""
+    if valor is None or isinstance(valor, bool):
+        return 1
+    if isinstance(valor, (int, float)):
+        return 8
+    if isinstance(valor, str):
+        return len(valor.encode("utf-8")) + 1
+    if isinstance(valor, bytes):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(len(str(k).encode("utf-8")) + 1 + firestore_size(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(firestore_size(v) for v in valor)
+    return 8
+
+
+def _encode_item(brainrot, ids_cuentas, catalogo):
+    """Codifica un Brainrot como registro binario o devuelve None si no está en el catálogo."""
+    brainrot_id = catalogo["brainrot_ids"].get(brainrot.get("Brainrot"))
+    color_id = catalogo["color_ids"].get(brainrot.get("Color") or "-")
+    cuenta = brainrot.get("Cuenta") or "(ninguna)"
+    cuenta_id = -1 if cuenta == "(ninguna)" else ids_cuentas.get(cuenta)
+    total = brainrot.get("Total")
+    if brainrot_id is None or color_id is None or cuenta_id is None or cuenta_id > 32767:
+        return None
+    if not isinstance(brainrot.get("id"), str) or not isinstance(total, (int, float)):
+        return None
+    mascara = 0
+    for mutacion in brainrot.get("Mutaciones") or []:
+        bit = catalogo["mutacion_bits"].get(mutacion)
+        if bit is None or bit >= 64:
+            return None
+        mascara |= 1 << bit
+    return REGISTRO_COMPACTO.pack(brainrot_id, color_id, mascara, cuenta_id, total, item_count(brainrot))
+
+
+def encode_inventory(brainrots, cuentas):
+    """Convierte el inventario al documento compacto que se guarda en Firestore.
+
+    Los Brainrots que no se pueden codificar (nombres, colores o mutaciones
+    fuera del catálogo) se conservan tal cual en ``brainrots``.
+    """
+    cuentas = account_entities(cuentas)
+    ids_cuentas = {cuenta["nombre"]: cuenta["id"] for cuenta in cuentas}
+    catalogo = current_catalog()
+    ids = []
+    registros = []
+    sin_codificar = []
+    for brainrot in brainrots:
+        registro = _encode_item(brainrot, ids_cuentas, catalogo)
+        if registro is None:
+            sin_codificar.append(brainrot)
+            continue
+        ids.append(brainrot["id"])
+        registros.append(registro)
+    return {
+        "formato": FORMATO_COMPACTO,
+        "cuentas": cuentas,
+        "inv": {"i": ids, "d": b"".join(registros)},
+        "brainrots": sin_codificar,
+    }
 
 
+def short_item_id(item_id):
+    """Acorta de forma determinista los uuid antiguos al formato de ``new_item_id``."""
+    if isinstance(item_id, str) and len(item_id) > 12:
+        return item_id.replace("-", "")[:12]
+    return item_id
+
+
+def _decode_mutations(mascara, nombres):
+    return [nombres[bit] for bit in range(len(nombres)) if mascara >> bit & 1 and nombres[bit]]
+
+
+def decode_inventory(data):
+    """Devuelve ``(brainrots, cuentas)`` desde un documento compacto o del formato anterior."""
+    cuentas = account_entities(data.get("cuentas", []))
+    nombres_cuentas = {cuenta["id"]: cuenta["nombre"] for cuenta in cuentas}
+    inv = data.get("inv") or {}
+    registros = REGISTRO_COMPACTO.iter_unpack(bytes(inv.get("d", b"")))
+    catalogo = current_catalog()
+    brainrot_nombres = catalogo["brainrot_nombres"]
+    color_nombres = catalogo["color_nombres"]
+    brainrots = []
+    # Los inventarios grandes repiten mucho los mismos ids, así que nombre,
+    # calidad, color y mutaciones se resuelven una vez por valor distinto.
+    especies = {}
+    colores = {}
+    combinaciones = {}
+    for item_id, (b, c, m, a, t, n) in zip(inv.get("i", []), registros):
+        especie = especies.get(b)
+        if especie is None:
+            nombre = (brainrot_nombres[b] if b < len(brainrot_nombres) else None) or f"Brainrot #{b}"
+            especie = especies[b] = (nombre, catalogo["brainrots"].get(nombre, {}).get("quality", "Común"))
+        color = colores.get(c)
+        if color is None:
+            color = colores[c] = (color_nombres[c] if c < len(color_nombres) else None) or "-"
+        mutaciones = combinaciones.get(m)
+        if mutaciones is None:
+            mutaciones = combinaciones[m] = _decode_mutations(m, catalogo["mutacion_nombres"]) if m else []
+        brainrots.append({
+            "id": short_item_id(item_id),
+            "Brainrot": especie[0],
+            "Calidad": especie[1],
+            "Color": color,
+            "Mutaciones": list(mutaciones),
+            "Cuenta": nombres_cuentas.get(a, "(ninguna)"),
+            "Total": int(t) if t.is_integer() else t,
+            "Cantidad": n,
+        })
+    for brainrot in data.get("brainrots", []):
+        if "id" in brainrot:
+            brainrot["id"] = short_item_id(brainrot["id"])
+        brainrots.append(brainrot)
+    return brainrots, cuentas
 
+# ============================
+# FRAGMENTACIÓN DE PERFILES GRANDES
+# ============================
 
+# Firestore limita cada documento a 1 MiB. Los inventarios de más de
+# FRAGMENTO_MAX_PILAS pilas se reparten en documentos de la subcolección
+# "fragmentos" según un hash estable del id de cada pila, así que un cambio
+# sólo altera los fragmentos de las pilas que toca. Cada fragmento se nombra
+# por su contenido y el documento base guarda la lista ("fragmentos") como
+# manifiesto: los fragmentos nuevos se escriben antes que el manifiesto y los
+# viejos se borran después, de modo que el manifiesto siempre apunta a
+# documentos completos.
+FRAGMENTO_MAX_PILAS = 4096
+FRAGMENTO_PILAS = 2048
+FRAGMENTOS_POR_BATCH = 20
 
 
+class MissingShard(RuntimeError):
+    """El manifiesto apunta a un fragmento que ya no existe (otro proceso lo reemplazó)."""
 
 
+def shard_count(pilas):
+    """Número de fragmentos (potencia de dos) para ``pilas`` pilas; 0 si caben en el documento base."""
+    if pilas <= FRAGMENTO_MAX_PILAS:
+        return 0
+    n = 2
+    while pilas > n * FRAGMENTO_PILAS:
+        n *= 2
+    return n
 
 
+def shard_of(item_id, n):
+    return zlib.crc32(str(item_id).encode("utf-8")) % n
 
 
+def encode_profile(brainrots, cuentas):
+    """Devuelve ``(documento_base, {id_fragmento: datos})`` para guardar el inventario.
 
+    Los inventarios pequeños van enteros en el documento base, igual que antes.
+    """
+    n = shard_count(len(brainrots))
+    if not n:
+        return dict(encode_inventory(brainrots, cuentas), fragmentos=firestore.DELETE_FIELD), {}
+    grupos = [[] for _ in range(n)]
+    for brainrot in brainrots:
+        grupos[shard_of(brainrot.get("id"), n)].append(brainrot)
+    fragmentos = {}
+    for i, grupo in enumerate(grupos):
+        codificado = encode_inventory(grupo, cuentas)
+        datos = {"inv": codificado["inv"], "brainrots": codificado["brainrots"]}
+        huella = hashlib.sha1(codificado["inv"]["d"])
+        huella.update("\0".join(codificado["inv"]["i"]).encode("utf-8"))
+        huella.update(json.dumps(codificado["brainrots"], sort_keys=True, default=str).encode("utf-8"))
+        fragmentos[f"{i:03d}-{huella.hexdigest()[:16]}"] = datos
+    base = dict(encode_inventory([], cuentas), fragmentos=list(fragmentos))
+    return base, fragmentos
+
+
+def join_shards(data, fragmentos):
+    """Reúne en ``data`` el inventario de los fragmentos leídos, en el orden del manifiesto."""
+    ids, registros, sin_codificar = [], [], []
+    for fragmento in fragmentos:
+        inv = fragmento.get("inv") or {}
+        ids.extend(inv.get("i", []))
+        registros.append(bytes(inv.get("d", b"")))
+        sin_codificar.extend(fragmento.get("brainrots", []))
+    return dict(data, inv={"i": ids, "d": b"".join(registros)}, brainrots=sin_codificar)
 
+# ============================
+# REGISTRO DE CAMBIOS (DESHACER / REHACER)
+# ============================
 
+# Cada cambio del inventario se guarda como una operación pequeña en
+# perfiles/{uid}/data/{perfil}/ops. El documento del perfil es la última
+# instantánea: "op_base" es el id de la última operación ya incluida en ella y
+# "deshacer"/"rehacer" son las pilas con los ids de las operaciones (las
+# operaciones en sí se leen de ``ops`` al deshacer o rehacer, y las que siguen
+# en las pilas no se borran al compactar). Cargar un perfil cuesta la
+# instantánea más las operaciones posteriores, y cada COMPACTAR_CADA operaciones
+# se escribe una instantánea nueva y se borran las ya incluidas. La
+# instantánea se arma con lo guardado en Firestore (no con el estado de un
+# proceso), así que incluye las operaciones de todas las sesiones.
+# ``commit_op`` escribe la operación antes de confirmar el cambio, así que un
+# cambio aceptado sobrevive aunque el proceso muera; lo que se difiere es sólo
+# la actualización del documento base (pilas, resumen y "op_head", la última
+# operación que ya refleja). Quien lee reaplica todas las operaciones
+# posteriores a op_base, estén o no en op_head. Cada actualización deja además
+# su id en "guardado": si al guardar no es el que conoce el estado local, otro
+# proceso escribió en medio y el resumen se recalcula desde el registro.
+# Las operaciones de cuentas ("cuenta+", "cuenta-", "cuenta~") sólo tocan la
+# lista de cuentas; "items" guarda las pilas afectadas para poder deshacer un
+# borrado, y "n"/"de" indican la cuenta que recibe o devuelve esas pilas cuando
+# el borrado es una fusión. "lote" agrupa varias operaciones que se deshacen
+# de una vez.
+COMPACTAR_CADA = 20
+COMPACTAR_MARGEN = 30
+LIMITE_DESHACER = 20
+CAMPOS_OPERACION = ("id", "Brainrot", "Calidad", "Color", "Mutaciones", "Cuenta", "Total", "Cantidad")
+
+
+def new_op_id():
+    """Id ordenable por tiempo para una operación o instantánea."""
+    return f"{time.time_ns():020d}-{uuid.uuid4().hex[:6]}"
+
+
+def op_item(brainrot, cantidad=None, **cambios):
+    """Copia mínima de un Brainrot para guardarla dentro de una operación."""
+    item = {campo: brainrot[campo] for campo in CAMPOS_OPERACION if campo in brainrot}
+    item["Mutaciones"] = list(item.get("Mutaciones") or [])
+    item["Cantidad"] = item_count(brainrot) if cantidad is None else int(cantidad)
+    item.update(cambios)
+    return item
+
+
+def find_stack(brainrots, item):
+    clave = stack_key(item)
+    for brainrot in brainrots:
+        if stack_key(brainrot) == clave:
+            return brainrot
+    return None
+
+
+def apply_op(brainrots, cuentas, op):
+    """Aplica una operación del registro y devuelve ``(brainrots, cuentas)``.
+
+    Las operaciones localizan las pilas por su clave (no por id), así que se
+    pueden reaplicar o invertir aunque las pilas se hayan fusionado entre medio.
+    """
+    tipo = op["k"]
+    if tipo == "add":
+        add_to_stack(brainrots, op_item(op["b"]))
+    elif tipo == "del":
+        pila = find_stack(brainrots, op["b"])
+        if pila:
+            brainrots = remove_from_stack(brainrots, pila["id"], item_count(op["b"]))
+    elif tipo == "move":
+        pila = find_stack(brainrots, op["b"])
+        if pila:
+            brainrots = move_from_stack(brainrots, pila["id"], item_count(op["b"]), op["a"])
+    elif tipo == "cuenta+":
+        if find_account(cuentas, op["a"]) is None:
+            cuenta_id = op.get("id")
+            if cuenta_id is None or any(cuenta["id"] == cuenta_id for cuenta in cuentas):
+                cuenta_id = new_account_id(cuentas)
+            cuentas.insert(min(op.get("pos", len(cuentas)), len(cuentas)), {"id": cuenta_id, "nombre": op["a"]})
+        for item in op.get("items", []):
+            pila = find_stack(brainrots, dict(item, Cuenta=op.get("de", "(ninguna)")))
+            if pila:
+                brainrots = move_from_stack(brainrots, pila["id"], item_count(item), op["a"])
+    elif tipo == "cuenta-":
+        cuenta = find_account(cuentas, op["a"])
+        if cuenta is not None:
+            cuentas.remove(cuenta)
+        destino = op.get("n", "(ninguna)")
+        for brainrot in brainrots:
+            if brainrot.get("Cuenta") == op["a"]:
+                brainrot["Cuenta"] = destino
+        brainrots, _ = merge_stacks(brainrots)
+    elif tipo == "lote":
+        for sub in op["ops"]:
+            brainrots, cuentas = apply_op(brainrots, cuentas, sub)
+    elif tipo == "cuenta~":
+        cuenta = find_account(cuentas, op["a"])
+        if cuenta is not None and find_account(cuentas, op["n"]) is None:
+            cuenta["nombre"] = op["n"]
+            for brainrot in brainrots:
+                if brainrot.get("Cuenta") == op["a"]:
+                    brainrot["Cuenta"] = op["n"]
+    return brainrots, cuentas
+
+
+def invert_op(op):
+    """Operación que deshace ``op``."""
+    tipo = op["k"]
+    if tipo == "add":
+        return {"k": "del", "b": op["b"]}
+    if tipo == "del":
+        return {"k": "add", "b": op["b"]}
+    if tipo == "move":
+        return {"k": "move", "b": dict(op["b"], Cuenta=op["a"]), "a": op["b"].get("Cuenta") or "(ninguna)"}
+    if tipo in ("cuenta+", "cuenta-"):
+        inversa = {"k": "cuenta-" if tipo == "cuenta+" else "cuenta+", "a": op["a"], "pos": op.get("pos", 0), "items": op.get("items", [])}
+        if "id" in op:
+            inversa["id"] = op["id"]
+        if tipo == "cuenta+" and "de" in op:
+            inversa["n"] = op["de"]
+        if tipo == "cuenta-" and "n" in op:
+            inversa["de"] = op["n"]
+        return inversa
+    if tipo == "cuenta~":
+        return {"k": "cuenta~", "a": op["n"], "n": op["a"]}
+    if tipo == "lote":
+        return {"k": "lote", "ops": [invert_op(sub) for sub in reversed(op["ops"])]}
+    raise ValueError(f"Operación desconocida: {tipo}")
+
+
+def describe_op(op):
+    """Texto corto para mostrar una operación en los botones de deshacer/rehacer."""
+    tipo = op["k"]
+    if tipo in ("add", "del", "move"):
+        item = op["b"]
+        texto = f"{item.get('Brainrot')} x{item_count(item)}"
+        if tipo == "add":
+            return f"agregar {texto}"
+        if tipo == "del":
+            return f"borrar {texto}"
+        return f"mover {texto} de '{item.get('Cuenta')}' a '{op['a']}'"
+    if tipo == "lote":
+        return f"{len(op['ops'])} movimientos del optimizador"
+    if tipo == "cuenta~":
+        return f"renombrar la cuenta '{op['a']}' a '{op['n']}'"
+    if tipo == "cuenta+":
+        if "de" in op:
+            return f"separar la cuenta '{op['a']}' de '{op['de']}'"
+        return f"agregar la cuenta '{op['a']}'"
+    if "n" in op:
+        return f"fusionar la cuenta '{op['a']}' con '{op['n']}'"
+    return f"borrar la cuenta '{op['a']}'"
+
+
+def replay_ops(brainrots, cuentas, ops):
+    """Reconstruye el estado aplicando en orden las operaciones posteriores a la instantánea."""
+    for op in ops:
+        brainrots, cuentas = apply_op(brainrots, cuentas, op)
+    return brainrots, cuentas
 
+# ============================
+# CACHÉ COMPARTIDA
+# ============================
 
+# Con varios procesos cada uno tiene su propia memoria, así que lo que debe ser
+# coherente entre ellos va a una caché compartida: Redis si hay
+# BRAINROT_REDIS_URL (o [cache] redis_url en secrets, requiere el paquete
+# redis) y, si no, MemoryCache, que tiene la misma interfaz y sirve para un
+# solo proceso y para pruebas.
+# Cada escritura de un perfil (también cada operación que guarda commit_op)
+# incrementa su versión ("perfil:{uid}:{perfil}:v") y los guardados del
+# documento base borran además la lista cacheada de perfiles del usuario; las
+# sesiones comparan esa versión antes de usar su copia local.
+CACHE_TTL_PERFILES = 300
+
+
+class MemoryCache:
+    """Caché en memoria del proceso con la parte de la interfaz de Redis que se usa aquí."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}
+
+    def get(self, clave):
+        with self._lock:
+            valor, expira = self._datos.get(clave, (None, None))
+            if expira is not None and expira < time.time():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def set(self, clave, valor, ex=None):
+        with self._lock:
+            self._datos[clave] = (valor, time.time() + ex if ex else None)
+        return True
 
+    def delete(self, *claves):
+        with self._lock:
+            return sum(self._datos.pop(clave, None) is not None for clave in claves)
+
+    def incr(self, clave, cantidad=1):
+        with self._lock:
+            valor, expira = self._datos.get(clave, (0, None))
+            valor = int(valor) + cantidad
+            self._datos[clave] = (valor, expira)
+            return valor
+
+    def expire(self, clave, segundos):
+        with self._lock:
+            if clave not in self._datos:
+                return False
+            self._datos[clave] = (self._datos[clave][0], time.time() + segundos)
+            return True
 
 
+@st.cache_resource
+def shared_cache():
+    """Caché compartida del proceso.
 
+    Si hay una URL de Redis configurada y el paquete falta o el servidor no
+    responde lanza RuntimeError en lugar de seguir con MemoryCache, que con
+    varios procesos rompería límites, sesiones y versiones de perfil.
+    """
+    url = os.environ.get("BRAINROT_REDIS_URL") or st.secrets.get("cache", {}).get("redis_url")
+    if not url:
+        return MemoryCache()
+    try:
+        import redis
+    except ImportError as e:
+        log.error("Hay una URL de Redis configurada pero falta el paquete redis")
+        raise RuntimeError("Hay una URL de Redis configurada pero falta el paquete redis (pip install redis).") from e
+    cliente = redis.Redis.from_url(url, socket_timeout=0.5)
+    try:
+        cliente.ping()
+    except redis.RedisError as e:
+        log.error("No se pudo conectar con Redis", exc_info=True)
+        raise RuntimeError(f"No se pudo conectar con la caché compartida (Redis): {e}") from e
+    return cliente
 
 
+def cache_get_json(clave):
+    try:
+        valor = shared_cache().get(clave)
+    except Exception:
+        return None
+    return json.loads(valor) if valor is not None else None
 
 
+def cache_set_json(clave, valor, ttl):
+    try:
+        shared_cache().set(clave, json.dumps(valor), ex=ttl)
+    except Exception:
+        pass
 
 
+def profile_version(uid, perfil):
+    """Versión compartida del perfil; None si la caché no responde."""
+    try:
+        return int(shared_cache().get(f"perfil:{uid}:{perfil}:v") or 0)
+    except Exception:
+        return None
 
 
+def invalidate_profile(uid, perfil, resumenes=True):
+    """Marca el perfil como modificado para todos los procesos; devuelve la versión nueva.
 
+    Con ``resumenes`` False no borra la lista cacheada de perfiles (el cambio
+    aún no está en el resumen guardado).
+    """
+    cache = shared_cache()
+    try:
+        if resumenes:
+            cache.delete(f"perfiles:{uid}")
+        return int(cache.incr(f"perfil:{uid}:{perfil}:v"))
+    except Exception:
+        return None
 
+# ============================
+# MEDICIÓN DE CONSUMO DE FIRESTORE
+# ============================
 
+# Las funciones de almacenamiento decoradas con @metered atribuyen al usuario
+# (su primer argumento) las lecturas, escrituras y bytes que hacen, contados
+# con read_doc/count_write en cada llamada a Firestore. El consumo del día se
+# suma en la caché compartida para aplicar los presupuestos entre procesos y
+# cada proceso lo acumula en "consumo/{día}" cada CONSUMO_GUARDADO segundos
+# para la vista de administración. Al agotar el presupuesto de lecturas se
+# sirven los datos en caché aunque estén viejos; al agotar el de escrituras los
+# cambios se quedan en la cola hasta el día siguiente.
+# El consumo de cada sesión también se acumula en el proceso, bajo su id de
+# sesión de Streamlit: submit_background guarda la sesión que encola la tarea,
+# así que lo que se lee y escribe en segundo plano se carga a esa sesión.
+CONSUMO_GUARDADO = 60
+CONSUMO_REINTENTO = 60
+PRESUPUESTO_POR_DEFECTO = {"lecturas": 50_000, "escrituras": 20_000}
+METRICAS_CONSUMO = ("lecturas", "escrituras", "bytes")
+CONSUMO_SESIONES_MAX = 10_000
 
+_medicion = contextvars.ContextVar("medicion_firestore", default=None)
+_sesion_consumo = contextvars.ContextVar("sesion_consumo", default=None)
 
 
+class BudgetExceeded(RuntimeError):
+    """El usuario agotó su presupuesto diario de escrituras."""
 
 
+def usage_day(ts=None):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
 
 
+def usage_session():
+    """Sesión a la que se carga el consumo: la del script o la que encoló la tarea en segundo plano."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else _sesion_consumo.get()
 
 
+def usage_budget(metrica):
+    """Presupuesto diario por usuario ([consumo] en secrets); 0 o None es ilimitado."""
+    return st.secrets.get("consumo", {}).get(f"{metrica}_dia", PRESUPUESTO_POR_DEFECTO.get(metrica))
 
 
+def read_doc(doc):
+    """``doc.to_dict()`` contando la lectura (y sus bytes) para el usuario que se está midiendo."""
+    data = doc.to_dict() if doc.exists else None
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion["lecturas"] += 1
+        medicion["bytes"] += firestore_size(data) if data else 0
+    return data
 
 
+def count_read():
+    """Cuenta una lectura sin documento: una consulta vacía o una agregación ``count()``."""
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion["lecturas"] += 1
 
 
+def count_write(data=None):
+    """Cuenta una escritura (set, update o delete) de ``data``."""
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion["escrituras"] += 1
+        medicion["bytes"] += firestore_size(data) if data else 0
 
 
+def metered(fn):
+    """Atribuye al usuario del primer argumento lo que ``fn`` lee y escribe en Firestore."""
+    @functools.wraps(fn)
+    def envoltura(uid, *args, **kwargs):
+        if _medicion.get() is not None:
+            return fn(uid, *args, **kwargs)
+        medicion = dict.fromkeys(METRICAS_CONSUMO, 0)
+        token = _medicion.set(medicion)
+        try:
+            return fn(uid, *args, **kwargs)
+        finally:
+            _medicion.reset(token)
+            record_usage(uid, medicion)
+    return envoltura
+
+
+@st.cache_resource
+def _usage_store():
+    store = {"lock": threading.Lock(), "pendiente": {}, "sesiones": {}, "timer": None, "error": None}
+    atexit.register(flush_usage)
+    return store
+
+
+def record_usage(uid, medicion):
+    if not any(medicion.values()):
+        return
+    dia = usage_day()
+    cache = shared_cache()
+    for metrica, cantidad in medicion.items():
+        if not cantidad:
+            continue
+        clave = f"consumo:{dia}:{uid}:{metrica}"
+        try:
+            if cache.incr(clave, cantidad) == cantidad:
+                cache.expire(clave, 2 * 86400)
+        except Exception:
+            pass
+
+    store = _usage_store()
+    sesion = usage_session()
+    with store["lock"]:
+        usuario = store["pendiente"].setdefault(dia, {}).setdefault(uid, dict.fromkeys(METRICAS_CONSUMO, 0))
+        for metrica, cantidad in medicion.items():
+            usuario[metrica] += cantidad
+        if store["timer"] is None:
+            store["timer"] = threading.Timer(CONSUMO_GUARDADO, flush_usage)
+            store["timer"].daemon = True
+            store["timer"].start()
+        if sesion is not None:
+            sesiones = store["sesiones"]
+            consumo = sesiones.pop(sesion, None) or dict.fromkeys(METRICAS_CONSUMO, 0)
+            sesiones[sesion] = consumo
+            for metrica, cantidad in medicion.items():
+                consumo[metrica] += cantidad
+            while len(sesiones) > CONSUMO_SESIONES_MAX:
+                sesiones.pop(next(iter(sesiones)))
+
+
+def session_usage(sesion=None):
+    """Consumo acumulado por la sesión (por defecto, la actual)."""
+    sesion = sesion or usage_session()
+    store = _usage_store()
+    with store["lock"]:
+        return dict(store["sesiones"].get(sesion) or dict.fromkeys(METRICAS_CONSUMO, 0))
+
+
+def flush_usage():
+    """Suma el consumo acumulado por el proceso al documento diario de Firestore."""
+    store = _usage_store()
+    with store["lock"]:
+        pendiente, store["pendiente"] = store["pendiente"], {}
+        if store["timer"] is not None:
+            store["timer"].cancel()
+            store["timer"] = None
+    for dia, usuarios in pendiente.items():
+        try:
+            db.collection("consumo").document(dia).set({
+                uid: {metrica: firestore.Increment(cantidad) for metrica, cantidad in medicion.items() if cantidad}
+                for uid, medicion in usuarios.items()
+            }, merge=True)
+        except Exception as e:
+            # El consumo no guardado vuelve a la cola para el siguiente intento
+            # y el error queda a la vista en el panel de consumo.
+            log.warning("No se pudo guardar el consumo de %s", dia, exc_info=True)
+            with store["lock"]:
+                store["error"] = f"{dia}: {e}"
+                for uid, medicion in usuarios.items():
+                    usuario = store["pendiente"].setdefault(dia, {}).setdefault(uid, dict.fromkeys(METRICAS_CONSUMO, 0))
+                    for metrica, cantidad in medicion.items():
+                        usuario[metrica] += cantidad
+                if store["timer"] is None:
+                    store["timer"] = threading.Timer(CONSUMO_GUARDADO, flush_usage)
+                    store["timer"].daemon = True
+                    store["timer"].start()
+        else:
+            with store["lock"]:
+                store["error"] = None
+
+
+def usage_today(uid, metrica):
+    """Consumo del usuario en el día actual, sumando todos los procesos."""
+    try:
+        return int(shared_cache().get(f"consumo:{usage_day()}:{uid}:{metrica}") or 0)
+    except Exception:
+        return 0
 
 
+def over_budget(uid, metrica):
+    presupuesto = usage_budget(metrica)
+    return bool(presupuesto) and usage_today(uid, metrica) >= presupuesto
 
 
+def usage_report(dia):
+    """Totales por usuario del día indicado según Firestore; incluye lo pendiente de este proceso."""
+    flush_usage()
+    data = db.collection("consumo").document(dia).get().to_dict() or {}
+    return pd.DataFrame([
+        {"Usuario": uid, **{metrica.capitalize(): medicion.get(metrica, 0) for metrica in METRICAS_CONSUMO}}
+        for uid, medicion in sorted(data.items())
+    ])
 
 
+def is_admin(uid):
+    return uid in st.secrets.get("admin", {}).get("uids", [])
 
+# ============================
+# FUNCIONES DE PERFILES
+# ============================
 
+# Cada proceso guarda los últimos perfiles decodificados junto al update_time
+# del documento del que salieron y la versión del catálogo con la que se
+# decodificaron. Antes de descargar un perfil se pide sólo su metadato
+# (máscara de campos vacía); si el documento no cambió, el catálogo es el
+# mismo y el registro no tiene operaciones posteriores a la última que aplicó
+# el modelo (una consulta con limit(1): commit_op no toca el documento base)
+# se sirve una copia del modelo sin transferir ni decodificar el inventario.
+MODELOS_DECODIFICADOS_MAX = 256
+
+
+def _profile_ref(uid, perfil):
+    return db.collection("perfiles").document(uid).collection("data").document(perfil)
+
+
+def _delete_ops(ref, hasta=None, conservar=()):
+    """Borra en lotes las operaciones del perfil (todas o las de id <= ``hasta``), salvo las de ``conservar``."""
+    consulta = ref.collection("ops")
+    if hasta is not None:
+        consulta = consulta.where("i", "<=", hasta)
+    batch = db.batch()
+    pendientes = 0
+    for doc in consulta.select([]).stream():
+        read_doc(doc)
+        if doc.id in conservar:
+            continue
+        batch.delete(doc.reference)
+        count_write()
+        pendientes += 1
+        if pendientes == 400:
+            batch.commit()
+            batch = db.batch()
+            pendientes = 0
+    if pendientes:
+        batch.commit()
+
+
+def profile_summary(brainrots, cuentas):
+    """Resumen pequeño que se guarda junto al perfil para listarlo sin leer el inventario."""
+    top = max(brainrots, key=lambda b: b.get("Total", 0), default=None)
+    return {
+        "pilas": len(brainrots),
+        "copias": sum(item_count(b) for b in brainrots),
+        "ingreso": sum(item_income(b) for b in brainrots),
+        "raros": sum(item_count(b) for b in brainrots if b.get("Calidad") in RAREZAS_CLASIFICACION),
+        "cuentas": len(cuentas),
+        "top": top["Brainrot"] if top else None,
+        "top_ingreso": top.get("Total", 0) if top else 0,
+    }
 
+@metered
+def list_profile_summaries(uid):
+    """Devuelve ``{perfil: resumen}`` proyectando sólo el campo ``resumen`` de cada documento.
 
+    Sin presupuesto de lecturas se devuelve la última lista conocida.
+    """
+    resumenes = cache_get_json(f"perfiles:{uid}")
+    if resumenes is not None:
+        return resumenes
+    if over_budget(uid, "lecturas"):
+        respaldo = cache_get_json(f"perfiles:{uid}:respaldo")
+        if respaldo is not None:
+            return respaldo
+    try:
+        col = db.collection("perfiles").document(uid).collection("data").select(["resumen"]).stream()
+        resumenes = {doc.id: (read_doc(doc) or {}).get("resumen") for doc in col}
+    except Exception as e:
+        st.error(f"Error listando perfiles: {e}")
+        return {}
+    remember_leaderboard_bases(uid, resumenes)
+    cache_set_json(f"perfiles:{uid}", resumenes, CACHE_TTL_PERFILES)
+    cache_set_json(f"perfiles:{uid}:respaldo", resumenes, 2 * 86400)
+    return resumenes
 
+def list_profiles(uid):
+    return list(list_profile_summaries(uid))
 
+@metered
+def create_profile(uid, name):
+    if over_budget(uid, "escrituras"):
+        raise BudgetExceeded("Alcanzaste el límite diario de escrituras; inténtalo mañana.")
+    data = dict(encode_inventory([], []), resumen=profile_summary([], []))
+    _profile_ref(uid, name).set(data)
+    count_write(data)
+    leaderboard_written(uid, name, data["resumen"])
+    invalidate_profile(uid, name)
+
+@metered
+def delete_profile(uid, name):
+    if over_budget(uid, "escrituras"):
+        raise BudgetExceeded("Alcanzaste el límite diario de escrituras; inténtalo mañana.")
+    discard_writes(uid, name)
+    ref = _profile_ref(uid, name)
+    _delete_ops(ref)
+    fragmentos = [doc.id for doc in ref.collection("fragmentos").select([]).stream() if read_doc(doc) is not None]
+    _delete_shards(ref, fragmentos)
+    batch = db.batch()
+    commit_leaderboard_writes(batch, leaderboard_writes(uid, name, None, ref=ref))
+    batch.delete(ref)
+    batch.delete(_history_ref(uid, name))
+    batch.commit()
+    count_write()
+    count_write()
+    leaderboard_written(uid, name, None)
+    unshare_profile(uid, name)
+    forget_decoded_profile(uid, name)
+    invalidate_profile(uid, name)
+
+@metered
+def load_profile(uid, perfil):
+    """Carga la instantánea del perfil, le aplica las operaciones pendientes y trae las pilas de deshacer.
+
+    Si este proceso tiene operaciones que aún no se reflejan en el documento
+    base se devuelve su estado local, que ya las incluye.
+    """
+    local = pending_state(uid, perfil)
+    if local is not None:
+        return local
+    ref = _profile_ref(uid, perfil)
+    if over_budget(uid, "lecturas"):
+        estado = decoded_profile(uid, perfil)
+        if estado is not None:
+            return estado
+    meta = ref.get(field_paths=[])
+    if read_doc(meta) is None:
+        return empty_profile_state()
+    estado = decoded_profile(uid, perfil, meta.update_time)
+    if estado is not None and has_newer_ops(ref, estado):
+        estado = None
+    if estado is None:
+        version_catalogo = current_catalog()["version"]
+        doc = ref.get()
+        estado = _profile_state(ref, doc)
+        remember_decoded_profile(uid, perfil, doc.update_time, estado, version_catalogo)
+    return estado
+
+def empty_profile_state():
+    return {
+        "brainrots": [], "cuentas": [], "pendientes": 0, "op_ultima": "", "guardado": "",
+        "deshacer": [], "rehacer": [], "operaciones": {},
+    }
 
+def copy_profile_state(estado):
+    """Copia un estado lo bastante a fondo para que ``commit_op`` no modifique el original."""
+    return {
+        "brainrots": [dict(b, Mutaciones=list(b.get("Mutaciones") or [])) for b in estado["brainrots"]],
+        "cuentas": account_entities(estado["cuentas"]),
+        "pendientes": estado["pendientes"],
+        "op_ultima": estado["op_ultima"],
+        "guardado": estado.get("guardado"),
+        "deshacer": list(estado["deshacer"]),
+        "rehacer": list(estado["rehacer"]),
+        "operaciones": dict(estado["operaciones"]),
+    }
 
+@st.cache_resource
+def _decoded_profiles():
+    return {"lock": threading.Lock(), "modelos": {}}
 
+def decoded_profile(uid, perfil, update_time=None):
+    """Copia del modelo decodificado si se obtuvo del documento con ese ``update_time`` (None: cualquiera).
 
+    Un modelo decodificado con otra versión del catálogo no se sirve.
+    """
+    registro = _decoded_profiles()
+    with registro["lock"]:
+        guardado = registro["modelos"].pop((uid, perfil), None)
+        if guardado is None:
+            return None
+        registro["modelos"][(uid, perfil)] = guardado
+    hora, version_catalogo, modelo = guardado
+    if update_time is not None and hora != update_time or version_catalogo != current_catalog()["version"]:
+        return None
+    return copy_profile_state(modelo)
+
+def remember_decoded_profile(uid, perfil, update_time, estado, version_catalogo):
+    """Guarda el modelo decodificado con la versión ``version_catalogo`` del documento leído con ``update_time``."""
+    if update_time is None:
+        return
+    registro = _decoded_profiles()
+    modelo = copy_profile_state(estado)
+    with registro["lock"]:
+        modelos = registro["modelos"]
+        modelos.pop((uid, perfil), None)
+        modelos[(uid, perfil)] = (update_time, version_catalogo, modelo)
+        while len(modelos) > MODELOS_DECODIFICADOS_MAX:
+            modelos.pop(next(iter(modelos)))
+
+def forget_decoded_profile(uid, perfil):
+    registro = _decoded_profiles()
+    with registro["lock"]:
+        registro["modelos"].pop((uid, perfil), None)
+
+def has_newer_ops(ref, estado):
+    """Indica si el registro tiene operaciones posteriores a la última aplicada en ``estado``."""
+    consulta = ref.collection("ops").where("i", ">", estado["op_ultima"]).order_by("i").limit(1).select([])
+    nuevas = [read_doc(snap) for snap in consulta.stream()]
+    if not nuevas:
+        count_read()
+    return bool(nuevas)
+
+def _profile_state(ref, doc):
+    """Construye el estado de un perfil a partir de su documento base ya leído."""
+    estado = empty_profile_state()
+    brainrots, cuentas, data, registros = _stored_profile(ref, doc)
+    if data is None:
+        return estado
+    estado["brainrots"], estado["cuentas"] = replay_ops(brainrots, cuentas, [r["op"] for r in registros])
+    estado["pendientes"] = len(registros)
+    estado["op_ultima"] = registros[-1]["i"] if registros else data.get("op_base", "")
+    estado["guardado"] = data.get("guardado", "")
+    estado["deshacer"] = data.get("deshacer", [])
+    estado["rehacer"] = data.get("rehacer", [])
+    return estado
+
+def _stored_profile(ref, doc):
+    """``(brainrots, cuentas, data, registros)`` de la instantánea guardada y las operaciones posteriores.
+
+    ``data`` es None si el perfil no existe; ``registros`` son los documentos
+    de ``ops`` con id mayor que op_base, en orden.
+    """
+    data = read_doc(doc)
+    if data is None:
+        return [], [], None, []
+    for intento in range(3):
+        try:
+            data = _with_shards(ref, data)
+            break
+        except MissingShard:
+            if intento == 2:
+                raise
+            data = read_doc(ref.get()) or {}
+    brainrots, cuentas = decode_inventory(data)
+    consulta = ref.collection("ops").where("i", ">", data.get("op_base", "")).order_by("i")
+    registros = [read_doc(snap) for snap in consulta.stream()]
+    if not registros:
+        count_read()
+    return brainrots, cuentas, data, registros
 
+def load_data(uid, perfil):
+    estado = load_profile(uid, perfil)
+    return estado["brainrots"], estado["cuentas"]
+
+def _with_shards(ref, data):
+    """Completa el documento base con sus fragmentos, leídos todos en un solo get_all."""
+    manifiesto = data.get("fragmentos")
+    if not manifiesto:
+        return data
+    col = ref.collection("fragmentos")
+    leidos = {doc.id: doc for doc in db.get_all([col.document(doc_id) for doc_id in manifiesto])}
+    if any(doc_id not in leidos or not leidos[doc_id].exists for doc_id in manifiesto):
+        raise MissingShard(ref.id)
+    return join_shards(data, [read_doc(leidos[doc_id]) for doc_id in manifiesto])
+
+def _delete_shards(ref, ids):
+    col = ref.collection("fragmentos")
+    for inicio in range(0, len(ids), 400):
+        batch = db.batch()
+        for doc_id in ids[inicio:inicio + 400]:
+            batch.delete(col.document(doc_id))
+            count_write()
+        batch.commit()
+
+@metered
+def save_data(uid, perfil, brainrots, cuentas, op_base=None, deshacer=None, rehacer=None, resumen=None, desde=None):
+    """Escribe una instantánea completa; incluye todas las operaciones registradas hasta ``op_base``.
+
+    Sólo se escriben los fragmentos cuyo contenido cambió respecto al
+    manifiesto guardado. ``deshacer`` y ``rehacer``, si se dan, reemplazan las
+    pilas guardadas; ``resumen`` reemplaza al calculado con la instantánea
+    (cuando hay operaciones posteriores que también cuentan). Con ``desde`` la
+    instantánea sólo se escribe si el op_base guardado sigue siendo ``desde``;
+    si otro proceso la reemplazó antes devuelve None sin cambiar nada.
+    """
+    op_base = op_base or new_op_id()
+    ref = _profile_ref(uid, perfil)
+    anteriores = (read_doc(ref.get(field_paths=["fragmentos"])) or {}).get("fragmentos") or []
+    base, fragmentos = encode_profile(brainrots, cuentas)
+    nuevos = [doc_id for doc_id in fragmentos if doc_id not in anteriores]
+    col = ref.collection("fragmentos")
+    for inicio in range(0, len(nuevos), FRAGMENTOS_POR_BATCH):
+        batch = db.batch()
+        for doc_id in nuevos[inicio:inicio + FRAGMENTOS_POR_BATCH]:
+            batch.set(col.document(doc_id), fragmentos[doc_id])
+            count_write(fragmentos[doc_id])
+        batch.commit()
+    data = dict(base, op_base=op_base, resumen=resumen or profile_summary(brainrots, cuentas))
+    if deshacer is not None:
+        data["deshacer"] = deshacer
+    if rehacer is not None:
+        data["rehacer"] = rehacer
+    if desde is None:
+        batch = db.batch()
+        batch.set(ref, data, merge=True)
+        count_write(data)
+        commit_leaderboard_writes(batch, leaderboard_writes(uid, perfil, data["resumen"]))
+        batch.commit()
+        leaderboard_written(uid, perfil, data["resumen"])
+    elif not _write_snapshot_base(db.transaction(), uid, perfil, data, desde):
+        vigentes = (read_doc(ref.get(field_paths=["fragmentos"])) or {}).get("fragmentos") or []
+        _delete_shards(ref, [doc_id for doc_id in nuevos if doc_id not in vigentes])
+        return None
+    _delete_shards(ref, [doc_id for doc_id in anteriores if doc_id not in fragmentos])
+    invalidate_profile(uid, perfil)
+    return op_base
+
+@firestore.transactional
+def _write_snapshot_base(transaccion, uid, perfil, data, desde):
+    """Escribe el documento base de una instantánea si el op_base guardado sigue siendo ``desde``."""
+    ref = _profile_ref(uid, perfil)
+    guardado = read_doc(ref.get(field_paths=["op_base", "resumen"], transaction=transaccion)) or {}
+    if guardado.get("op_base", "") != desde:
+        return False
+    transaccion.set(ref, data, merge=True)
+    count_write(data)
+    commit_leaderboard_writes(transaccion, leaderboard_writes(uid, perfil, data["resumen"], anterior=guardado.get("resumen") or {}))
+    leaderboard_written(uid, perfil, data["resumen"])
+    return True
+
+@firestore.transactional
+def _write_profile_head(transaccion, uid, perfil, base, visto):
+    """Escribe pilas, resumen y op_head salvo que Firestore ya tenga un op_head posterior.
+
+    Cada guardado deja en "guardado" un id propio; ``visto`` es el último que
+    conoce el estado local. Si Firestore tiene otro, algún proceso guardó
+    operaciones que ese estado puede no incluir y el resumen se recalcula
+    desde lo guardado. Un guardado que llega tarde (otro proceso, o un
+    reintento) no retrocede op_head ni pisa pilas más nuevas; sólo corrige el
+    resumen. Devuelve ``(resumen guardado, recalculado)`` para que la
+    clasificación sume la diferencia con lo realmente guardado.
+    """
+    ref = _profile_ref(uid, perfil)
+    guardado = read_doc(ref.get(field_paths=["op_head", "guardado", "resumen"], transaction=transaccion)) or {}
+    recalculado = guardado.get("guardado", "") != visto
+    if recalculado:
+        brainrots, cuentas, _, registros = _stored_profile(ref, ref.get())
+        base = dict(base, resumen=summary_with_ops(brainrots, cuentas, registros))
+    if guardado.get("op_head", "") > base["op_head"]:
+        base = {"resumen": base["resumen"], "guardado": base["guardado"]}
+    transaccion.set(ref, base, merge=True)
+    count_write(base)
+    commit_leaderboard_writes(transaccion, leaderboard_writes(uid, perfil, base["resumen"], anterior=guardado.get("resumen") or {}))
+    return base["resumen"], recalculado
+
+def settled_profile(ref):
+    """Lee el perfil y separa las operaciones asentadas de las recientes.
+
+    Devuelve ``(brainrots, cuentas, data, corte, asentadas, recientes)``: el
+    inventario de la instantánea con las operaciones de más de
+    COMPACTAR_MARGEN segundos ya aplicadas y las posteriores sin aplicar.
+    Una instantánea con op_base ``corte`` no puede dejar fuera una operación
+    que otro proceso siga escribiendo.
+    """
+    brainrots, cuentas, data, registros = _stored_profile(ref, ref.get())
+    corte = f"{time.time_ns() - int(COMPACTAR_MARGEN * 1e9):020d}"
+    asentadas = [r for r in registros if r["i"] <= corte]
+    brainrots, cuentas = replay_ops(brainrots, cuentas, [r["op"] for r in asentadas])
+    return brainrots, account_entities(cuentas), data, corte, asentadas, registros[len(asentadas):]
+
+def summary_with_ops(brainrots, cuentas, registros):
+    """Resumen del perfil tras aplicar ``registros`` a una copia del inventario."""
+    copia = [dict(b, Mutaciones=list(b.get("Mutaciones") or [])) for b in brainrots]
+    return profile_summary(*replay_ops(copia, account_entities(cuentas), [r["op"] for r in registros]))
+
+@metered
+def compact_profile(uid, perfil):
+    """Escribe una instantánea desde lo guardado en Firestore y borra las operaciones que ya incluye.
+
+    Sólo entran en la instantánea las operaciones asentadas (ver
+    ``settled_profile``); las recientes siguen en el registro y cuentan en el
+    resumen. Devuelve cuántas operaciones se compactaron.
+    """
+    ref = _profile_ref(uid, perfil)
+    brainrots, cuentas, data, corte, asentadas, recientes = settled_profile(ref)
+    if data is None or not asentadas:
+        return 0
+    op_base = save_data(
+        uid, perfil, brainrots, cuentas,
+        op_base=corte,
+        resumen=summary_with_ops(brainrots, cuentas, recientes),
+        desde=data.get("op_base", ""),
+    )
+    if op_base is None:
+        return 0
+    _delete_ops(ref, hasta=op_base, conservar=set(stack_ids(data)))
+    return len(asentadas)
+
+class SaveFailed(RuntimeError):
+    """No se pudo guardar una operación; el estado local no cambió."""
+
+
+@metered
+def commit_op(uid, perfil, estado, op, modo="do"):
+    """Guarda ``op`` en el registro del perfil y la aplica al estado local.
+
+    ``modo`` es "do" para un cambio nuevo, "undo" cuando ``op`` es la inversa
+    de la última operación de ``deshacer`` y "redo" al reaplicar la última de
+    ``rehacer``. La operación queda escrita al volver; ``flush_writes``
+    actualiza después el documento base agrupando ráfagas. Sin tocar el estado
+    lanza RateLimited si el usuario supera el límite de escrituras,
+    BudgetExceeded si agotó su presupuesto diario y SaveFailed si Firestore
+    rechaza la escritura.
+    """
+    take_token("escritura", uid)
+    if over_budget(uid, "escrituras"):
+        raise BudgetExceeded("Alcanzaste el límite diario de escrituras; inténtalo mañana.")
+    cola = _write_queue(uid, perfil)
+    with cola["lock"]:
+        # Con el lock de la cola el orden de los ids coincide con el orden en
+        # que se aplican las operaciones al estado local.
+        op_id = new_op_id()
+        registro = {"i": op_id, "op": op, "modo": modo}
+        try:
+            _profile_ref(uid, perfil).collection("ops").document(op_id).set(dict(registro, ts=firestore.SERVER_TIMESTAMP))
+        except Exception as e:
+            raise SaveFailed(f"No se pudo guardar el cambio: {e}") from e
+        count_write(registro)
+        estado["brainrots"], estado["cuentas"] = apply_op(estado["brainrots"], estado["cuentas"], op)
+        deshacer, rehacer = estado["deshacer"], estado["rehacer"]
+        if modo == "do":
+            deshacer.append(op_id)
+            estado["operaciones"][op_id] = op
+            rehacer.clear()
+        elif modo == "undo":
+            rehacer.append(deshacer.pop())
+        elif modo == "redo":
+            deshacer.append(rehacer.pop())
+        del deshacer[:-LIMITE_DESHACER]
+        apiladas = set(stack_ids(estado))
+        estado["operaciones"] = {i: o for i, o in estado["operaciones"].items() if i in apiladas}
+        estado["pendientes"] += 1
+        estado["op_ultima"] = op_id
+
+        cola["estado"] = estado
+        cola["sesion"] = usage_session() or cola["sesion"]
+        cola["version"] = invalidate_profile(uid, perfil, resumenes=False)
+        cola["ops"].append(op_id)
+        cola["desde"] = cola["desde"] or time.time()
+        _schedule_flush(cola, uid, perfil)
+    return op_id
+
+def stack_ids(estado):
+    """Ids de operación de las pilas de deshacer/rehacer de un estado o documento base."""
+    return estado.get("deshacer", []) + estado.get("rehacer", [])
+
+def stack_top(uid, perfil, estado, pila):
+    """Operación en la cima de ``pila`` ("deshacer" o "rehacer"), o None si está vacía.
+
+    Las operaciones se leen de ``ops`` la primera vez y quedan en
+    ``estado["operaciones"]``. Si otra sesión ya borró la operación, la
+    entrada se descarta y se mira la siguiente.
+    """
+    entradas = estado[pila]
+    while entradas:
+        entrada = entradas[-1]
+        op = estado["operaciones"].get(entrada)
+        if op is None:
+            registro = read_doc(_profile_ref(uid, perfil).collection("ops").document(entrada).get())
+            op = (registro or {}).get("op")
+        if op is not None:
+            estado["operaciones"][entrada] = op
+            return op
+        entradas.pop()
+    return None
+
+def undo_last(uid, perfil, estado):
+    """Deshace la última operación registrada; devuelve la operación deshecha o None."""
+    op = stack_top(uid, perfil, estado, "deshacer")
+    if op is None:
+        return None
+    commit_op(uid, perfil, estado, invert_op(op), modo="undo")
+    return op
+
+def redo_last(uid, perfil, estado):
+    """Rehace la última operación deshecha; devuelve la operación o None."""
+    op = stack_top(uid, perfil, estado, "rehacer")
+    if op is None:
+        return None
+    commit_op(uid, perfil, estado, op, modo="redo")
+    return op
+
+def stack_ops(ref, estado):
+    """Pilas ``(deshacer, rehacer)`` con las operaciones completas, leídas en un solo get_all.
+
+    Las entradas cuya operación ya no existe se omiten.
+    """
+    faltan = [i for i in stack_ids(estado) if i not in estado["operaciones"]]
+    operaciones = dict(estado["operaciones"])
+    if faltan:
+        col = ref.collection("ops")
+        for doc in db.get_all([col.document(i) for i in faltan]):
+            registro = read_doc(doc)
+            if registro is not None:
+                operaciones[doc.id] = registro["op"]
+    def completa(pila):
+        ops = [operaciones.get(e) for e in pila]
+        return [op for op in ops if op is not None]
+    return completa(estado["deshacer"]), completa(estado["rehacer"])
 
+# ============================
+# EJECUCIÓN EN SEGUNDO PLANO
+# ============================
 
+# Un único pool de hilos por proceso hace las escrituras (y lecturas
+# anticipadas) fuera del hilo que dibuja la página. Cada usuario tiene su
+# propia fila: como mucho TAREAS_ACTIVAS_POR_USUARIO se ejecutan a la vez y, si
+# acumula TAREAS_PENDIENTES_POR_USUARIO, quien encola espera (backpressure) y al
+# agotar ESPERA_BACKPRESSURE recibe BackgroundBusy. Los errores se guardan por
+# usuario y se muestran en el siguiente rerun.
+TRABAJADORES_SEGUNDO_PLANO = 8
+TAREAS_ACTIVAS_POR_USUARIO = 2
+TAREAS_PENDIENTES_POR_USUARIO = 20
+ESPERA_BACKPRESSURE = 3.0
+
+
+class BackgroundBusy(RuntimeError):
+    """El usuario tiene demasiadas tareas en segundo plano pendientes."""
+
+
+@st.cache_resource
+def _background_runner():
+    """Pool de hilos y filas por usuario, compartidos por todas las sesiones del proceso."""
+    lock = threading.Lock()
+    return {
+        "executor": ThreadPoolExecutor(max_workers=TRABAJADORES_SEGUNDO_PLANO, thread_name_prefix="segundo-plano"),
+        "lock": lock,
+        "cambio": threading.Condition(lock),
+        "usuarios": {},
+    }
 
 
+def _background_user(runner, uid):
+    usuario = runner["usuarios"].get(uid)
+    if usuario is None:
+        usuario = {"fila": deque(), "activas": 0, "pendientes": 0, "errores": [], "perfiles": {}}
+        runner["usuarios"][uid] = usuario
+    return usuario
 
 
+def submit_background(uid, etiqueta, fn, *args, bloquear=True, sesion=None, **kwargs):
+    """Encola ``fn(*args, **kwargs)`` en la fila del usuario y devuelve un Future.
 
+    Si la fila está llena espera hasta ESPERA_BACKPRESSURE segundos (o nada si
+    ``bloquear`` es False) y después lanza BackgroundBusy. El consumo de la
+    tarea se carga a ``sesion`` o, por defecto, a la sesión que la encola.
+    """
+    runner = _background_runner()
+    futuro = Future()
+    sesion = sesion or usage_session()
+    with runner["cambio"]:
+        usuario = _background_user(runner, uid)
+        limite = time.time() + (ESPERA_BACKPRESSURE if bloquear else 0)
+        while usuario["pendientes"] >= TAREAS_PENDIENTES_POR_USUARIO:
+            restante = limite - time.time()
+            if restante <= 0:
+                raise BackgroundBusy(f"Demasiadas operaciones en curso ({usuario['pendientes']}).")
+            runner["cambio"].wait(restante)
+        usuario["pendientes"] += 1
+        usuario["fila"].append((etiqueta, fn, args, kwargs, futuro, sesion))
+        _dispatch_background(runner, uid, usuario)
+    return futuro
+
+
+def _dispatch_background(runner, uid, usuario):
+    """Pasa tareas de la fila del usuario al pool sin superar su límite de concurrencia."""
+    while usuario["fila"] and usuario["activas"] < TAREAS_ACTIVAS_POR_USUARIO:
+        tarea = usuario["fila"].popleft()
+        usuario["activas"] += 1
+        runner["executor"].submit(_run_background, runner, uid, tarea)
+
+
+def _run_background(runner, uid, tarea):
+    etiqueta, fn, args, kwargs, futuro, sesion = tarea
+    token = _sesion_consumo.set(sesion)
+    try:
+        futuro.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        futuro.set_exception(e)
+        with runner["lock"]:
+            _background_user(runner, uid)["errores"].append(f"{etiqueta}: {e}")
+    finally:
+        _sesion_consumo.reset(token)
+        with runner["cambio"]:
+            usuario = _background_user(runner, uid)
+            usuario["activas"] -= 1
+            usuario["pendientes"] -= 1
+            runner["cambio"].notify_all()
+            _dispatch_background(runner, uid, usuario)
+
+
+def background_pending(uid):
+    """Tareas del usuario encoladas o en ejecución."""
+    runner = _background_runner()
+    with runner["lock"]:
+        return _background_user(runner, uid)["pendientes"]
+
+
+def pop_background_errors(uid):
+    """Devuelve y limpia los errores de tareas en segundo plano del usuario."""
+    runner = _background_runner()
+    with runner["lock"]:
+        usuario = _background_user(runner, uid)
+        errores, usuario["errores"] = usuario["errores"], []
+    return errores
+
+
+def _track_profile_change(uid, nombre, cambio):
+    """Registra un perfil que se está creando o borrando para mostrarlo antes de que termine."""
+    runner = _background_runner()
+    with runner["lock"]:
+        perfiles = _background_user(runner, uid)["perfiles"]
+        if cambio is None:
+            perfiles.pop(nombre, None)
+        else:
+            perfiles[nombre] = cambio
+
+
+def _run_profile_change(uid, nombre, fn):
+    try:
+        fn(uid, nombre)
+    finally:
+        _track_profile_change(uid, nombre, None)
 
 
+def create_profile_async(uid, nombre):
+    """Crea el perfil en segundo plano; ``with_pending_profiles`` ya lo muestra."""
+    take_token("escritura", uid)
+    _track_profile_change(uid, nombre, "crear")
+    return submit_background(uid, f"crear perfil '{nombre}'", _run_profile_change, uid, nombre, create_profile)
 
 
+def delete_profile_async(uid, nombre):
+    """Borra el perfil en segundo plano; ``with_pending_profiles`` ya lo oculta."""
+    take_token("escritura", uid)
+    _track_profile_change(uid, nombre, "borrar")
+    return submit_background(uid, f"borrar perfil '{nombre}'", _run_profile_change, uid, nombre, delete_profile)
 
 
+def with_pending_profiles(uid, perfiles):
+    """Aplica a la lista de perfiles las creaciones y borrados que siguen en curso."""
+    runner = _background_runner()
+    with runner["lock"]:
+        cambios = dict(_background_user(runner, uid)["perfiles"])
+    resultado = [p for p in perfiles if cambios.get(p) != "borrar"]
+    resultado += [p for p, cambio in cambios.items() if cambio == "crear" and p not in resultado]
+    return resultado
 
+# ============================
+# COLA DEL DOCUMENTO BASE (WRITE-BEHIND)
+# ============================
 
+# Cada clic escribe su operación en el registro antes de que commit_op vuelva;
+# lo único que se difiere es actualizar el documento base (pilas, resumen,
+# op_head y la clasificación): una ráfaga de clics se agrupa en una sola escritura cuando
+# pasan GUARDADO_DEBOUNCE segundos sin cambios nuevos, y nunca se espera más de
+# GUARDADO_MAX_ESPERA desde el primer cambio pendiente. Si la escritura falla
+# se reintenta; al cerrar el proceso, cerrar sesión o cambiar de perfil se
+# vacía la cola. Si el proceso muere antes, las operaciones siguen en el
+# registro y se reaplican al leer el perfil; sólo se pierden el último
+# resumen y las últimas entradas de las pilas de deshacer/rehacer.
+GUARDADO_DEBOUNCE = 1.0
+GUARDADO_MAX_ESPERA = 5.0
+GUARDADO_REINTENTO = 5.0
+MAX_ESCRITURAS_BATCH = 450
+
+
+@st.cache_resource
+def _write_queues():
+    """Colas de escritura por perfil, compartidas por todas las sesiones del proceso."""
+    registro = {"lock": threading.Lock(), "colas": {}}
+    atexit.register(flush_all_writes)
+    return registro
+
+
+def _write_queue(uid, perfil):
+    registro = _write_queues()
+    with registro["lock"]:
+        cola = registro["colas"].get((uid, perfil))
+        if cola is None:
+            cola = {
+                "lock": threading.RLock(),
+                "estado": None,
+                "ops": [],
+                "desde": None,
+                "timer": None,
+                "en_vuelo": False,
+                "error": None,
+                "compactado": 0.0,
+                "version": None,
+                "sesion": None,
+            }
+            registro["colas"][(uid, perfil)] = cola
+        return cola
+
+
+def _schedule_flush(cola, uid, perfil, espera=None):
+    """(Re)programa el guardado de la cola respetando el debounce y la espera máxima."""
+    if cola["timer"] is not None:
+        cola["timer"].cancel()
+    if espera is None:
+        limite = cola["desde"] + GUARDADO_MAX_ESPERA - time.time()
+        espera = max(0.0, min(GUARDADO_DEBOUNCE, limite))
+    timer = threading.Timer(espera, _submit_flush, args=(uid, perfil))
+    timer.daemon = True
+    cola["timer"] = timer
+    timer.start()
+
+
+def _submit_flush(uid, perfil):
+    """Lleva el guardado de la cola al pool de segundo plano (se reintenta si está saturado).
+
+    El guardado se carga a la última sesión que encoló cambios.
+    """
+    cola = _write_queue(uid, perfil)
+    try:
+        submit_background(uid, f"guardar '{perfil}'", flush_writes, uid, perfil, bloquear=False, sesion=cola["sesion"])
+    except BackgroundBusy:
+        with cola["lock"]:
+            _schedule_flush(cola, uid, perfil, espera=GUARDADO_REINTENTO)
+
+
+def pending_state(uid, perfil):
+    """Estado local del perfil si tiene operaciones que aún no se reflejan en el documento base, o None."""
+    cola = _write_queues()["colas"].get((uid, perfil))
+    if cola is None:
+        return None
+    with cola["lock"]:
+        if cola["ops"] or cola["en_vuelo"]:
+            return cola["estado"]
+    return None
+
+
+def pending_write_count(uid, perfil):
+    """Número de operaciones del perfil que aún no se reflejan en el documento base."""
+    cola = _write_queues()["colas"].get((uid, perfil))
+    if cola is None:
+        return 0
+    with cola["lock"]:
+        return len(cola["ops"]) + (1 if cola["en_vuelo"] else 0)
+
+
+def write_error(uid, perfil):
+    """Último error de guardado del perfil (se limpia al guardar con éxito)."""
+    cola = _write_queues()["colas"].get((uid, perfil))
+    return cola["error"] if cola else None
+
+
+@metered
+def flush_writes(uid, perfil, esperar=False):
+    """Actualiza el documento base con las operaciones ya guardadas desde el último guardado.
+
+    Si el perfil acumuló COMPACTAR_CADA operaciones desde la última
+    instantánea, además escribe una instantánea nueva y borra las operaciones
+    que ya incluye. Con ``esperar`` aguarda a que termine un guardado en curso
+    en lugar de dejarlo para el siguiente turno. Devuelve True si la cola quedó
+    vacía.
+    """
+    cola = _write_queue(uid, perfil)
+    limite = time.time() + 10
+    while esperar and cola["en_vuelo"] and time.time() < limite:
+        time.sleep(0.05)
+    with cola["lock"]:
+        if cola["en_vuelo"]:
+            return False
+        if cola["timer"] is not None:
+            cola["timer"].cancel()
+            cola["timer"] = None
+        op_ids = cola["ops"]
+        if not op_ids:
+            return True
+        if over_budget(uid, "escrituras"):
+            cola["error"] = "límite diario de escrituras alcanzado; se guardará cuando se renueve"
+            _schedule_flush(cola, uid, perfil, espera=CONSUMO_REINTENTO)
+            return False
+        estado = cola["estado"]
+        cola["ops"] = []
+        cola["desde"] = None
+        cola["en_vuelo"] = True
+        deshacer = list(estado["deshacer"])
+        rehacer = list(estado["rehacer"])
+        resumen = profile_summary(estado["brainrots"], estado["cuentas"])
+        visto = estado.get("guardado")
+        compactar = estado["pendientes"] >= COMPACTAR_CADA and time.time() - cola["compactado"] > COMPACTAR_MARGEN
 
+    try:
+        base = {"op_head": max(op_ids), "guardado": new_op_id(), "deshacer": deshacer, "rehacer": rehacer, "resumen": resumen}
+        resumen, recalculado = _write_profile_head(db.transaction(), uid, perfil, base, visto)
+        leaderboard_written(uid, perfil, resumen)
+        with cola["lock"]:
+            # Un estado al que le faltan operaciones de otro proceso lo sigue
+            # estando: sus guardados recalculan el resumen hasta que se recargue.
+            estado["guardado"] = None if recalculado else base["guardado"]
+        if compactar:
+            compactadas = compact_profile(uid, perfil)
+            with cola["lock"]:
+                cola["compactado"] = time.time()
+                estado["pendientes"] = max(0, estado["pendientes"] - compactadas)
+    except Exception as e:
+        with cola["lock"]:
+            cola["ops"] = op_ids + cola["ops"]
+            cola["desde"] = cola["desde"] or time.time()
+            cola["error"] = str(e)
+            cola["en_vuelo"] = False
+            _schedule_flush(cola, uid, perfil, espera=GUARDADO_REINTENTO)
+        return False
+
+    version = invalidate_profile(uid, perfil)
+    compartido = share_token(uid, perfil) is not None
+    with cola["lock"]:
+        cola["en_vuelo"] = False
+        cola["error"] = None
+        # Sin version propia las sesiones descartan el estado local desfasado.
+        cola["version"] = None if estado["guardado"] is None else version
+        if cola["ops"]:
+            _schedule_flush(cola, uid, perfil)
+            return False
+        brainrots = [dict(b) for b in estado["brainrots"]]
+    record_income_snapshot(uid, perfil, brainrots)
+    if compartido:
+        refresh_share(uid, perfil, brainrots)
+    return True
+
+
+def flush_all_writes(uid=None):
+    """Vacía las colas de todos los perfiles (o sólo las de ``uid``)."""
+    registro = _write_queues()
+    with registro["lock"]:
+        claves = [clave for clave in registro["colas"] if uid is None or clave[0] == uid]
+    for clave in claves:
+        flush_writes(*clave, esperar=True)
+
+
+def discard_writes(uid, perfil):
+    """Descarta la cola de un perfil (por ejemplo, al borrarlo)."""
+    registro = _write_queues()
+    with registro["lock"]:
+        cola = registro["colas"].pop((uid, perfil), None)
+    if cola is not None and cola["timer"] is not None:
+        cola["timer"].cancel()
 
+# ============================
+# PRECARGA DE PERFILES
+# ============================
 
+# Al iniciar sesión se leen en segundo plano los documentos de todos los
+# perfiles con un solo get_all y se guardan en la sesión, así que cambiar de
+# perfil no vuelve a Firestore. Cada estado guarda la versión compartida con la
+# que se leyó y se vuelve a leer si otro proceso escribió el perfil después. La
+# caché se renueva cada PRECARGA_TTL segundos, pero sólo se descargan los
+# perfiles cuyo update_time cambió o que tienen operaciones nuevas desde que se
+# decodificaron.
+PRECARGA_TTL = 300
+
+
+@metered
+def prefetch_profiles(uid, perfiles):
+    """Lee y decodifica todos los perfiles indicados; devuelve ``({perfil: estado}, {perfil: versión})``."""
+    versiones = {perfil: profile_version(uid, perfil) for perfil in perfiles}
+    refs = [_profile_ref(uid, perfil) for perfil in perfiles]
+    estados = {}
+    cambiados = []
+    if over_budget(uid, "lecturas"):
+        for ref in refs:
+            estado = decoded_profile(uid, ref.id)
+            if estado is not None:
+                estados[ref.id] = estado
+        refs = [ref for ref in refs if ref.id not in estados]
+    for meta in db.get_all(refs, field_paths=[]):
+        if read_doc(meta) is None:
+            estados[meta.id] = empty_profile_state()
+            continue
+        estado = decoded_profile(uid, meta.id, meta.update_time)
+        if estado is None or has_newer_ops(meta.reference, estado):
+            cambiados.append(meta.reference)
+        else:
+            estados[meta.id] = estado
+    if cambiados:
+        version_catalogo = current_catalog()["version"]
+        for doc in db.get_all(cambiados):
+            estados[doc.id] = _profile_state(doc.reference, doc)
+            remember_decoded_profile(uid, doc.id, doc.update_time, estados[doc.id], version_catalogo)
+    return estados, versiones
+
+
+def _is_own_write(uid, perfil, estado, version):
+    """Indica si ``version`` la dejó el guardado de ``estado`` en este proceso."""
+    registro = _write_queues()
+    with registro["lock"]:
+        cola = registro["colas"].get((uid, perfil))
+    return cola is not None and cola["estado"] is estado and cola["version"] == version
+
+
+def _profile_cache(uid, perfiles):
+    cache = st.session_state.get("perfiles_cache")
+    catalogo = current_catalog()["version"]
+    if (
+        not cache or cache["uid"] != uid or cache["catalogo"] != catalogo
+        or time.time() - cache["cargado"] > PRECARGA_TTL
+    ):
+        cache = {"uid": uid, "catalogo": catalogo, "cargado": time.time(), "estados": {}, "versiones": {}, "futuro": None}
+        st.session_state["perfiles_cache"] = cache
+        try:
+            cache["futuro"] = submit_background(uid, "precargar perfiles", prefetch_profiles, uid, list(perfiles))
+        except BackgroundBusy:
+            pass
+    futuro = cache["futuro"]
+    if futuro is not None and futuro.done():
+        cache["futuro"] = None
+        if futuro.exception() is None:
+            estados, versiones = futuro.result()
+            for perfil, estado in estados.items():
+                if perfil not in cache["estados"]:
+                    cache["estados"][perfil] = estado
+                    cache["versiones"][perfil] = versiones.get(perfil)
+    return cache
+
+
+def start_profile_prefetch(uid, perfiles):
+    """Lanza la precarga de los perfiles si la caché de la sesión está vacía o caducó."""
+    _profile_cache(uid, perfiles)
+
+
+def cached_profile(uid, perfil):
+    """Como ``load_profile`` pero sirviendo desde la precarga de la sesión cuando se puede."""
+    local = pending_state(uid, perfil)
+    if local is not None:
+        return local
+    cache = _profile_cache(uid, [perfil])
+    version = profile_version(uid, perfil)
+    if perfil in cache["estados"] and version is not None and version != cache["versiones"].get(perfil):
+        if _is_own_write(uid, perfil, cache["estados"][perfil], version):
+            cache["versiones"][perfil] = version
+        else:
+            del cache["estados"][perfil]
+    if perfil not in cache["estados"]:
+        cache["estados"][perfil] = load_profile(uid, perfil)
+        cache["versiones"][perfil] = version
+    return cache["estados"][perfil]
+
+
+def forget_cached_profile(perfil, estado=None):
+    """Actualiza la precarga tras crear (``estado`` vacío) o borrar (None) un perfil."""
+    cache = st.session_state.get("perfiles_cache")
+    if not cache:
+        return
+    cache["versiones"].pop(perfil, None)
+    if estado is None:
+        cache["estados"].pop(perfil, None)
+    else:
+        cache["estados"][perfil] = estado
 
+# ============================
+# HISTORIAL DE INGRESOS
+# ============================
 
+# Un documento por perfil en perfiles/{uid}/historial/{perfil} con tres series
+# ("h" horas, "d" días, "w" semanas). Cada serie es un mapa inicio_del_periodo ->
+# punto; un periodo guarda el último valor registrado en él, así que las tres
+# resoluciones se actualizan en la misma escritura y un gráfico es una lectura.
+# Se registra un punto al ver el inventario y cada vez que flush_writes guarda
+# cambios. La primera escritura de cada día (por proceso) lee las claves de las
+# series con retención y borra las caducadas en esa misma escritura; al leer
+# sólo se filtran.
+HISTORIAL_RESOLUCIONES = {"Horas": "h", "Días": "d", "Semanas": "w"}
+HISTORIAL_RETENCION = {"h": 7 * 24 * 3600, "d": 400 * 24 * 3600, "w": None}
+HISTORIAL_INTERVALO = 15 * 60  # segundos mínimos entre escrituras dentro de la misma hora
 
 
+def _history_ref(uid, perfil):
+    return db.collection("perfiles").document(uid).collection("historial").document(perfil)
 
 
+def _field_path(*partes):
+    return ".".join(f"`{parte}`" for parte in partes)
 
 
+@st.cache_resource
+def _history_state():
+    """Último punto escrito por perfil, compartido entre todas las sesiones del proceso."""
+    return {"lock": threading.Lock(), "perfiles": {}}
 
 
+def income_snapshot(brainrots):
+    """Resume el inventario en ingreso total, copias e ingreso por cuenta."""
+    por_cuenta = {}
+    for brainrot in brainrots:
+        cuenta = brainrot.get("Cuenta") or "(ninguna)"
+        por_cuenta[cuenta] = por_cuenta.get(cuenta, 0) + item_income(brainrot)
+    return {
+        "t": sum(por_cuenta.values()),
+        "n": sum(item_count(b) for b in brainrots),
+        "c": por_cuenta,
+    }
 
 
+def history_buckets(ts):
+    """Inicio (epoch UTC, como texto) de la hora, el día y la semana ISO que contienen ``ts``."""
+    hora = int(ts) // 3600 * 3600
+    dia = int(ts) // 86400 * 86400
+    semana = dia - time.gmtime(dia).tm_wday * 86400
+    return {"h": str(hora), "d": str(dia), "w": str(semana)}
 
 
+def record_income_snapshot(uid, perfil, brainrots, ahora=None):
+    """Agrega el ingreso actual al historial si cambió.
 
+    Se escribe como mucho una vez cada ``HISTORIAL_INTERVALO`` dentro de la
+    misma hora; un cambio que se salta por ese límite se escribe en la
+    siguiente llamada en que se cumpla. La escritura va al pool de segundo
+    plano; devuelve si se encoló.
+    """
+    ahora = time.time() if ahora is None else ahora
+    if over_budget(uid, "escrituras"):
+        return False
+    punto = income_snapshot(brainrots)
+    buckets = history_buckets(ahora)
+    estado = _history_state()
+    with estado["lock"]:
+        ultimo = estado["perfiles"].get((uid, perfil))
+        if ultimo and ultimo["punto"] == punto:
+            return False
+        if ultimo and ultimo["hora"] == buckets["h"] and ahora - ultimo["escrito"] < HISTORIAL_INTERVALO:
+            return False
+        podar = not ultimo or ultimo["dia"] != buckets["d"]
+        estado["perfiles"][(uid, perfil)] = {"punto": punto, "hora": buckets["h"], "dia": buckets["d"], "escrito": ahora}
+
+    data = {serie: {clave: punto} for serie, clave in buckets.items()}
+    try:
+        submit_background(
+            uid, "historial de ingresos", _write_income_snapshot, uid, perfil, data, ahora if podar else None, bloquear=False
+        )
+    except BackgroundBusy:
+        with estado["lock"]:
+            estado["perfiles"].pop((uid, perfil), None)
+        return False
+    return True
 
 
+def expired_history_keys(puntos, retencion, ahora):
+    return [clave for clave in puntos if int(clave) < ahora - retencion]
 
 
+@metered
+def _write_income_snapshot(uid, perfil, data, podar_hasta=None):
+    """Escribe el punto; con ``podar_hasta`` borra en la misma escritura los caducados a esa fecha."""
+    ref = _history_ref(uid, perfil)
+    try:
+        if podar_hasta is not None:
+            series = [serie for serie, retencion in HISTORIAL_RETENCION.items() if retencion]
+            guardado = read_doc(ref.get(field_paths=series)) or {}
+            data = {serie: dict(puntos) for serie, puntos in data.items()}
+            for serie in series:
+                for clave in expired_history_keys(guardado.get(serie, {}), HISTORIAL_RETENCION[serie], podar_hasta):
+                    data[serie][clave] = firestore.DELETE_FIELD
+        ref.set(data, merge=[_field_path(s, c) for s, c in data.items() for c in data[s]])
+        count_write(data)
+    except Exception:
+        estado = _history_state()
+        with estado["lock"]:
+            estado["perfiles"].pop((uid, perfil), None)
+        raise
+
+
+@metered
+def load_income_history(uid, perfil, serie="d", ahora=None):
+    """Devuelve los puntos ``(ts, punto)`` de una serie ordenados, sin los que caducaron.
+
+    Sólo lee: los caducados se borran al registrar un punto nuevo.
+    """
+    ahora = time.time() if ahora is None else ahora
+    doc = _history_ref(uid, perfil).get(field_paths=[serie])
+    puntos = (read_doc(doc) or {}).get(serie, {})
+    retencion = HISTORIAL_RETENCION.get(serie)
+    if retencion:
+        for clave in expired_history_keys(puntos, retencion, ahora):
+            puntos.pop(clave)
+    return sorted((int(clave), punto) for clave, punto in puntos.items())
+
+
+def income_history_frame(puntos):
+    """DataFrame para graficar: una columna Total y una por cuenta, indexado por fecha."""
+    filas = []
+    for ts, punto in puntos:
+        fila = {"Total": punto.get("t", 0)}
+        fila.update(punto.get("c", {}))
+        filas.append(fila)
+    return pd.DataFrame(filas, index=pd.to_datetime([ts for ts, _ in puntos], unit="s")).fillna(0)
 
+# ============================
+# CLASIFICACIÓN GLOBAL
+# ============================
 
+# Cada usuario tiene un documento clasificacion/{uid} con sus totales (suma de
+# los resúmenes de sus perfiles) y el total global se reparte en
+# CLASIFICACION_FRAGMENTOS documentos de clasificacion_global para no
+# concentrar las escrituras en uno solo. Cada guardado suma con Increment la
+# diferencia entre el resumen nuevo y el último conocido del perfil, dentro
+# del mismo batch. El top y la posición salen de una consulta ordenada y de un
+# count() cacheados; ``reconcile_leaderboard`` recalcula los totales desde los
+# perfiles para corregir desvíos (escrituras concurrentes desde otro proceso).
+# Sólo aparecen en el top y cuentan para las posiciones los usuarios con
+# ``publico`` (por defecto no), bajo un alias aleatorio o elegido por ellos;
+# las consultas filtran por ``publico == True``, lo que requiere un índice
+# compuesto (publico, métrica) en Firestore.
+METRICAS_CLASIFICACION = {"ingreso": "Ingreso total", "raros": "Secretos y OG"}
+RAREZAS_CLASIFICACION = ("Secreto", "OG")
+CLASIFICACION_FRAGMENTOS = 10
+CLASIFICACION_TOP = 20
+CLASIFICACION_TTL = 60
+RECONCILIACION_INTERVALO = 24 * 3600
+ALIAS_MAX = 24
+
+
+def _leaderboard_ref(uid):
+    return db.collection("clasificacion").document(uid)
+
+
+@st.cache_resource
+def _leaderboard_state():
+    """Último resumen conocido de cada perfil (base de los incrementos) y reconciliaciones hechas."""
+    return {"lock": threading.Lock(), "bases": {}, "reconciliado": {}}
+
+
+def leaderboard_totals(resumen):
+    """Valores del perfil que suman a la clasificación."""
+    resumen = resumen or {}
+    return {metrica: resumen.get(metrica) or 0 for metrica in METRICAS_CLASIFICACION}
+
+
+def remember_leaderboard_bases(uid, resumenes, reemplazar=False):
+    """Registra los resúmenes leídos de Firestore como base de los próximos incrementos."""
+    estado = _leaderboard_state()
+    with estado["lock"]:
+        for perfil, resumen in resumenes.items():
+            if reemplazar or (uid, perfil) not in estado["bases"]:
+                estado["bases"][(uid, perfil)] = leaderboard_totals(resumen)
+
+
+def leaderboard_writes(uid, perfil, resumen, ref=None, anterior=None):
+    """Escrituras ``(ref, data)`` que llevan a la clasificación el cambio de resumen del perfil.
+
+    ``anterior`` es el resumen guardado si ya se leyó (por ejemplo dentro de
+    una transacción). Si no se da ni se conoce, se lee sólo ese campo del
+    perfil (``ref`` permite leerlo antes de borrarlo). Devuelve una lista
+    vacía si nada cambió.
+    """
+    if anterior is not None:
+        anterior = leaderboard_totals(anterior)
+    else:
+        estado = _leaderboard_state()
+        with estado["lock"]:
+            anterior = estado["bases"].get((uid, perfil))
+    if anterior is None:
+        ref = ref or _profile_ref(uid, perfil)
+        anterior = leaderboard_totals((read_doc(ref.get(field_paths=["resumen"])) or {}).get("resumen"))
+    nuevo = leaderboard_totals(resumen)
+    delta = {metrica: nuevo[metrica] - anterior[metrica] for metrica in nuevo if nuevo[metrica] != anterior[metrica]}
+    if not delta:
+        return []
+    incrementos = {metrica: firestore.Increment(valor) for metrica, valor in delta.items()}
+    fragmento = db.collection("clasificacion_global").document(str(random.randrange(CLASIFICACION_FRAGMENTOS)))
+    return [(_leaderboard_ref(uid), incrementos), (fragmento, incrementos)]
 
 
+def commit_leaderboard_writes(batch, escrituras):
+    for ref, data in escrituras:
+        batch.set(ref, data, merge=True)
+        count_write(data)
 
 
+def leaderboard_written(uid, perfil, resumen):
+    """Tras confirmar el batch, el resumen escrito pasa a ser la base del perfil."""
+    estado = _leaderboard_state()
+    with estado["lock"]:
+        if resumen is None:
+            estado["bases"].pop((uid, perfil), None)
+        else:
+            estado["bases"][(uid, perfil)] = leaderboard_totals(resumen)
 
 
+def random_alias():
+    """Alias por defecto en la clasificación: no se deriva del correo ni del uid."""
+    return f"Jugador-{os.urandom(3).hex()}"
 
 
+def forget_leaderboard_cache(uid):
+    """Invalida el top y la posición del usuario tras cambiar su visibilidad o alias."""
+    try:
+        cache = shared_cache()
+        cache.delete(f"clasificacion:posicion:{uid}")
+        for metrica in METRICAS_CLASIFICACION:
+            cache.delete(f"clasificacion:top:{metrica}:{CLASIFICACION_TOP}")
+    except Exception:
+        pass
 
 
+@metered
+def leaderboard_settings(uid):
+    """``(publico, nombre)`` del usuario en la clasificación."""
+    data = read_doc(_leaderboard_ref(uid).get(field_paths=["publico", "nombre"])) or {}
+    return bool(data.get("publico")), data.get("nombre") or ""
 
 
+@metered
+def set_leaderboard_settings(uid, publico, nombre):
+    """Guarda si el usuario aparece en la clasificación y con qué alias.
 
+    Un alias vacío se sustituye por uno aleatorio. Devuelve el alias guardado.
+    """
+    nombre = (nombre or "").strip()[:ALIAS_MAX] or random_alias()
+    data = {"publico": bool(publico), "nombre": nombre}
+    _leaderboard_ref(uid).set(data, merge=True)
+    count_write(data)
+    forget_leaderboard_cache(uid)
+    return nombre
 
 
+@metered
+def reconcile_leaderboard(uid):
+    """Recalcula los totales del usuario desde los resúmenes de sus perfiles.
 
+    Fija los valores absolutos en su documento y corrige el total global con
+    la diferencia respecto a lo que había acumulado.
+    """
+    col = db.collection("perfiles").document(uid).collection("data").select(["resumen"]).stream()
+    resumenes = {doc.id: (read_doc(doc) or {}).get("resumen") for doc in col}
+    totales = dict.fromkeys(METRICAS_CLASIFICACION, 0)
+    for resumen in resumenes.values():
+        for metrica, valor in leaderboard_totals(resumen).items():
+            totales[metrica] += valor
+    actual = read_doc(_leaderboard_ref(uid).get()) or {}
+    correccion = {m: totales[m] - (actual.get(m) or 0) for m in totales if totales[m] != (actual.get(m) or 0)}
+
+    data = dict(totales, reconciliado=firestore.SERVER_TIMESTAMP)
+    if not actual.get("nombre"):
+        data["nombre"] = random_alias()
+    if "publico" not in actual:
+        data["publico"] = False
+    batch = db.batch()
+    batch.set(_leaderboard_ref(uid), data, merge=True)
+    count_write(data)
+    if correccion:
+        fragmento = db.collection("clasificacion_global").document(str(random.randrange(CLASIFICACION_FRAGMENTOS)))
+        incrementos = {metrica: firestore.Increment(valor) for metrica, valor in correccion.items()}
+        batch.set(fragmento, incrementos, merge=True)
+        count_write(incrementos)
+    batch.commit()
+
+    remember_leaderboard_bases(uid, resumenes, reemplazar=True)
+    estado = _leaderboard_state()
+    with estado["lock"]:
+        estado["reconciliado"][uid] = time.time()
+    try:
+        shared_cache().delete(f"clasificacion:posicion:{uid}")
+    except Exception:
+        pass
+    return totales
+
+
+def schedule_leaderboard_reconcile(uid):
+    """Reconcilia al usuario en segundo plano si no se hizo en RECONCILIACION_INTERVALO."""
+    estado = _leaderboard_state()
+    with estado["lock"]:
+        if time.time() - estado["reconciliado"].get(uid, 0) < RECONCILIACION_INTERVALO:
+            return False
+        estado["reconciliado"][uid] = time.time()
+    try:
+        submit_background(uid, "clasificación", reconcile_leaderboard, uid, bloquear=False)
+    except BackgroundBusy:
+        with estado["lock"]:
+            estado["reconciliado"].pop(uid, None)
+        return False
+    return True
+
+
+@metered
+def leaderboard_top(uid, metrica, n=CLASIFICACION_TOP):
+    """Top ``n`` público de la métrica: lista de ``{"uid", "nombre", "valor"}`` cacheada CLASIFICACION_TTL segundos."""
+    clave = f"clasificacion:top:{metrica}:{n}"
+    top = cache_get_json(clave)
+    if top is not None:
+        return top
+    consulta = (
+        db.collection("clasificacion")
+        .where("publico", "==", True)
+        .order_by(metrica, direction=firestore.Query.DESCENDING)
+        .limit(n)
+        .select([metrica, "nombre"])
+    )
+    top = []
+    for doc in consulta.stream():
+        data = read_doc(doc) or {}
+        top.append({"uid": doc.id, "nombre": data.get("nombre") or "Jugador", "valor": data.get(metrica) or 0})
+    cache_set_json(clave, top, CLASIFICACION_TTL)
+    return top
+
+
+@metered
+def leaderboard_position(uid, metrica):
+    """``(posición, valor)`` del usuario entre los jugadores públicos.
+
+    La posición es None si el usuario aún no figura o no es público.
+    """
+    clave = f"clasificacion:posicion:{uid}"
+    posiciones = cache_get_json(clave) or {}
+    if metrica in posiciones:
+        return tuple(posiciones[metrica])
+    data = read_doc(_leaderboard_ref(uid).get(field_paths=[metrica, "publico"])) or {}
+    if metrica not in data:
+        return None, 0
+    valor = data[metrica]
+    if not data.get("publico"):
+        return None, valor
+    consulta = db.collection("clasificacion").where("publico", "==", True).where(metrica, ">", valor)
+    superiores = consulta.count().get()[0][0].value
+    count_read()
+    posiciones[metrica] = (superiores + 1, valor)
+    cache_set_json(clave, posiciones, CLASIFICACION_TTL)
+    return superiores + 1, valor
+
+
+@metered
+def leaderboard_global(uid):
+    """Suma de los fragmentos del total global, cacheada CLASIFICACION_TTL segundos."""
+    totales = cache_get_json("clasificacion:global")
+    if totales is not None:
+        return totales
+    refs = [db.collection("clasificacion_global").document(str(i)) for i in range(CLASIFICACION_FRAGMENTOS)]
+    totales = dict.fromkeys(METRICAS_CLASIFICACION, 0)
+    for doc in db.get_all(refs):
+        for metrica, valor in leaderboard_totals(read_doc(doc)).items():
+            totales[metrica] += valor
+    cache_set_json("clasificacion:global", totales, CLASIFICACION_TTL)
+    return totales
 
+# ============================
+# INSTANTÁNEAS COMPARTIDAS
+# ============================
 
+# "Compartir" publica una instantánea de sólo lectura del perfil en
+# compartidos/{token}: la tabla ya renderizada (mismo inventory_html e
+# insignias que la interfaz), comprimida con zlib. Quien abre ?compartido=token
+# (o /compartido/{token} en la API) la recibe de la caché compartida, o de una
+# sola lectura del documento, sin sesión, sin cargar el perfil y sin pandas.
+# La instantánea se regenera en segundo plano después de cada guardado del
+# perfil y sólo se escribe si el HTML cambió.
+COMPARTIDO_MAX_PILAS = 1000
+COMPARTIDO_TTL = 7 * 86400
+COMPARTIDO_SIN_TOKEN_TTL = 300
+
+
+def _share_ref(token):
+    return db.collection("compartidos").document(token)
+
+
+def share_fragment(perfil, brainrots):
+    """HTML autocontenido (estilos, encabezado y tabla) de la instantánea."""
+    ordenados = heapq.nlargest(COMPARTIDO_MAX_PILAS, brainrots, key=lambda b: b.get("Total") or 0)
+    copias = sum(item_count(b) for b in brainrots)
+    ingreso = sum(item_income(b) for b in brainrots)
+    partes = [
+        RARITY_BADGE_STYLE,
+        COLOR_BADGE_STYLE,
+        f"<h3>📒 {html.escape(perfil)}</h3>",
+        f"<p>{len(brainrots)} pilas · {copias} copias · Ingreso: {format_num(ingreso)}</p>",
+    ]
+    if len(brainrots) > len(ordenados):
+        partes.append(f"<p>Se muestran las {len(ordenados)} pilas con mayor Total.</p>")
+    partes.append(inventory_html(ordenados) if ordenados else "<p>El inventario está vacío.</p>")
+    return "\n".join(partes)
+
+
+def share_page(fragmento):
+    """Página HTML completa para servir la instantánea fuera de Streamlit."""
+    return (
+        "<!doctype html><html><head><meta charset='utf-8'>"
+        "<meta name='viewport' content='width=device-width, initial-scale=1'>"
+        "<title>Inventario de Brainrots</title></head>"
+        f"<body style='font-family: sans-serif'>{fragmento}</body></html>"
+    )
+
+
+def share_url(token):
+    """Enlace público de la instantánea ([compartir] url_base en secrets o la URL de la app)."""
+    base = st.secrets.get("compartir", {}).get("url_base") or st.context.url or ""
+    return f"{base.split('?')[0]}?compartido={token}"
+
+
+def share_token(uid, perfil):
+    """Token de la instantánea del perfil, o None si no está compartido."""
+    clave = f"compartido:perfil:{uid}:{perfil}"
+    token = cache_get_json(clave)
+    if token is None:
+        consulta = (
+            db.collection("compartidos")
+            .where("uid", "==", uid)
+            .where("perfil", "==", perfil)
+            .limit(1)
+            .select([])
+        )
+        token = next((doc.id for doc in consulta.stream() if read_doc(doc) is not None), "")
+        cache_set_json(clave, token, COMPARTIDO_TTL if token else COMPARTIDO_SIN_TOKEN_TTL)
+    return token or None
+
+
+@metered
+def publish_share(uid, perfil, brainrots, token=None):
+    """Renderiza y guarda la instantánea; devuelve su token (nuevo si el perfil no estaba compartido).
+
+    Con ``token`` sólo se regenera si el perfil sigue compartido con ese token.
+    """
+    actual = share_token(uid, perfil)
+    if token is not None and token != actual:
+        return None
+    token = actual or os.urandom(12).hex()
+    fragmento = share_fragment(perfil, brainrots)
+    huella = hashlib.sha1(fragmento.encode("utf-8")).hexdigest()
+    if cache_get_json(f"compartido:{token}:huella") == huella:
+        return token
+    fragmento += f"\n<p><small>Actualizado {time.strftime('%Y-%m-%d %H:%M', time.gmtime())} UTC</small></p>"
+    comprimido = zlib.compress(fragmento.encode("utf-8"))
+    data = {"uid": uid, "perfil": perfil, "html": comprimido, "huella": huella, "actualizado": firestore.SERVER_TIMESTAMP}
+    _share_ref(token).set(data)
+    count_write(data)
+    try:
+        shared_cache().set(f"compartido:{token}", comprimido, ex=COMPARTIDO_TTL)
+    except Exception:
+        pass
+    cache_set_json(f"compartido:{token}:huella", huella, COMPARTIDO_TTL)
+    cache_set_json(f"compartido:perfil:{uid}:{perfil}", token, COMPARTIDO_TTL)
+    return token
+
+
+def refresh_share(uid, perfil, brainrots):
+    """Tras guardar el perfil, regenera su instantánea en segundo plano si está compartido."""
+    token = share_token(uid, perfil)
+    if token is None:
+        return
+    try:
+        submit_background(uid, "instantánea compartida", publish_share, uid, perfil, brainrots, token, bloquear=False)
+    except BackgroundBusy:
+        pass
+
+
+@metered
+def unshare_profile(uid, perfil):
+    token = share_token(uid, perfil)
+    if token is None:
+        return
+    _share_ref(token).delete()
+    count_write()
+    try:
+        shared_cache().delete(f"compartido:{token}", f"compartido:{token}:huella")
+    except Exception:
+        pass
+    cache_set_json(f"compartido:perfil:{uid}:{perfil}", "", COMPARTIDO_SIN_TOKEN_TTL)
 
 
+def shared_snapshot(token):
+    """``(huella, fragmento HTML)`` de la instantánea, o None si el token no existe."""
+    try:
+        comprimido = shared_cache().get(f"compartido:{token}")
+    except Exception:
+        comprimido = None
+    if comprimido is None:
+        data = _share_ref(token).get().to_dict() if token.isalnum() else None
+        comprimido = data["html"] if data else b""
+        try:
+            shared_cache().set(f"compartido:{token}", comprimido, ex=COMPARTIDO_TTL if data else 60)
+        except Exception:
+            pass
+    if not comprimido:
+        return None
+    return hashlib.sha1(comprimido).hexdigest(), zlib.decompress(comprimido).decode("utf-8")
 
+# ============================
+# COPIAS DE SEGURIDAD (NDJSON)
+# ============================
 
+# Una copia es un NDJSON comprimido con gzip: una línea "cabecera" y, por
+# perfil, una línea "perfil" (cuentas, pilas de deshacer y número de pilas)
+# seguida de líneas "pilas" de hasta FRAGMENTO_PILAS Brainrots y, si existe,
+# una línea "historial". Se escribe y se lee perfil a perfil, así que la
+# memoria depende del perfil más grande y no de la cuenta entera.
+# La restauración escribe cada perfil con save_data en RESPALDO_HILOS hilos
+# (a lo sumo RESPALDO_EN_VUELO perfiles en memoria) y anota en un checkpoint
+# los perfiles ya escritos: repetirla con el mismo archivo salta esos perfiles.
+# El archivo lo sube el usuario, así que cada línea se valida al leerla: sólo
+# Brainrots, colores y mutaciones del catálogo vigente, cuentas con id y nombre
+# válidos, y Calidad y Total recalculados con el catálogo en lugar de
+# copiarlos. Una línea que no cumple rechaza la copia.
+RESPALDO_VERSION = 1
+RESPALDO_HILOS = 8
+RESPALDO_EN_VUELO = 16
+RESPALDO_NOMBRE_MAX = 100
+TIPOS_OPERACION = ("add", "del", "move", "cuenta+", "cuenta-", "cuenta~", "lote")
+
+
+def backup_uids():
+    """Todos los usuarios con perfiles (copia de administrador)."""
+    return [ref.id for ref in db.collection("perfiles").list_documents()]
+
+
+@metered
+def export_backup(uid, salida, uids=None):
+    """Escribe en ``salida`` (binario) la copia de ``uids`` (por defecto, sólo ``uid``); devuelve cuántos perfiles copió."""
+    uids = uids or [uid]
+    perfiles = 0
+    with gzip.GzipFile(fileobj=salida, mode="wb") as gz:
+        def escribir(registro):
+            gz.write(json.dumps(registro, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+
+        escribir({"tipo": "cabecera", "version": RESPALDO_VERSION, "creado": int(time.time()), "usuarios": len(uids)})
+        for dueño in uids:
+            flush_all_writes(dueño)
+            for doc in db.collection("perfiles").document(dueño).collection("data").stream():
+                estado = _profile_state(doc.reference, doc)
+                deshacer, rehacer = stack_ops(doc.reference, estado)
+                clave = {"uid": dueño, "perfil": doc.id}
+                escribir(dict(
+                    clave,
+                    tipo="perfil",
+                    cuentas=account_entities(estado["cuentas"]),
+                    deshacer=deshacer,
+                    rehacer=rehacer,
+                    pilas=len(estado["brainrots"]),
+                ))
+                for inicio in range(0, len(estado["brainrots"]), FRAGMENTO_PILAS):
+                    escribir(dict(clave, tipo="pilas", items=estado["brainrots"][inicio:inicio + FRAGMENTO_PILAS]))
+                historial = read_doc(_history_ref(dueño, doc.id).get())
+                if historial:
+                    escribir(dict(clave, tipo="historial", data=historial))
+                perfiles += 1
+    return perfiles
+
+
+def _backup_name(valor, campo):
+    if not isinstance(valor, str) or not valor.strip() or len(valor) > RESPALDO_NOMBRE_MAX:
+        raise ValueError(f"{campo} no válido: {valor!r}")
+    return valor
+
+
+def backup_accounts(cuentas):
+    """Cuentas de la copia validadas: ids enteros y nombres únicos."""
+    if not isinstance(cuentas, list):
+        raise ValueError("la lista de cuentas no es válida")
+    validas = []
+    for cuenta in account_entities(cuentas):
+        cuenta_id, nombre = cuenta.get("id"), _backup_name(cuenta.get("nombre"), "Nombre de cuenta")
+        if isinstance(cuenta_id, bool) or not isinstance(cuenta_id, int) or cuenta_id < 0:
+            raise ValueError(f"id de cuenta no válido: {cuenta_id!r}")
+        if nombre == "(ninguna)" or any(c["id"] == cuenta_id or c["nombre"] == nombre for c in validas):
+            raise ValueError(f"cuenta repetida o reservada: {nombre!r}")
+        validas.append({"id": cuenta_id, "nombre": nombre})
+    return validas
+
+
+def backup_item(item, catalogo, cuentas=None):
+    """Pila de la copia validada contra el catálogo, con Calidad y Total recalculados.
+
+    ``cuentas`` son los nombres válidos para "Cuenta"; None acepta cualquier
+    nombre (las operaciones de deshacer pueden nombrar cuentas ya borradas).
+    """
+    if not isinstance(item, dict):
+        raise ValueError("pila no válida")
+    nombre = item.get("Brainrot")
+    info = catalogo["brainrots"].get(nombre) if isinstance(nombre, str) else None
+    if info is None:
+        raise ValueError(f"Brainrot fuera del catálogo: {nombre!r}")
+    color = item.get("Color") or "-"
+    if not isinstance(color, str) or color not in catalogo["colores"]:
+        raise ValueError(f"color fuera del catálogo: {color!r}")
+    mutaciones = item.get("Mutaciones") or []
+    if (
+        not isinstance(mutaciones, list)
+        or any(not isinstance(m, str) or m not in catalogo["mutaciones"] for m in mutaciones)
+        or len(set(mutaciones)) != len(mutaciones)
+    ):
+        raise ValueError(f"mutaciones fuera del catálogo: {mutaciones!r}")
+    cuenta = item.get("Cuenta") or "(ninguna)"
+    if cuenta != "(ninguna)" and (_backup_name(cuenta, "Cuenta") if cuentas is None else cuenta not in cuentas):
+        raise ValueError(f"cuenta desconocida: {cuenta!r}")
+    cantidad = item.get("Cantidad", 1)
+    if isinstance(cantidad, bool) or not isinstance(cantidad, int) or cantidad < 1:
+        raise ValueError(f"cantidad no válida: {cantidad!r}")
+    item_id = item.get("id")
+    if not isinstance(item_id, str) or not re.fullmatch(r"[0-9a-f]{12}", item_id):
+        item_id = new_item_id()
+    return {
+        "id": item_id,
+        "Brainrot": nombre,
+        "Calidad": info["quality"],
+        "Color": color,
+        "Mutaciones": list(mutaciones),
+        "Cuenta": cuenta,
+        "Total": calcular_total(
+            info["income"], catalogo["colores"].get(color, 1), [catalogo["mutaciones"][m] for m in mutaciones]
+        ),
+        "Cantidad": cantidad,
+    }
 
 
+def backup_op(op, catalogo):
+    """Operación de deshacer/rehacer de la copia validada (sus pilas pasan por ``backup_item``)."""
+    if not isinstance(op, dict) or op.get("k") not in TIPOS_OPERACION:
+        raise ValueError("operación no válida")
+    limpia = {"k": op["k"]}
+    if op["k"] == "lote":
+        if not isinstance(op.get("ops"), list):
+            raise ValueError("operación no válida")
+        limpia["ops"] = [backup_op(sub, catalogo) for sub in op["ops"]]
+        return limpia
+    for campo in ("a", "n", "de"):
+        if campo in op:
+            limpia[campo] = _backup_name(op[campo], "Cuenta")
+    if op["k"] in ("add", "del", "move"):
+        limpia["b"] = backup_item(op.get("b"), catalogo)
+    if op["k"] in ("move", "cuenta+", "cuenta-", "cuenta~") and "a" not in limpia or op["k"] == "cuenta~" and "n" not in limpia:
+        raise ValueError("operación sin cuenta")
+    if "items" in op:
+        if not isinstance(op["items"], list):
+            raise ValueError("operación no válida")
+        limpia["items"] = [backup_item(item, catalogo) for item in op["items"]]
+    for campo in ("id", "pos"):
+        if campo in op:
+            if isinstance(op[campo], bool) or not isinstance(op[campo], int) or op[campo] < 0:
+                raise ValueError("operación no válida")
+            limpia[campo] = op[campo]
+    return limpia
+
+
+def backup_history(data):
+    """Historial de la copia validado: series conocidas de puntos numéricos."""
+    if not isinstance(data, dict) or any(serie not in HISTORIAL_RETENCION for serie in data):
+        raise ValueError("historial no válido")
+
+    def numero(valor):
+        return not isinstance(valor, bool) and isinstance(valor, (int, float))
+
+    for puntos in data.values():
+        if not isinstance(puntos, dict):
+            raise ValueError("historial no válido")
+        for clave, punto in puntos.items():
+            if (
+                not clave.isdigit() or not isinstance(punto, dict)
+                or not numero(punto.get("t")) or not numero(punto.get("n"))
+                or not isinstance(punto.get("c", {}), dict)
+                or any(not isinstance(c, str) or len(c) > RESPALDO_NOMBRE_MAX or not numero(v) for c, v in punto.get("c", {}).items())
+            ):
+                raise ValueError("historial no válido")
+    return data
+
+
+def backup_file(uid):
+    """Copia de los perfiles de ``uid`` escrita en un archivo temporal, abierto y al principio.
+
+    El archivo se borra al cerrarlo; así la copia no queda en memoria ni en la sesión.
+    """
+    archivo = tempfile.TemporaryFile()
+    try:
+        export_backup(uid, archivo)
+        archivo.seek(0)
+    except Exception:
+        archivo.close()
+        raise
+    return archivo
 
 
+def read_backup(entrada):
+    """Recorre una copia (binaria, gzip) entregando cada perfil completo y validado.
 
+    Lanza ValueError (con el número de línea) ante cualquier línea mal formada
+    o con datos que no están en el catálogo vigente.
+    """
+    catalogo = current_catalog()
+    actual = None
+
+    def completo(respaldo):
+        if len(respaldo["brainrots"]) != respaldo["pilas"]:
+            raise ValueError(f"La copia del perfil '{respaldo['perfil']}' está incompleta.")
+        respaldo.pop("nombres")
+        ids = set()
+        for brainrot in respaldo["brainrots"]:
+            if brainrot["id"] in ids:
+                brainrot["id"] = new_item_id()
+            ids.add(brainrot["id"])
+        return respaldo
+
+    def leer(registro):
+        nonlocal actual
+        if not isinstance(registro, dict):
+            raise ValueError("no es un objeto")
+        tipo = registro.get("tipo")
+        if tipo == "cabecera":
+            if registro.get("version", 0) > RESPALDO_VERSION:
+                raise ValueError("La copia es de una versión más nueva de la aplicación.")
+            return None
+        if tipo == "perfil":
+            listo = actual
+            pilas = registro["pilas"]
+            if isinstance(pilas, bool) or not isinstance(pilas, int) or pilas < 0:
+                raise ValueError("número de pilas no válido")
+            cuentas = backup_accounts(registro["cuentas"])
+            actual = {
+                "uid": _backup_name(registro["uid"], "uid"),
+                "perfil": _backup_name(registro["perfil"], "Perfil"),
+                "cuentas": cuentas,
+                "nombres": set(account_names(cuentas)),
+                "deshacer": [backup_op(op, catalogo) for op in registro.get("deshacer", [])][-LIMITE_DESHACER:],
+                "rehacer": [backup_op(op, catalogo) for op in registro.get("rehacer", [])][-LIMITE_DESHACER:],
+                "pilas": pilas,
+                "brainrots": [],
+                "historial": None,
+            }
+            return listo
+        if actual is None or (registro.get("uid"), registro.get("perfil")) != (actual["uid"], actual["perfil"]):
+            raise ValueError("registro fuera de su perfil")
+        if tipo == "pilas":
+            if not isinstance(registro["items"], list):
+                raise ValueError("pilas no válidas")
+            actual["brainrots"].extend(backup_item(item, catalogo, actual["nombres"]) for item in registro["items"])
+        elif tipo == "historial":
+            actual["historial"] = backup_history(registro["data"])
+        else:
+            raise ValueError(f"tipo de línea desconocido: {tipo!r}")
+        return None
+
+    with gzip.GzipFile(fileobj=entrada, mode="rb") as gz:
+        for numero, linea in enumerate(gz, start=1):
+            if not linea.strip():
+                continue
+            try:
+                listo = leer(json.loads(linea))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Línea {numero}: {e}") from e
+            if listo is not None:
+                yield completo(listo)
+    if actual is not None:
+        yield completo(actual)
+
+
+@metered
+def restore_profile(uid, perfil, respaldo):
+    """Reemplaza el perfil por el de la copia (inventario, cuentas, deshacer e historial)."""
+    discard_writes(uid, perfil)
+    ref = _profile_ref(uid, perfil)
+    # Las operaciones de las pilas se guardan con ids anteriores a la
+    # instantánea, así que quedan en ``ops`` para deshacer pero no se reaplican.
+    pilas = {
+        nombre: [(new_op_id(), op) for op in respaldo[nombre]] for nombre in ("deshacer", "rehacer")
+    }
+    op_base = save_data(
+        uid, perfil, respaldo["brainrots"], respaldo["cuentas"],
+        deshacer=[i for i, _ in pilas["deshacer"]], rehacer=[i for i, _ in pilas["rehacer"]],
+    )
+    batch = db.batch()
+    for op_id, op in pilas["deshacer"] + pilas["rehacer"]:
+        registro = {"i": op_id, "op": op, "modo": "do"}
+        batch.set(ref.collection("ops").document(op_id), registro)
+        count_write(registro)
+    batch.commit()
+    _delete_ops(ref, hasta=op_base, conservar={i for i, _ in pilas["deshacer"] + pilas["rehacer"]})
+    if respaldo["historial"]:
+        _history_ref(uid, perfil).set(respaldo["historial"])
+        count_write(respaldo["historial"])
+    forget_decoded_profile(uid, perfil)
+    refresh_share(uid, perfil, respaldo["brainrots"])
+
+
+def _checkpoint_load(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            return {linea.rstrip("\n") for linea in archivo if linea.strip()}
+    except OSError:
+        return set()
 
 
+def restore_backup(entrada, uid=None, checkpoint=None):
+    """Restaura una copia; devuelve ``(restaurados, omitidos)``.
 
+    Con ``uid`` todos los perfiles van a ese usuario y la copia debe ser de un
+    solo usuario; sin él se respetan los uid de la copia (administrador). Con
+    ``checkpoint`` (ruta de archivo) se saltan los perfiles que ya constan en
+    él y se añade cada perfil al terminar de escribirlo. Si algún perfil falla
+    se lanza el primer error después de esperar al resto.
+    """
+    if uid is not None and over_budget(uid, "escrituras"):
+        raise BudgetExceeded("Alcanzaste el límite diario de escrituras; inténtalo mañana.")
+    hechos = _checkpoint_load(checkpoint) if checkpoint else set()
+    lock = threading.Lock()
+    cupo = threading.BoundedSemaphore(RESPALDO_EN_VUELO)
+    futuros = []
+    origen = None
+    omitidos = 0
+
+    def escribir(destino, respaldo, clave):
+        try:
+            restore_profile(destino, respaldo["perfil"], respaldo)
+        finally:
+            cupo.release()
+        if checkpoint:
+            with lock, open(checkpoint, "a", encoding="utf-8") as archivo:
+                archivo.write(clave + "\n")
+
+    with ThreadPoolExecutor(max_workers=RESPALDO_HILOS, thread_name_prefix="restaurar") as pool:
+        for respaldo in read_backup(entrada):
+            if uid is not None:
+                origen = origen or respaldo["uid"]
+                if respaldo["uid"] != origen:
+                    raise ValueError("La copia incluye varios usuarios; sólo un administrador puede restaurarla.")
+            destino = uid or respaldo["uid"]
+            clave = json.dumps([destino, respaldo["perfil"]], ensure_ascii=False)
+            if clave in hechos:
+                omitidos += 1
+                continue
+            cupo.acquire()
+            # Con el contexto actual el consumo se carga a la sesión que restaura.
+            futuros.append(pool.submit(contextvars.copy_context().run, escribir, destino, respaldo, clave))
+    for futuro in futuros:
+        futuro.result()
+    return len(futuros), omitidos
 
+# ============================
+# MANTENIMIENTO (LÍNEA DE COMANDOS)
+# ============================
 
+# ``python app.py mantenimiento <tareas>`` (fuera de ``streamlit run``) recorre
+# los perfiles de todos los usuarios con una consulta collection_group("data")
+# que sólo trae ids, y los procesa en un pool de ``--hilos`` hilos con a lo
+# sumo MANTENIMIENTO_EN_VUELO perfiles en memoria. Un perfil cuyo inventario
+# cambia se guarda como instantánea de lo asentado (ver settled_profile) sólo
+# si nadie reemplazó la instantánea entre tanto, así que los cambios que otra
+# sesión registre mientras tanto se reaplican encima; si
+# sólo cambia el resumen se escribe junto con otros en batches de
+# MAX_ESCRITURAS_BATCH. Igual que al restaurar, ``--checkpoint`` anota los
+# perfiles terminados para reanudar, y cada MANTENIMIENTO_REPORTE segundos se
+# informa el avance en perfiles por segundo.
+MANTENIMIENTO_EN_VUELO = 64
+MANTENIMIENTO_REPORTE = 5.0
+
+
+def _task_quality(brainrots, cuentas):
+    cambios = fill_qualities(brainrots)
+    brainrots, apiladas = merge_stacks(brainrots)
+    return brainrots, cuentas, cambios or apiladas
+
+
+def _task_totals(brainrots, cuentas):
+    cambios = recompute_totals(brainrots)
+    return brainrots, cuentas, cambios
+
+
+def _task_accounts(brainrots, cuentas):
+    """Quita las cuentas sin nombre o llamadas "(ninguna)", que chocan con la pila sin cuenta."""
+    validas = [c for c in cuentas if (c.get("nombre") or "").strip() not in ("", "(ninguna)")]
+    if len(validas) == len(cuentas):
+        return brainrots, cuentas, False
+    nombres = set(account_names(validas))
+    for brainrot in brainrots:
+        if brainrot.get("Cuenta") not in nombres:
+            brainrot["Cuenta"] = "(ninguna)"
+    brainrots, _ = merge_stacks(brainrots)
+    return brainrots, validas, True
+
+
+TAREAS_MANTENIMIENTO = {
+    "calidad": _task_quality,
+    "totales": _task_totals,
+    "cuentas": _task_accounts,
+}
 
 
+@metered
+def maintain_profile(uid, perfil, tareas, simular=False):
+    """Aplica las tareas al perfil; devuelve "igual", "inventario" (ya guardado) o el resumen nuevo.
 
+    Con ``simular`` no escribe nada.
+    """
+    ref = _profile_ref(uid, perfil)
+    for _ in range(3):
+        brainrots, cuentas, datos, corte, _, recientes = settled_profile(ref)
+        datos = datos or {}
+        cambiado = False
+        for tarea in tareas:
+            brainrots, cuentas, cambios = TAREAS_MANTENIMIENTO[tarea](brainrots, cuentas)
+            cambiado = cambiado or cambios
+        resumen = summary_with_ops(brainrots, cuentas, recientes)
+        if not cambiado:
+            return "igual" if datos.get("resumen") == resumen else resumen
+        if simular:
+            return "inventario"
+        guardado = save_data(
+            uid, perfil, brainrots, cuentas, op_base=corte, resumen=resumen, desde=datos.get("op_base", "")
+        )
+        if guardado is not None:
+            break
+    else:
+        raise RuntimeError("otro proceso reescribió la instantánea del perfil tres veces seguidas")
+    forget_decoded_profile(uid, perfil)
+    token = share_token(uid, perfil)
+    if token is not None:
+        publish_share(uid, perfil, brainrots, token)
+    return "inventario"
+
+
+def run_maintenance(tareas, hilos=8, checkpoint=None, uid=None, simular=False, reportar=print):
+    """Ejecuta las tareas sobre todos los perfiles (o los de ``uid``) y devuelve las cifras finales."""
+    if uid:
+        consulta = db.collection("perfiles").document(uid).collection("data")
+    else:
+        consulta = db.collection_group("data")
+    tareas_perfil = [t for t in tareas if t in TAREAS_MANTENIMIENTO]
+    hechos = _checkpoint_load(checkpoint) if checkpoint else set()
+    lock = threading.Lock()
+    cupo = threading.BoundedSemaphore(MANTENIMIENTO_EN_VUELO)
+    cifras = {"procesados": 0, "inventarios": 0, "resúmenes": 0, "omitidos": 0, "errores": 0}
+    resumenes = []
+    usuarios = set()
+    inicio = time.time()
+    ultimo_reporte = [inicio]
+
+    def anotar(claves):
+        if checkpoint and not simular and claves:
+            with lock, open(checkpoint, "a", encoding="utf-8") as archivo:
+                archivo.writelines(clave + "\n" for clave in claves)
+
+    def tomar_lote(todos=False):
+        """Saca de ``resumenes`` el siguiente lote a escribir, o ``[]`` (llamar con ``lock``)."""
+        if not resumenes or not (todos or len(resumenes) * 3 >= MAX_ESCRITURAS_BATCH):
+            return []
+        lote = resumenes[:MAX_ESCRITURAS_BATCH // 3]
+        del resumenes[:len(lote)]
+        return lote
+
+    def escribir_lote(lote):
+        """Guarda el lote en un batch, sin ``lock`` para no frenar a los demás hilos, y lo anota en el checkpoint."""
+        try:
+            batch = db.batch()
+            for dueño, perfil, resumen, _ in lote:
+                batch.set(_profile_ref(dueño, perfil), {"resumen": resumen}, merge=True)
+                for ref, data in leaderboard_writes(dueño, perfil, resumen):
+                    batch.set(ref, data, merge=True)
+            batch.commit()
+        except Exception as e:
+            with lock:
+                cifras["errores"] += len(lote)
+            reportar(f"✗ lote de {len(lote)} resúmenes: {e}")
+            return
+        for dueño, perfil, resumen, _ in lote:
+            leaderboard_written(dueño, perfil, resumen)
+            invalidate_profile(dueño, perfil)
+        anotar([clave for *_, clave in lote])
+
+    def reporte():
+        transcurrido = max(time.time() - inicio, 1e-9)
+        return (
+            f"{cifras['procesados']} perfiles ({cifras['procesados'] / transcurrido:.1f}/s) · "
+            f"{cifras['inventarios']} inventarios y {cifras['resúmenes']} resúmenes guardados · "
+            f"{cifras['omitidos']} omitidos · {cifras['errores']} errores"
+        )
+
+    def procesar(dueño, perfil, clave):
+        try:
+            resultado = maintain_profile(dueño, perfil, tareas_perfil, simular)
+        except Exception as e:
+            with lock:
+                cifras["errores"] += 1
+            reportar(f"✗ {dueño}/{perfil}: {e}")
+            return
+        finally:
+            cupo.release()
+        lote = []
+        with lock:
+            cifras["procesados"] += 1
+            if resultado == "inventario":
+                cifras["inventarios"] += 1
+            elif resultado != "igual":
+                cifras["resúmenes"] += 1
+            if time.time() - ultimo_reporte[0] >= MANTENIMIENTO_REPORTE:
+                ultimo_reporte[0] = time.time()
+                reportar(reporte())
+            if resultado not in ("inventario", "igual") and not simular:
+                # El perfil se anota en el checkpoint cuando se escriba su resumen.
+                resumenes.append((dueño, perfil, resultado, clave))
+                lote = tomar_lote()
+                clave = None
+        if lote:
+            escribir_lote(lote)
+        if clave is not None:
+            anotar([clave])
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="mantenimiento") as pool:
+        for doc in consulta.select([]).stream():
+            padre = doc.reference.parent.parent
+            if padre is None or padre.parent.id != "perfiles":
+                continue
+            usuarios.add(padre.id)
+            clave = json.dumps([padre.id, doc.id], ensure_ascii=False)
+            if clave in hechos:
+                cifras["omitidos"] += 1
+                continue
+            if tareas_perfil:
+                cupo.acquire()
+                pool.submit(procesar, padre.id, doc.id, clave)
+    while True:
+        with lock:
+            lote = tomar_lote(todos=True)
+        if not lote:
+            break
+        escribir_lote(lote)
+
+    if "clasificacion" in tareas and not simular:
+        def reconciliar(dueño):
+            try:
+                reconcile_leaderboard(dueño)
+            except Exception as e:
+                with lock:
+                    cifras["errores"] += 1
+                reportar(f"✗ clasificación de {dueño}: {e}")
+
+        with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="mantenimiento") as pool:
+            list(pool.map(reconciliar, usuarios))
+        reportar(f"Clasificación reconciliada para {len(usuarios)} usuarios.")
+    reportar(f"Terminado en {time.time() - inicio:.1f} s: {reporte()}")
+    return cifras
+
+
+def admin_cli(argv):
+    """Punto de entrada de ``python app.py`` fuera de Streamlit; devuelve el código de salida."""
+    parser = argparse.ArgumentParser(prog="python app.py", description="Tareas de administración del inventario de Brainrots.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    mantenimiento = comandos.add_parser("mantenimiento", help="Recorre los perfiles de todos los usuarios aplicando tareas.")
+    mantenimiento.add_argument("tareas", nargs="+", choices=[*TAREAS_MANTENIMIENTO, "clasificacion"])
+    mantenimiento.add_argument("--hilos", type=int, default=8, help="Perfiles procesados en paralelo.")
+    mantenimiento.add_argument("--checkpoint", help="Archivo donde anotar los perfiles terminados para reanudar.")
+    mantenimiento.add_argument("--uid", help="Limitar a un usuario.")
+    mantenimiento.add_argument("--simular", action="store_true", help="Contar los cambios sin escribir.")
+
+    respaldo = comandos.add_parser("respaldo", help="Copia de seguridad NDJSON comprimida.")
+    respaldo.add_argument("salida")
+    respaldo.add_argument("--uid", help="Sólo este usuario (por defecto, todos).")
+
+    restaurar = comandos.add_parser("restaurar", help="Restaura una copia de seguridad.")
+    restaurar.add_argument("entrada")
+    restaurar.add_argument("--uid", help="Restaurar todos los perfiles en este usuario.")
+    restaurar.add_argument("--checkpoint")
+
+    args = parser.parse_args(argv)
+    shared_cache()
+    if args.comando == "mantenimiento":
+        cifras = run_maintenance(args.tareas, args.hilos, args.checkpoint, args.uid, args.simular)
+        return 1 if cifras["errores"] else 0
+    if args.comando == "respaldo":
+        uids = [args.uid] if args.uid else backup_uids()
+        with open(args.salida, "wb") as salida:
+            copiados = export_backup(args.uid or "admin", salida, uids)
+        print(f"{copiados} perfiles de {len(uids)} usuarios copiados en {args.salida}")
+        return 0
+    with open(args.entrada, "rb") as entrada:
+        restaurados, omitidos = restore_backup(entrada, args.uid, args.checkpoint)
+    print(f"{restaurados} perfiles restaurados, {omitidos} ya estaban en el checkpoint")
+    return 0
 
+# ============================
+# API DE LECTURA (REST/JSON)
+# ============================
 
+# Con BRAINROT_API_PUERTO (o [api] puerto en secrets) el proceso sirve además
+# una API JSON de sólo lectura en un hilo aparte, con las mismas funciones de
+# almacenamiento y el mismo catálogo pero sin pasar por Streamlit. Cada usuario
+# genera su clave en Opciones y la envía como "Authorization: Bearer <clave>";
+# en Firestore (api_claves/{sha256}) sólo se guarda el hash. Las respuestas se
+# cachean por perfil, versión y consulta: mientras la versión compartida del
+# perfil no cambie, una consulta repetida o un If-None-Match vigente se
+# responden sin leer Firestore.
+#
+#   GET /api/v1/catalogo
+#   GET /api/v1/perfiles
+#   GET /api/v1/perfiles/{perfil}/inventario
+#       ?orden= &cuenta= &rareza= &color= &mutacion= &modo= &min= &max= &q= &pagina= &por_pagina=
+#   GET /compartido/{token}  (página HTML de una instantánea compartida, sin clave)
+API_POR_PAGINA = 100
+API_POR_PAGINA_MAX = 500
+API_RESPUESTAS_MAX = 512
+API_CLAVE_TTL = 300
+
+
+class ApiError(Exception):
+    """Error de la API con su código HTTP."""
+
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _api_key_ref(clave):
+    return db.collection("api_claves").document(hashlib.sha256(clave.encode("utf-8")).hexdigest())
+
+
+@metered
+def create_api_key(uid):
+    """Genera una clave nueva para el usuario (invalidando las anteriores) y la devuelve en claro."""
+    if over_budget(uid, "escrituras"):
+        raise BudgetExceeded("Alcanzaste el límite diario de escrituras; inténtalo mañana.")
+    revoke_api_keys(uid)
+    clave = os.urandom(24).hex()
+    data = {"uid": uid, "creada": firestore.SERVER_TIMESTAMP}
+    _api_key_ref(clave).set(data)
+    count_write(data)
+    return clave
+
+
+@metered
+def revoke_api_keys(uid):
+    for doc in db.collection("api_claves").where("uid", "==", uid).select([]).stream():
+        if read_doc(doc) is None:
+            continue
+        doc.reference.delete()
+        count_write()
+        try:
+            shared_cache().delete(f"api:clave:{doc.id}")
+        except Exception:
+            pass
 
 
+def api_key_uid(clave):
+    """uid dueño de la clave, o None si no existe; se cachea API_CLAVE_TTL segundos."""
+    ref = _api_key_ref(clave)
+    cache_clave = f"api:clave:{ref.id}"
+    uid = cache_get_json(cache_clave)
+    if uid is None:
+        uid = (read_doc(ref.get()) or {}).get("uid") or ""
+        cache_set_json(cache_clave, uid, API_CLAVE_TTL)
+    return uid or None
 
 
+@st.cache_resource
+def _api_cache():
+    """Respuestas e índices ya calculados, por (uid, perfil), junto a la versión del perfil."""
+    return {"lock": threading.Lock(), "respuestas": {}, "indices": {}}
 
 
+def _api_lru_get(tabla, clave, version):
+    registro = _api_cache()
+    with registro["lock"]:
+        guardado = registro[tabla].pop(clave, None)
+        if guardado is None:
+            return None
+        registro[tabla][clave] = guardado
+    return guardado[1] if version is not None and guardado[0] == version else None
 
 
+def _api_lru_set(tabla, clave, version, valor):
+    if version is None:
+        return
+    registro = _api_cache()
+    with registro["lock"]:
+        registro[tabla].pop(clave, None)
+        registro[tabla][clave] = (version, valor)
+        while len(registro[tabla]) > API_RESPUESTAS_MAX:
+            registro[tabla].pop(next(iter(registro[tabla])))
 
 
+def api_body(data):
+    """Cuerpo JSON y su ETag."""
+    cuerpo = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return f'"{hashlib.sha1(cuerpo).hexdigest()}"', cuerpo
 
 
+def api_inventory_query(parametros):
+    """Valida los parámetros del listado y los devuelve normalizados (mismos filtros que la tabla)."""
+    def uno(nombre, defecto=""):
+        return (parametros.get(nombre) or [defecto])[-1]
 
+    def entero(nombre, defecto, minimo, maximo):
+        try:
+            valor = int(uno(nombre, defecto))
+        except ValueError:
+            raise ApiError(400, f"'{nombre}' debe ser un número entero.")
+        if not minimo <= valor <= maximo:
+            raise ApiError(400, f"'{nombre}' debe estar entre {minimo} y {maximo}.")
+        return valor
+
+    consulta = {
+        "orden": uno("orden", FILTROS_POR_DEFECTO["orden"]),
+        "cuenta": uno("cuenta", FILTROS_POR_DEFECTO["cuenta"]),
+        "rarezas": sorted(set(parametros.get("rareza", []))),
+        "colores": sorted(set(parametros.get("color", []))),
+        "mutaciones": sorted(set(parametros.get("mutacion", []))),
+        "mutaciones_modo": uno("modo", FILTROS_POR_DEFECTO["mutaciones_modo"]),
+        "total_min": parse_num(uno("min")) if uno("min") else None,
+        "total_max": parse_num(uno("max")) if uno("max") else None,
+        "busqueda": uno("q"),
+        "pagina": entero("pagina", 1, 1, 10**6),
+        "por_pagina": entero("por_pagina", API_POR_PAGINA, 1, API_POR_PAGINA_MAX),
+    }
+    if consulta["orden"] not in ORDENES_INVENTARIO:
+        raise ApiError(400, f"'orden' debe ser uno de: {', '.join(ORDENES_INVENTARIO)}.")
+    if consulta["mutaciones_modo"] not in ("Todas", "Cualquiera"):
+        raise ApiError(400, "'modo' debe ser Todas o Cualquiera.")
+    for nombre in ("min", "max"):
+        if uno(nombre) and consulta[f"total_{nombre}"] is None:
+            raise ApiError(400, f"'{nombre}' no es un total válido (ej. 10M).")
+    return consulta
+
+
+def api_item(brainrot, catalogo):
+    info = catalogo["brainrots"].get(brainrot.get("Brainrot")) or {}
+    return {
+        "id": brainrot.get("id"),
+        "Brainrot": brainrot.get("Brainrot"),
+        "Calidad": brainrot.get("Calidad") or info.get("quality", "Común"),
+        "Color": brainrot.get("Color") or "-",
+        "Mutaciones": list(brainrot.get("Mutaciones") or []),
+        "Cuenta": brainrot.get("Cuenta") or "(ninguna)",
+        "Cantidad": item_count(brainrot),
+        "Total": brainrot.get("Total") or 0,
+        "Ingreso": item_income(brainrot),
+    }
 
 
+@metered
+def api_profiles(uid):
+    return api_body({"perfiles": list_profile_summaries(uid)})
+
+
+@metered
+def api_inventory(uid, perfil, parametros):
+    """``(etag, cuerpo)`` de una página del inventario filtrado y ordenado."""
+    consulta = api_inventory_query(parametros)
+    clave = (uid, perfil, json.dumps(consulta, sort_keys=True))
+    catalogo = current_catalog()
+    version = None if pending_state(uid, perfil) is not None else (profile_version(uid, perfil), catalogo["version"])
+    respuesta = _api_lru_get("respuestas", clave, version)
+    if respuesta is not None:
+        return respuesta
+
+    if perfil not in list_profile_summaries(uid):
+        raise ApiError(404, f"No existe el perfil '{perfil}'.")
+    indice = _api_lru_get("indices", (uid, perfil), version)
+    if indice is None:
+        indice = InventoryIndex([api_item(b, catalogo) for b in load_profile(uid, perfil)["brainrots"]])
+        _api_lru_set("indices", (uid, perfil), version, indice)
+    visibles = indice.filtrar(
+        rarezas=consulta["rarezas"],
+        colores=consulta["colores"],
+        mutaciones=consulta["mutaciones"],
+        mutaciones_modo=consulta["mutaciones_modo"],
+        cuenta=consulta["cuenta"],
+        total_min=consulta["total_min"],
+        total_max=consulta["total_max"],
+        busqueda=consulta["busqueda"],
+    )
+    inicio = (consulta["pagina"] - 1) * consulta["por_pagina"]
+    respuesta = api_body({
+        "perfil": perfil,
+        "pilas": len(visibles),
+        "copias": sum(b["Cantidad"] for b in visibles),
+        "ingreso": sum(b["Ingreso"] for b in visibles),
+        "pagina": consulta["pagina"],
+        "paginas": -(-len(visibles) // consulta["por_pagina"]),
+        "items": sort_inventory(visibles, consulta["orden"])[inicio:inicio + consulta["por_pagina"]],
+    })
+    _api_lru_set("respuestas", clave, version, respuesta)
+    return respuesta
+
+
+def api_catalog():
+    catalogo = current_catalog()
+    respuesta = _api_lru_get("respuestas", ("catalogo",), catalogo["version"])
+    if respuesta is None:
+        respuesta = api_body({
+            "version": catalogo["version"],
+            "brainrots": catalogo["brainrots"],
+            "colores": catalogo["colores"],
+            "mutaciones": catalogo["mutaciones"],
+        })
+        _api_lru_set("respuestas", ("catalogo",), catalogo["version"], respuesta)
+    return respuesta
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            take_token("api", forwarded_client(self.client_address[0], self.headers))
+            etag, cuerpo, *tipo = self.route(urllib.parse.urlsplit(self.path))
+        except RateLimited as e:
+            return self.reply(429, *api_body({"error": str(e)}), {"Retry-After": str(max(1, round(e.espera)))})
+        except ApiError as e:
+            return self.reply(e.estado, *api_body({"error": str(e)}))
+        except Exception as e:
+            return self.reply(500, *api_body({"error": f"Error interno: {e}"}))
+        if etag in [valor.strip() for valor in self.headers.get("If-None-Match", "").split(",")]:
+            return self.reply(304, etag, b"")
+        self.reply(200, etag, cuerpo, tipo=tipo[0] if tipo else None)
+
+    def route(self, url):
+        partes = [urllib.parse.unquote(p) for p in url.path.strip("/").split("/")]
+        if len(partes) == 2 and partes[0] == "compartido":
+            instantanea = shared_snapshot(partes[1])
+            if instantanea is None:
+                raise ApiError(404, "La instantánea no existe o se dejó de compartir.")
+            huella, fragmento = instantanea
+            return f'"{huella}"', share_page(fragmento).encode("utf-8"), "text/html; charset=utf-8"
+        if partes[:2] != ["api", "v1"]:
+            raise ApiError(404, "Ruta desconocida.")
+        partes = partes[2:]
+        if partes == ["catalogo"]:
+            return api_catalog()
+        uid = self.authenticate()
+        if partes == ["perfiles"]:
+            return api_profiles(uid)
+        if len(partes) == 3 and partes[0] == "perfiles" and partes[2] == "inventario":
+            return api_inventory(uid, partes[1], urllib.parse.parse_qs(url.query))
+        raise ApiError(404, "Ruta desconocida.")
+
+    def authenticate(self):
+        esquema, _, clave = self.headers.get("Authorization", "").partition(" ")
+        if esquema.lower() != "bearer" or not clave.strip():
+            raise ApiError(401, "Falta la cabecera 'Authorization: Bearer <clave>'.")
+        uid = api_key_uid(clave.strip())
+        if uid is None:
+            raise ApiError(401, "Clave de API no válida.")
+        return uid
+
+    def reply(self, estado, etag, cuerpo, cabeceras=None, tipo=None):
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo or "application/json; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, no-cache")
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(cuerpo)
+
+    do_HEAD = do_GET
+
+    def log_message(self, formato, *args):
+        pass
+
+
+@st.cache_resource
+def start_api_server():
+    """Arranca la API en un hilo del proceso si hay puerto configurado; devuelve el servidor o None."""
+    puerto = os.environ.get("BRAINROT_API_PUERTO") or st.secrets.get("api", {}).get("puerto")
+    if not puerto:
+        return None
+    servidor = ThreadingHTTPServer(("0.0.0.0", int(puerto)), ApiHandler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="api", daemon=True).start()
+    atexit.register(servidor.shutdown)
+    return servidor
 
+# ============================
+# CALCULADORA DE INTERCAMBIOS
+# ============================
 
+# El intercambio vive en session_state y se dibuja en un fragmento: editarlo
+# sólo reejecuta ese fragmento, sin volver a listar perfiles ni leer Firestore.
+# Lo que se da sale del inventario ya cargado y lo que se recibe se calcula con
+# el catálogo.
 
+@st.cache_data(show_spinner=False)
+def trade_side(items, version_catalogo):
+    """Total e inventario por rareza de un lado del intercambio.
 
+    ``items`` es una tupla de ``(brainrot, color, mutaciones, total, cantidad)``;
+    si ``total`` es None se calcula con el catálogo. ``version_catalogo`` sólo
+    separa la caché entre versiones del catálogo.
+    """
+    catalogo = current_catalog()
+    total = 0
+    por_rareza = dict.fromkeys(RAREZAS, 0)
+    for nombre, color, mutaciones, total_item, cantidad in items:
+        info = catalogo["brainrots"].get(nombre, {})
+        if total_item is None:
+            total_item = calcular_total(
+                info.get("income", 0),
+                catalogo["colores"].get(color, 1),
+                [catalogo["mutaciones"].get(m, 1) for m in mutaciones],
+            )
+        total += total_item * cantidad
+        calidad = info.get("quality", "Común")
+        por_rareza[calidad] = por_rareza.get(calidad, 0) + cantidad
+    return total, por_rareza
+
+
+def get_trade(perfil):
+    return st.session_state.setdefault(f"intercambio_{perfil}", {"doy": {}, "recibo": []})
+
+
+def _trade_give(intercambio, brainrot_id, cantidad):
+    intercambio["doy"][brainrot_id] = intercambio["doy"].get(brainrot_id, 0) + cantidad
+
+
+def _trade_clear(intercambio):
+    intercambio["doy"].clear()
+    intercambio["recibo"].clear()
+
+
+@st.fragment
+def trade_calculator(perfil, brainrots):
+    """Pestaña de intercambios: compara lo que se da del inventario con lo que se recibe."""
+    intercambio = get_trade(perfil)
+    por_id = {b["id"]: b for b in brainrots}
+    intercambio["doy"] = {i: n for i, n in intercambio["doy"].items() if i in por_id}
+
+    col_doy, col_recibo = st.columns(2)
+    with col_doy:
+        st.markdown("#### 📤 Doy")
+        opciones = {
+            f"{b['Brainrot']} | {b['Cuenta']} | {format_num(b['Total'])}"
+            + (f" | {b['Color']}" if b.get("Color") not in (None, "-") else "")
+            + (f" | {', '.join(b['Mutaciones'])}" if b.get("Mutaciones") else ""): b["id"]
+            for b in brainrots
+        }
+        seleccion = st.selectbox("Del inventario", ["(ninguno)"] + list(opciones), key=f"intercambio_doy_sel_{perfil}")
+        if seleccion != "(ninguno)":
+            pila = por_id[opciones[seleccion]]
+            disponibles = item_count(pila) - intercambio["doy"].get(pila["id"], 0)
+            if disponibles > 0:
+                cantidad = st.number_input("Copias", 1, disponibles, 1, key=f"intercambio_doy_n_{perfil}")
+                st.button(
+                    "➕ Añadir a lo que doy",
+                    key=f"intercambio_doy_add_{perfil}",
+                    on_click=_trade_give,
+                    args=(intercambio, pila["id"], int(cantidad)),
+                )
+        for brainrot_id, cantidad in list(intercambio["doy"].items()):
+            pila = por_id[brainrot_id]
+            st.button(
+                f"✖ {pila['Brainrot']} x{cantidad} ({format_num(pila['Total'])})",
+                key=f"intercambio_doy_quitar_{brainrot_id}",
+                on_click=intercambio["doy"].pop,
+                args=(brainrot_id, None),
+            )
+
+    with col_recibo:
+        st.markdown("#### 📥 Recibo")
+        nombre = st.selectbox(
+            "Del catálogo",
+            ["(ninguno)"] + [make_searchable_option(f"{n} — {format_num(d['income'])}", n, d.get("quality")) for n, d in BRAINROTS.items()],
+            format_func=option_display,
+            key=f"intercambio_recibo_sel_{perfil}",
+        )
+        nombre = option_display(nombre).split(" — ")[0]
+        color = st.selectbox("Color", list(COLORES), key=f"intercambio_recibo_color_{perfil}")
+        mutaciones = st.multiselect("Mutaciones", list(MUTACIONES), key=f"intercambio_recibo_mut_{perfil}")
+        cantidad = st.number_input("Copias", 1, 1000, 1, key=f"intercambio_recibo_n_{perfil}")
+        st.button(
+            "➕ Añadir a lo que recibo",
+            key=f"intercambio_recibo_add_{perfil}",
+            disabled=nombre == "(ninguno)",
+            on_click=intercambio["recibo"].append,
+            args=({"Brainrot": nombre, "Color": color, "Mutaciones": list(mutaciones), "Cantidad": int(cantidad)},),
+        )
+        for i, item in enumerate(intercambio["recibo"]):
+            extras = [item["Color"]] if item["Color"] != "-" else []
+            extras += item["Mutaciones"]
+            etiqueta = f"✖ {item['Brainrot']} x{item['Cantidad']}" + (f" ({', '.join(extras)})" if extras else "")
+            st.button(etiqueta, key=f"intercambio_recibo_quitar_{perfil}_{i}", on_click=intercambio["recibo"].pop, args=(i,))
+
+    total_doy, rarezas_doy = trade_side(tuple(
+        (por_id[i]["Brainrot"], por_id[i].get("Color") or "-", tuple(por_id[i].get("Mutaciones") or ()), por_id[i]["Total"], n)
+        for i, n in intercambio["doy"].items()
+    ), CATALOGO["version"])
+    total_recibo, rarezas_recibo = trade_side(tuple(
+        (item["Brainrot"], item["Color"], tuple(item["Mutaciones"]), None, item["Cantidad"])
+        for item in intercambio["recibo"]
+    ), CATALOGO["version"])
+    col_a, col_b, col_c = st.columns(3)
+    col_a.metric("Doy", format_num(total_doy))
+    col_b.metric("Recibo", format_num(total_recibo))
+    diferencia = total_recibo - total_doy
+    col_c.metric("Diferencia", ("+" if diferencia >= 0 else "-") + format_num(abs(diferencia)))
+    if total_doy or total_recibo:
+        if diferencia > 0:
+            st.success("El intercambio te sube el ingreso.")
+        elif diferencia < 0:
+            st.warning("El intercambio te baja el ingreso.")
+        else:
+            st.info("El intercambio deja el ingreso igual.")
+    filas = [
+        {"Calidad": rareza, "Doy": rarezas_doy.get(rareza, 0), "Recibo": rarezas_recibo.get(rareza, 0)}
+        for rareza in RAREZAS
+        if rarezas_doy.get(rareza) or rarezas_recibo.get(rareza)
+    ]
+    if filas:
+        st.dataframe(pd.DataFrame(filas), hide_index=True)
+    if intercambio["doy"] or intercambio["recibo"]:
+        st.button(
+            "🧹 Vaciar intercambio",
+            key=f"intercambio_vaciar_{perfil}",
+            on_click=_trade_clear,
+            args=(intercambio,),
+        )
 
+# ============================
+# MEDICIÓN DE TIEMPOS
+# ============================
 
+# Cada sección de la interfaz guarda en la sesión cuánto tardó su última
+# ejecución. La página completa sólo se mide cuando el script llega al final,
+# así que la interacción dentro de un fragmento se ve como una ejecución más
+# del fragmento y ninguna de la página.
+
+
+def record_timing(nombre, inicio):
+    """Guarda la duración de una sección medida desde ``inicio`` (``time.perf_counter``)."""
+    duracion = (time.perf_counter() - inicio) * 1000
+    tiempos = st.session_state.setdefault("tiempos_secciones", {})
+    registro = tiempos.setdefault(nombre, {"ejecuciones": 0, "ultima": 0.0, "total": 0.0})
+    registro["ejecuciones"] += 1
+    registro["ultima"] = duracion
+    registro["total"] += duracion
+
+
+def timed(nombre):
+    """Decorador que mide cada ejecución de una sección de la interfaz."""
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_timing(nombre, inicio)
+        return envoltura
+    return decorador
+
+
+def timing_frame():
+    """Tabla con las ejecuciones y tiempos registrados en la sesión."""
+    tiempos = st.session_state.get("tiempos_secciones", {})
+    return pd.DataFrame([
+        {
+            "Sección": nombre,
+            "Ejecuciones": registro["ejecuciones"],
+            "Última (ms)": round(registro["ultima"], 1),
+            "Media (ms)": round(registro["total"] / registro["ejecuciones"], 1),
+        }
+        for nombre, registro in sorted(tiempos.items())
+    ])
 
+# ============================
+# SECCIONES DE LA INTERFAZ
+# ============================
 
+# Cada panel es un fragmento: tocar uno de sus widgets sólo vuelve a ejecutar
+# ese panel, leyendo el perfil de la caché de la sesión. Las acciones que
+# cambian el inventario hacen st.rerun() para que el resto de la página vea el
+# cambio.
 
+# Con inventarios muy grandes la tabla se pagina y los selectores de
+# borrar/mover se limitan a las pilas que coinciden con una búsqueda.
+TABLA_FILAS_POR_PAGINA = 500
+SELECTOR_MAX_PILAS = 1000
 
 
+def normalize_inventory(uid, perfil, estado, resumenes):
+    """Completa calidades y apila copias sueltas, guardando el resultado en segundo plano.
 
+    Se hace una vez por estado cargado; las operaciones posteriores ya
+    mantienen las pilas fusionadas.
+    """
+    brainrots = estado["brainrots"]
+    if estado.get("normalizado"):
+        return brainrots
+    estado["normalizado"] = True
+    faltantes_calidad = fill_qualities(brainrots)
+    brainrots, copias_apiladas = merge_stacks(brainrots)
+
+    if faltantes_calidad or copias_apiladas or (perfil in resumenes and not resumenes[perfil]):
+        estado["brainrots"] = brainrots
+        try:
+            submit_background(
+                uid, "normalizar inventario", save_data,
+                uid, perfil, [dict(b) for b in brainrots], account_entities(estado["cuentas"]),
+            )
+        except BackgroundBusy as e:
+            st.warning(f"No se pudo guardar el inventario normalizado: {e}")
+    return brainrots
+
+
+@st.fragment
+@timed("perfiles")
+@show_rate_limit
+def profile_manager(uid, perfil_actual):
+    """Crear y borrar perfiles."""
+    with st.form("form_nuevo_perfil", clear_on_submit=True, border=False):
+        nuevo_perfil = st.text_input("Nombre de nuevo perfil")
+        if st.form_submit_button("➕ Crear perfil") and nuevo_perfil:
+            try:
+                create_profile_async(uid, nuevo_perfil)
+            except BackgroundBusy as e:
+                st.warning(str(e))
+            else:
+                forget_cached_profile(nuevo_perfil, empty_profile_state())
+                st.success(f"Perfil '{nuevo_perfil}' creado.")
+                st.rerun()
 
+    if perfil_actual and perfil_actual != "(ninguno)":
+        if st.button(f"🗑️ Borrar perfil '{perfil_actual}'"):
+            st.session_state["confirm_delete_profile"] = perfil_actual
+
+        if "confirm_delete_profile" in st.session_state:
+            perfil_to_delete = st.session_state["confirm_delete_profile"]
+            confirmed = confirm_deletion(
+                "confirm_delete_profile",
+                f"⚠️ ¿Seguro que deseas borrar el perfil '{perfil_to_delete}'? Esta acción no se puede deshacer.",
+            )
+            if confirmed:
+                try:
+                    delete_profile_async(uid, perfil_to_delete)
+                except BackgroundBusy as e:
+                    st.warning(str(e))
+                else:
+                    forget_cached_profile(perfil_to_delete)
+                    st.success(f"Perfil '{perfil_to_delete}' borrado.")
+                    st.rerun()
 
 
+@st.fragment
+@timed("cuentas")
+@show_rate_limit
+def accounts_panel(uid, perfil):
+    """Alta, baja, renombrado y fusión de cuentas."""
+    estado = cached_profile(uid, perfil)
+    brainrots = estado["brainrots"]
+    cuentas = account_names(estado["cuentas"])
+
+    with st.container(border=True):
+        st.markdown("### 🏷️ Gestión de cuentas")
+        with st.form(f"form_nueva_cuenta_{perfil}", clear_on_submit=True, border=False):
+            nueva_cuenta = st.text_input("Nombre de nueva cuenta")
+            if st.form_submit_button("➕ Agregar cuenta"):
+                if nueva_cuenta and nueva_cuenta not in cuentas:
+                    commit_op(uid, perfil, estado, {
+                        "k": "cuenta+",
+                        "a": nueva_cuenta,
+                        "pos": len(cuentas),
+                        "id": new_account_id(estado["cuentas"]),
+                    })
+                    st.success(f"Cuenta '{nueva_cuenta}' añadida.")
+                    st.rerun()
 
+        if not cuentas:
+            return
+
+        cuenta_borrar = st.selectbox("Selecciona una cuenta para borrar", ["(ninguna)"] + cuentas)
+        if st.button("🗑️ Borrar cuenta") and cuenta_borrar != "(ninguna)":
+            st.session_state["confirm_delete_account"] = cuenta_borrar
+
+        if "confirm_delete_account" in st.session_state:
+            cuenta_to_delete = st.session_state["confirm_delete_account"]
+            confirmed_account = confirm_deletion(
+                "confirm_delete_account",
+                f"⚠️ ¿Seguro que deseas borrar la cuenta '{cuenta_to_delete}'? Los brainrots asociados quedarán sin cuenta.",
+            )
+            if confirmed_account and confirmed_account in cuentas:
+                commit_op(uid, perfil, estado, {
+                    "k": "cuenta-",
+                    "a": confirmed_account,
+                    "pos": cuentas.index(confirmed_account),
+                    "id": find_account(estado["cuentas"], confirmed_account)["id"],
+                    "items": [op_item(b) for b in brainrots if b["Cuenta"] == confirmed_account],
+                })
+                st.success(f"Cuenta '{confirmed_account}' borrada.")
+                st.rerun()
 
+        col_renombrar, col_fusionar = st.columns(2)
+        with col_renombrar:
+            with st.form(f"form_renombrar_cuenta_{perfil}", border=False):
+                cuenta_renombrar = st.selectbox("Cuenta a renombrar", cuentas, key="cuenta_renombrar")
+                nuevo_nombre = st.text_input("Nuevo nombre", key="cuenta_nuevo_nombre")
+                if st.form_submit_button("✏️ Renombrar cuenta"):
+                    if not nuevo_nombre or nuevo_nombre == "(ninguna)" or nuevo_nombre in cuentas:
+                        st.warning("Elige un nombre nuevo que no esté en uso.")
+                    else:
+                        commit_op(uid, perfil, estado, {"k": "cuenta~", "a": cuenta_renombrar, "n": nuevo_nombre})
+                        st.success(f"Cuenta '{cuenta_renombrar}' renombrada a '{nuevo_nombre}'.")
+                        st.rerun()
+        with col_fusionar:
+            if len(cuentas) < 2:
+                st.caption("Necesitas al menos dos cuentas para fusionarlas.")
+            else:
+                cuenta_origen = st.selectbox("Fusionar la cuenta", cuentas, key="cuenta_fusion_origen")
+                cuenta_destino = st.selectbox(
+                    "Dentro de", [c for c in cuentas if c != cuenta_origen], key="cuenta_fusion_destino"
+                )
+                if st.button("🔀 Fusionar cuentas"):
+                    commit_op(uid, perfil, estado, {
+                        "k": "cuenta-",
+                        "a": cuenta_origen,
+                        "n": cuenta_destino,
+                        "pos": cuentas.index(cuenta_origen),
+                        "id": find_account(estado["cuentas"], cuenta_origen)["id"],
+                        "items": [op_item(b) for b in brainrots if b["Cuenta"] == cuenta_origen],
+                    })
+                    st.success(f"Cuenta '{cuenta_origen}' fusionada con '{cuenta_destino}'.")
+                    st.rerun()
 
 
+@st.fragment
+@timed("agregar")
+@show_rate_limit
+def add_brainrot_panel(uid, perfil):
+    """Formulario para agregar Brainrots con vista previa del total."""
+    estado = cached_profile(uid, perfil)
+    cuentas = account_names(estado["cuentas"])
+
+    with st.container(border=True):
+        st.markdown("### ➕ Agregar Brainrot")
+        opciones_personajes = ["(ninguno)"] + [
+            make_searchable_option(
+                f"{nombre} — {format_num(data['income'])}",
+                nombre,
+                data.get("quality"),
+            )
+            for nombre, data in BRAINROTS.items()
+        ]
+
+        personaje_opcion = st.selectbox(
+            "Selecciona un Brainrot",
+            opciones_personajes,
+            key=f"seleccion_brainrot_{perfil}",
+            format_func=option_display,
+        )
+
+        personaje = option_display(personaje_opcion)
+        color = st.selectbox("Color", list(COLORES.keys()))
+        mutaciones = st.multiselect("Mutaciones", list(MUTACIONES.keys()))
+        cuenta_sel = st.selectbox("Cuenta", ["(ninguna)"] + cuentas)
+        cantidad_sel = st.number_input("Cantidad", min_value=1, value=1, step=1)
+
+        total_preview = None
+        nombre_seleccionado = None
+        datos_brainrot = None
+        if personaje != "(ninguno)":
+            nombre_seleccionado = personaje.split(" — ")[0]
+            datos_brainrot = BRAINROTS[nombre_seleccionado]
+            base = datos_brainrot["income"]
+            total_preview = calcular_total(
+                base,
+                COLORES[color],
+                [MUTACIONES[m] for m in mutaciones],
+            )
+            st.info(f"Total: {format_num(total_preview)}")
+        else:
+            st.info("Selecciona un Brainrot para ver la vista previa del total.")
+
+        if st.button("Agregar") and nombre_seleccionado:
+            nuevo = {
+                "id": new_item_id(),  # ID invisible
+                "Brainrot": nombre_seleccionado,
+                "Calidad": datos_brainrot["quality"],
+                "Color": color,
+                "Mutaciones": mutaciones,
+                "Cuenta": cuenta_sel,
+                "Total": total_preview,
+                "Cantidad": int(cantidad_sel),
+            }
+            commit_op(uid, perfil, estado, {"k": "add", "b": nuevo})
+            pila = find_stack(estado["brainrots"], nuevo)
+            st.success(
+                f"Brainrot '{nombre_seleccionado}' [{datos_brainrot['quality']}] x{int(cantidad_sel)} agregado con total {format_num(total_preview)} "
+                f"(ahora tienes {item_count(pila)})."
+            )
+            st.rerun()
+
+
+@st.fragment
+@timed("tabla")
+def inventory_table(uid, perfil):
+    """Tabla del inventario con orden y filtros."""
+    brainrots = cached_profile(uid, perfil)["brainrots"]
+
+    with st.container(border=True):
+        st.markdown("### 📋 Tus Brainrots")
+        filtros = get_inventory_filters(perfil)
+        indice = get_inventory_index(perfil, brainrots)
+
+        opciones_orden = ORDENES_INVENTARIO
+        orden_key = f"orden_{perfil}"
+        bind_filter_widget(orden_key, filtros, "orden", opciones_orden)
+
+        orden = st.selectbox(
+            "Ordenar por",
+            opciones_orden,
+            key=orden_key
+        )
+        filtros["orden"] = orden
+
+        cuentas_filtro = ["Todas"] + sorted(indice.por_cuenta)
+        cuenta_key = f"cuenta_filtro_{perfil}"
+        bind_filter_widget(cuenta_key, filtros, "cuenta", cuentas_filtro)
+
+        cuenta_filtro = st.selectbox(
+            "Filtrar por Cuenta",
+            cuentas_filtro,
+            key=cuenta_key
+        )
+        filtros["cuenta"] = cuenta_filtro
+
+        with st.expander("🔎 Filtros avanzados"):
+            busqueda_key = f"filtro_busqueda_{perfil}"
+            bind_filter_widget(busqueda_key, filtros, "busqueda")
+            filtros["busqueda"] = st.text_input("Buscar por nombre", key=busqueda_key)
+
+            rarezas_key = f"filtro_rarezas_{perfil}"
+            bind_filter_widget(rarezas_key, filtros, "rarezas", RAREZAS)
+            filtros["rarezas"] = st.multiselect("Calidad", RAREZAS, key=rarezas_key)
+
+            opciones_colores = list(COLORES.keys())
+            colores_key = f"filtro_colores_{perfil}"
+            bind_filter_widget(colores_key, filtros, "colores", opciones_colores)
+            filtros["colores"] = st.multiselect("Color", opciones_colores, key=colores_key)
+
+            opciones_mutaciones = list(MUTACIONES.keys())
+            mutaciones_key = f"filtro_mutaciones_{perfil}"
+            bind_filter_widget(mutaciones_key, filtros, "mutaciones", opciones_mutaciones)
+            filtros["mutaciones"] = st.multiselect("Mutaciones", opciones_mutaciones, key=mutaciones_key)
+
+            modos_mutacion = ["Todas", "Cualquiera"]
+            modo_key = f"filtro_mutaciones_modo_{perfil}"
+            bind_filter_widget(modo_key, filtros, "mutaciones_modo", modos_mutacion)
+            filtros["mutaciones_modo"] = st.radio(
+                "Debe tener las mutaciones",
+                modos_mutacion,
+                key=modo_key,
+                horizontal=True,
+            )
+
+            col_min, col_max = st.columns(2)
+            with col_min:
+                total_min_key = f"filtro_total_min_{perfil}"
+                bind_filter_widget(total_min_key, filtros, "total_min")
+                filtros["total_min"] = st.text_input("Total mínimo (ej. 10M)", key=total_min_key)
+            with col_max:
+                total_max_key = f"filtro_total_max_{perfil}"
+                bind_filter_widget(total_max_key, filtros, "total_max")
+                filtros["total_max"] = st.text_input("Total máximo (ej. 1B)", key=total_max_key)
+
+            total_min = parse_num(filtros["total_min"])
+            total_max = parse_num(filtros["total_max"])
+            if filtros["total_min"] and total_min is None:
+                st.warning("Total mínimo no válido; se ignora.")
+            if filtros["total_max"] and total_max is None:
+                st.warning("Total máximo no válido; se ignora.")
+
+        visibles = indice.filtrar(
+            rarezas=filtros["rarezas"],
+            colores=filtros["colores"],
+            mutaciones=filtros["mutaciones"],
+            mutaciones_modo=filtros["mutaciones_modo"],
+            cuenta=cuenta_filtro,
+            total_min=total_min,
+            total_max=total_max,
+            busqueda=filtros["busqueda"],
+        )
+        st.caption(
+            f"Mostrando {len(visibles)} de {len(brainrots)} pilas "
+            f"({sum(item_count(b) for b in visibles)} copias) — "
+            f"Ingreso: {format_num(sum(item_income(b) for b in visibles))}"
+        )
+
+        if not visibles:
+            st.info("No hay brainrots para mostrar con los filtros seleccionados.")
+            return
+
+        pagina = 1
+        paginas = -(-len(visibles) // TABLA_FILAS_POR_PAGINA)
+        if paginas > 1:
+            pagina = int(st.number_input(
+                f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, step=1,
+                key=f"tabla_pagina_{perfil}",
+            ))
+
+        ensure_rarity_styles()
+        ensure_color_styles()
+        st.markdown(
+            inventory_table_html(perfil, indice, visibles, orden, filtros, pagina),
+            unsafe_allow_html=True,
+        )
+
+
+def inventory_table_html(perfil, indice, visibles, orden, filtros, pagina=1):
+    """HTML de una página de la tabla; se reutiliza mientras no cambien el índice, el orden, los filtros ni la página."""
+    clave = (orden, json.dumps(filtros, sort_keys=True), pagina)
+    tablas = st.session_state.setdefault("inventario_tablas", {})
+    guardada = tablas.get(perfil)
+    if guardada and guardada[0] is indice and guardada[1] == clave:
+        return guardada[2]
+
+    ordenados = sort_inventory(visibles, orden)
+    tabla = inventory_html(ordenados[(pagina - 1) * TABLA_FILAS_POR_PAGINA:pagina * TABLA_FILAS_POR_PAGINA])
+    tablas[perfil] = (indice, clave, tabla)
+    return tabla
+
+
+def inventory_html(items):
+    """Tabla HTML (con insignias de calidad y color) de las pilas ya ordenadas."""
+    df = pd.DataFrame(items)
+    df["Cantidad"] = [item_count(b) for b in items]
+
+    df["Total"] = df["Total"].apply(format_num)
+    df = df.drop(columns=["id"], errors="ignore")
+    if "Calidad" not in df.columns:
+        df["Calidad"] = df["Brainrot"].map(
+            lambda nombre: BRAINROTS.get(nombre, {}).get("quality", "Common")
+        )
+
+    df["Mutaciones"] = df["Mutaciones"].apply(
+        lambda mut: ", ".join(mut) if isinstance(mut, list) else mut
+    )
+
+    columnas = ["Brainrot", "Calidad", "Cuenta", "Cantidad", "Total", "Color", "Mutaciones"]
+    df = df[[col for col in columnas if col in df.columns]]
+
+    df_display = df.copy()
+    df_display["Brainrot"] = df_display["Brainrot"].apply(lambda valor: html.escape(str(valor)))
+    df_display["Calidad"] = df_display["Calidad"].apply(rarity_badge_html)
+    df_display["Mutaciones"] = df_display["Mutaciones"].apply(
+        lambda valor: html.escape(valor) if valor else "-"
+    )
+    df_display["Cuenta"] = df_display["Cuenta"].apply(
+        lambda valor: html.escape(valor) if valor else "-"
+    )
+    if "Color" in df_display:
+        df_display["Color"] = df_display["Color"].apply(color_badge_html)
+
+    return df_display.to_html(
+        escape=False,
+        index=False,
+        classes="brainrot-table"
+    )
+
+
+def brainrot_label(b):
+    """Etiqueta legible de una pila para los selectores de borrar/mover."""
+    parts = [
+        f"{b['Brainrot']}" + (f" x{item_count(b)}" if item_count(b) > 1 else ""),
+        f"Cuenta: {b['Cuenta']}",
+        f"Total: {format_num(b['Total'])}"
+    ]
+    if b.get("Calidad"):
+        parts.append(f"Calidad: {b['Calidad']}")
+    if b.get("Color") and b["Color"] != "-":
+        parts.append(f"Color: {b['Color']}")
+    if b.get("Mutaciones"):
+        parts.append(f"Mutaciones: {', '.join(b['Mutaciones'])}")
+    return " | ".join(parts), b["id"]
+
+
+@st.fragment
+@timed("borrar/mover")
+@show_rate_limit
+def delete_move_panel(uid, perfil):
+    """Borrar copias de una pila o moverlas a otra cuenta."""
+    estado = cached_profile(uid, perfil)
+    brainrots = estado["brainrots"]
+    cuentas = account_names(estado["cuentas"])
+
+    with st.container(border=True):
+        st.markdown("### 🗑️ 🔄 Borrar / Mover Brainrots")
+
+        candidatos = brainrots
+        if len(brainrots) > SELECTOR_MAX_PILAS:
+            busqueda = st.text_input("Buscar pila por nombre", key=f"buscar_pila_{perfil}")
+            encontrados = get_inventory_index(perfil, brainrots).filtrar(busqueda=busqueda)
+            candidatos = heapq.nlargest(SELECTOR_MAX_PILAS, encontrados, key=lambda b: b.get("Total", 0))
+            st.caption(
+                f"{len(encontrados)} pilas coinciden; se listan las {len(candidatos)} de mayor Total."
+            )
+
+        brainrot_entries = []
+        for brainrot in candidatos:
+            label, brainrot_id = brainrot_label(brainrot)
+            option_value = make_searchable_option(
+                label,
+                label,
+                brainrot.get("Brainrot", ""),
+                brainrot.get("Cuenta", ""),
+                brainrot.get("Calidad", ""),
+                brainrot.get("Color", ""),
+                ", ".join(brainrot.get("Mutaciones", [])),
+            )
+            brainrot_entries.append((option_value, label, brainrot_id))
+
+        opciones_brainrots = ["(ninguno)"] + [entry[0] for entry in brainrot_entries]
+        ids_map = {entry[1]: entry[2] for entry in brainrot_entries}
+        brainrots_por_id = {b["id"]: b for b in candidatos}
+
+        def cantidad_input(etiqueta, seleccion, key):
+            """Pide cuántas copias usar cuando la pila seleccionada tiene varias."""
+            if seleccion == "(ninguno)":
+                return 1
+            disponibles = item_count(brainrots_por_id[ids_map[seleccion]])
+            if disponibles <= 1:
+                return 1
+            return int(st.number_input(etiqueta, min_value=1, max_value=disponibles, value=1, step=1, key=key))
+
+        # Borrar
+        to_delete_option = st.selectbox(
+            "Selecciona un Brainrot para borrar",
+            opciones_brainrots,
+            format_func=option_display,
+        )
+        to_delete = option_display(to_delete_option)
+        cantidad_borrar = cantidad_input("Copias a borrar", to_delete, f"cantidad_borrar_{perfil}")
+        if st.button("🗑️ Borrar Brainrot") and to_delete != "(ninguno)":
+            brainrot = brainrots_por_id[ids_map[to_delete]]
+            commit_op(uid, perfil, estado, {"k": "del", "b": op_item(brainrot, cantidad_borrar)})
+            st.success(f"Brainrot borrado (x{cantidad_borrar}).")
+            st.rerun()
+
+        # Mover
+        mover_option = st.selectbox(
+            "Selecciona un Brainrot para mover",
+            opciones_brainrots,
+            format_func=option_display,
+        )
+        mover = option_display(mover_option)
+        cantidad_mover = cantidad_input("Copias a mover", mover, f"cantidad_mover_{perfil}")
+        nueva_cuenta_sel = st.selectbox("Mover a cuenta", ["(ninguna)"] + cuentas)
+        if st.button("🔄 Mover Brainrot") and mover != "(ninguno)" and nueva_cuenta_sel != "(ninguna)":
+            brainrot = brainrots_por_id[ids_map[mover]]
+            commit_op(uid, perfil, estado, {
+                "k": "move",
+                "b": op_item(brainrot, cantidad_mover),
+                "a": nueva_cuenta_sel,
+            })
+            st.success(f"Brainrot movido a cuenta '{nueva_cuenta_sel}' (x{cantidad_mover}).")
+            st.rerun()
+
+
+@st.fragment
+@timed("optimizador")
+@show_rate_limit
+def loadout_optimizer_panel(uid, perfil):
+    """Reparto de pilas entre cuentas que maximiza el ingreso."""
+    estado = cached_profile(uid, perfil)
+    brainrots = estado["brainrots"]
+    cuentas = account_names(estado["cuentas"])
+
+    with st.container(border=True):
+        st.markdown("### 🧮 Optimizador de cuentas")
+        st.caption("Indica cuántos espacios tiene la base de cada cuenta para ver el reparto con más ingreso.")
+        espacios = {}
+        columnas_espacios = st.columns(min(len(cuentas), 4))
+        for i, cuenta in enumerate(cuentas):
+            with columnas_espacios[i % len(columnas_espacios)]:
+                espacios[cuenta] = int(st.number_input(
+                    cuenta, min_value=0, max_value=1000, value=10, step=1,
+                    key=f"espacios_{perfil}_{cuenta}",
+                ))
+        movimientos, ingreso_optimo = optimize_loadout(brainrots, espacios)
+        ingreso_actual = current_income(brainrots, espacios)
+        st.metric(
+            "Ingreso con el reparto óptimo",
+            format_num(ingreso_optimo),
+            delta=format_num(ingreso_optimo - ingreso_actual) if ingreso_optimo != ingreso_actual else None,
+        )
+        if not movimientos:
+            st.success("El inventario ya está repartido de forma óptima.")
+        else:
+            st.dataframe(
+                pd.DataFrame([
+                    {"Brainrot": pila["Brainrot"], "Cantidad": n, "De": pila["Cuenta"], "A": destino, "Total": format_num(pila["Total"])}
+                    for pila, n, destino in movimientos
+                ]),
+                hide_index=True,
+            )
+            if st.button(f"🚚 Aplicar {len(movimientos)} movimientos", key="aplicar_optimizador"):
+                commit_op(uid, perfil, estado, {
+                    "k": "lote",
+                    "ops": [{"k": "move", "b": op_item(pila, n), "a": destino} for pila, n, destino in movimientos],
+                })
+                st.success("Movimientos aplicados.")
+                st.rerun()
 
 
+@st.fragment
+@timed("simulador")
+def upgrade_simulator_panel(uid, perfil):
+    """Mejores mejoras de color/mutación para el inventario."""
+    brainrots = cached_profile(uid, perfil)["brainrots"]
+
+    with st.container(border=True):
+        st.markdown("### 🧪 Simulador de mejoras")
+        nombres_mejoras = [nombre for nombre, _, _ in upgrade_candidates()]
+        mejoras_sel = st.multiselect(
+            "Mejoras disponibles",
+            nombres_mejoras,
+            key=f"simulador_mejoras_{perfil}",
+            placeholder="Todas",
+        )
+        top_k = st.slider("Mostrar las mejores", 5, 50, 10, key=f"simulador_k_{perfil}")
+        simulacion = simulate_upgrades(brainrots, mejoras_sel or None, top_k)
+        if not simulacion:
+            st.info("Ninguna de esas mejoras sube el ingreso de tus Brainrots.")
+        else:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Brainrot": pila["Brainrot"],
+                        "Cuenta": pila["Cuenta"],
+                        "Mejora": f"{tipo}: {nombre}",
+                        "Total actual": format_num(pila["Total"]),
+                        "Nuevo total": format_num(pila["Total"] + ganancia),
+                        "Ganancia": format_num(ganancia),
+                    }
+                    for pila, nombre, tipo, ganancia in simulacion
+                ]),
+                hide_index=True,
+            )
+            st.caption("La ganancia es por copia mejorada.")
+
+
+@st.fragment
+@timed("historial")
+def income_history_panel(uid, perfil):
+    """Gráfica del ingreso registrado a lo largo del tiempo."""
+    with st.container(border=True):
+        st.markdown("### 📈 Historial de ingresos")
+        if st.toggle("Mostrar historial", key=f"mostrar_historial_{perfil}"):
+            resolucion = st.radio(
+                "Resolución",
+                list(HISTORIAL_RESOLUCIONES),
+                index=1,
+                horizontal=True,
+                key=f"historial_resolucion_{perfil}",
+            )
+            puntos = load_income_history(uid, perfil, HISTORIAL_RESOLUCIONES[resolucion])
+            if len(puntos) < 2:
+                st.info("Todavía no hay suficiente historial para graficar.")
+            else:
+                st.line_chart(income_history_frame(puntos))
+                st.caption(f"Último registro: {format_num(puntos[-1][1].get('t', 0))}")
+
+
+
+@st.fragment
+@timed("compartir")
+def share_panel(uid, perfil):
+    """Publica o retira la instantánea de sólo lectura del perfil."""
+    with st.container(border=True):
+        st.markdown("### 🔗 Compartir")
+        token = share_token(uid, perfil)
+        if token is None:
+            st.caption("Crea un enlace público de sólo lectura con tu tabla; se actualiza solo cuando cambie el perfil.")
+            st.button(
+                "🔗 Compartir este perfil",
+                key=f"compartir_{perfil}",
+                on_click=_share_current,
+                args=(uid, perfil),
+            )
+        else:
+            st.code(share_url(token), language=None)
+            st.button("🚫 Dejar de compartir", key=f"descompartir_{perfil}", on_click=unshare_profile, args=(uid, perfil))
+
+
+def _share_current(uid, perfil):
+    publish_share(uid, perfil, [dict(b) for b in cached_profile(uid, perfil)["brainrots"]])
+
+
+@st.fragment
+@timed("clasificación")
+def leaderboard_panel(uid):
+    """Top global y posición del usuario; las cifras se refrescan cada CLASIFICACION_TTL segundos."""
+    metrica = st.radio(
+        "Clasificar por",
+        list(METRICAS_CLASIFICACION),
+        format_func=METRICAS_CLASIFICACION.get,
+        horizontal=True,
+        key="clasificacion_metrica",
+    )
+    formato = format_num if metrica == "ingreso" else str
+    publico, nombre = leaderboard_settings(uid)
+    with st.expander("👁️ Visibilidad", expanded=False):
+        nuevo_publico = st.toggle("Aparecer en la clasificación pública", value=publico, key="clasificacion_publico")
+        nuevo_nombre = st.text_input(
+            "Alias", value=nombre, max_chars=ALIAS_MAX, key="clasificacion_alias", placeholder="Vacío para uno aleatorio"
+        )
+        if st.button("Guardar visibilidad", key="clasificacion_guardar"):
+            nombre = set_leaderboard_settings(uid, nuevo_publico, nuevo_nombre)
+            publico = nuevo_publico
+            st.success(f"✅ {'Apareces' if publico else 'No apareces'} en la clasificación como {nombre}.")
+    posicion, valor = leaderboard_position(uid, metrica)
+    totales = leaderboard_global(uid)
+    col_posicion, col_global = st.columns(2)
+    col_posicion.metric("Tu posición", f"#{posicion}" if posicion else "—", formato(valor), delta_color="off")
+    if not publico:
+        col_posicion.caption("Tu perfil es privado: no cuentas para las posiciones ni apareces en el top.")
+    col_global.metric(f"{METRICAS_CLASIFICACION[metrica]} de todos los jugadores", formato(totales.get(metrica, 0)))
+    top = leaderboard_top(uid, metrica)
+    if top:
+        st.dataframe(
+            pd.DataFrame([
+                {"#": i, "Jugador": fila["nombre"] + (" (tú)" if fila["uid"] == uid else ""), METRICAS_CLASIFICACION[metrica]: formato(fila["valor"])}
+                for i, fila in enumerate(top, start=1)
+            ]),
+            hide_index=True,
+        )
+    else:
+        st.info("Todavía no hay jugadores en la clasificación.")
+    st.caption(f"Se actualiza cada {CLASIFICACION_TTL} segundos.")
 
+# ============================
+# INTERFAZ STREAMLIT
+# ============================
 
+if __name__ == "__main__" and get_script_run_ctx(suppress_warning=True) is None:
+    sys.exit(admin_cli(sys.argv[1:]))
 
+_inicio_pagina = time.perf_counter()
+st.title("📒 Inventario de Brainrots")
+try:
+    shared_cache()
+except RuntimeError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+sync_session_cookie()
+start_api_server()
+
+compartido = st.query_params.get("compartido")
+if compartido:
+    instantanea = shared_snapshot(compartido)
+    if instantanea is None:
+        st.error("❌ Este enlace no existe o su dueño dejó de compartirlo.")
+    else:
+        st.markdown(instantanea[1], unsafe_allow_html=True)
+    st.stop()
 
+# ============================
+# 🖥️ INTERFAZ LOGIN / SIGNUP
+# ============================
 
+if not load_session_token():
+    tabs = st.tabs(["🔑 Iniciar sesión", "🆕 Registrarse"])
 
+    with tabs[0]:
+        email = st.text_input("Correo", key="login_email_input")
+        password = st.text_input("Contraseña", type="password", key="login_pass_input")
+        if st.button("Entrar", key="login_button"):
+            user = login(email, password)
+            if "error" in user:
+                st.error(user["error"]["message"])
+            else:
+                save_session_token(
+                    user.get("localId"),
+                    user.get("email"),
+                    user.get("idToken"),
+                    user.get("refreshToken"),
+                )
+                st.success(f"✅ Sesión iniciada: {user['email']}")
+                st.rerun()
 
+    with tabs[1]:
+        new_email = st.text_input("Correo nuevo", key="signup_email_input")
+        new_pass = st.text_input("Contraseña nueva", type="password", key="signup_pass_input", placeholder="Mínimo 6 caracteres")
+        if st.button("Crear cuenta", key="signup_button"):
+            user = signup(new_email, new_pass)
+            if "error" in user:
+                st.error(user["error"]["message"])
+            else:
+                st.success(f"✅ Cuenta creada: {new_email}. Ahora puedes iniciar sesión.")
 
+else:
+    st.success(f"✅ Bienvenido {st.session_state['user']['email']}")
+    for error in pop_background_errors(st.session_state["user"]["uid"]):
+        st.error(f"❌ Error en segundo plano: {error}")
+    if over_budget(st.session_state["user"]["uid"], "lecturas"):
+        st.warning("📉 Alcanzaste el límite diario de lecturas: se muestran los datos guardados en caché, que pueden no estar al día.")
 
 
+    # ============================
+    # PESTAÑAS PRINCIPALES
+    # ============================
+    pestañas = st.tabs(["👤 Perfiles", "📦 Inventario", "🤝 Intercambios", "🏆 Clasificación", "⚙️ Opciones"])
 
+    # ============================
+    # 👤 GESTIÓN DE PERFILES
+    # ============================
+    with pestañas[0]:
+        with st.container(border=True):
+            st.subheader("👤 Gestión de Perfiles")
+            
+            perfil_actual = None
+            uid = st.session_state["user"]["uid"]
+            resumenes = list_profile_summaries(uid)
+            perfiles = with_pending_profiles(uid, list(resumenes))
+            start_profile_prefetch(uid, perfiles)
+            schedule_leaderboard_reconcile(uid)
 
+            if perfiles:
+                filas_resumen = []
+                for perfil in perfiles:
+                    resumen = resumenes.get(perfil) or {}
+                    filas_resumen.append({
+                        "Perfil": perfil,
+                        "Pilas": resumen.get("pilas"),
+                        "Copias": resumen.get("copias"),
+                        "Ingreso": format_num(resumen.get("ingreso", 0)),
+                        "Mejor Brainrot": resumen.get("top") or "—",
+                    })
+                st.dataframe(pd.DataFrame(filas_resumen), hide_index=True)
+                perfil_actual = st.selectbox("Selecciona un perfil", ["(ninguno)"] + perfiles)
+            else:
+                st.info("No tienes perfiles creados todavía.")
 
+            profile_manager(uid, perfil_actual)
 
+    # ============================
+    # INVENTARIO DE BRAINROTS
+    # ============================
+    with pestañas[1]:
+        if perfil_actual and perfil_actual != "(ninguno)":
+            perfil_anterior = st.session_state.get("perfil_activo")
+            if perfil_anterior and perfil_anterior != perfil_actual:
+                _submit_flush(uid, perfil_anterior)
+            st.session_state["perfil_activo"] = perfil_actual
+
+            estado_perfil = cached_profile(uid, perfil_actual)
+            brainrots = normalize_inventory(uid, perfil_actual, estado_perfil, resumenes)
+            cuentas = account_names(estado_perfil["cuentas"])
+            record_income_snapshot(uid, perfil_actual, brainrots)
+
+            st.subheader(f"📦 Inventario — Perfil: {perfil_actual}")
+            if pending_write_count(uid, perfil_actual) or write_error(uid, perfil_actual):
+                save_status(uid, perfil_actual)
+
+            col_deshacer, col_rehacer = st.columns(2)
+            with col_deshacer:
+                ultima = stack_top(uid, perfil_actual, estado_perfil, "deshacer")
+                if ultima is not None:
+                    if st.button("↩️ Deshacer", help=f"Deshacer: {describe_op(ultima)}", key="deshacer_button"):
+                        try:
+                            undo_last(uid, perfil_actual, estado_perfil)
+                        except RateLimited as e:
+                            st.warning(f"⏳ {e}")
+                        except (BudgetExceeded, SaveFailed) as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            st.rerun()
+            with col_rehacer:
+                siguiente = stack_top(uid, perfil_actual, estado_perfil, "rehacer")
+                if siguiente is not None:
+                    if st.button("↪️ Rehacer", help=f"Rehacer: {describe_op(siguiente)}", key="rehacer_button"):
+                        try:
+                            redo_last(uid, perfil_actual, estado_perfil)
+                        except RateLimited as e:
+                            st.warning(f"⏳ {e}")
+                        except (BudgetExceeded, SaveFailed) as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            st.rerun()
 
+            accounts_panel(uid, perfil_actual)
+            add_brainrot_panel(uid, perfil_actual)
+            if brainrots:
+                inventory_table(uid, perfil_actual)
+                delete_move_panel(uid, perfil_actual)
+            else:
+                st.info("Tu inventario está vacío; agrega tu primer Brainrot.")
+            if cuentas and brainrots:
+                loadout_optimizer_panel(uid, perfil_actual)
+            if brainrots:
+                upgrade_simulator_panel(uid, perfil_actual)
+            income_history_panel(uid, perfil_actual)
+            share_panel(uid, perfil_actual)
+        else:
+            st.info("Debes seleccionar un perfil para ver tu inventario")
 
+    with pestañas[2]:
+        with st.container(border=True):
+            st.subheader("🤝 Calculadora de intercambios")
+            if perfil_actual and perfil_actual != "(ninguno)":
+                trade_calculator(perfil_actual, cached_profile(uid, perfil_actual)["brainrots"])
+            else:
+                st.info("Selecciona un perfil para armar un intercambio con tu inventario.")
 
+    with pestañas[3]:
+        with st.container(border=True):
+            st.subheader("🏆 Clasificación global")
+            leaderboard_panel(uid)
 
+    with pestañas[4]:
+        with st.container(border=True):
+            st.subheader("⚙️ Opciones")
 
+            if "user" in st.session_state and st.session_state["user"]:
+                if st.button("🚪 Cerrar sesión", key="logout_button"):
+                    flush_all_writes(st.session_state["user"]["uid"])
+                    clear_session_token()
+                    st.session_state.pop("user", None)
+                    st.session_state.pop("perfiles_cache", None)
+                    st.session_state.pop("api_clave", None)
+                    st.success("✅ Sesión cerrada correctamente.")
+                    st.rerun()
 
+            with st.expander("🔌 API de lectura"):
+                st.caption(
+                    "Los bots pueden leer tus perfiles en /api/v1/perfiles y "
+                    "/api/v1/perfiles/{perfil}/inventario enviando la cabecera "
+                    "`Authorization: Bearer <clave>`."
+                )
+                col_generar, col_revocar = st.columns(2)
+                if col_generar.button("🔑 Generar clave nueva", key="api_generar"):
+                    try:
+                        st.session_state["api_clave"] = create_api_key(uid)
+                    except BudgetExceeded as e:
+                        st.warning(str(e))
+                if col_revocar.button("🚫 Revocar claves", key="api_revocar"):
+                    revoke_api_keys(uid)
+                    st.session_state.pop("api_clave", None)
+                    st.success("✅ Claves revocadas.")
+                if st.session_state.get("api_clave"):
+                    st.code(st.session_state["api_clave"], language=None)
+                    st.caption("Guárdala ahora: no se vuelve a mostrar y generar otra invalida ésta.")
+
+            with st.expander("💾 Copia de seguridad"):
+                # Sólo los perfiles propios: las copias de todos los usuarios se
+                # hacen con "python app.py respaldo", que escribe directo a disco.
+                # La copia se genera al pulsar el botón, no en cada rerun.
+                st.download_button(
+                    "⬇️ Descargar copia",
+                    functools.partial(backup_file, uid),
+                    file_name=f"brainrots-{time.strftime('%Y%m%d-%H%M')}.ndjson.gz",
+                    mime="application/gzip",
+                    key="respaldo_descargar",
+                    on_click="ignore",
+                )
 
+                restauracion = st.session_state.get("respaldo_restauracion")
+                if restauracion is None:
+                    subida = st.file_uploader("Restaurar desde una copia", type=["gz"], key="respaldo_subida")
+                    if subida is not None and st.button("♻️ Restaurar", key="respaldo_restaurar"):
+                        contenido = subida.getvalue()
+                        huella = hashlib.sha1(contenido).hexdigest()[:16]
+                        checkpoint = os.path.join(tempfile.gettempdir(), f"brainrots-restaurar-{uid}-{huella}")
+                        try:
+                            futuro = submit_background(uid, "restaurar copia", restore_backup, io.BytesIO(contenido), uid, checkpoint)
+                        except BackgroundBusy as e:
+                            st.warning(str(e))
+                        else:
+                            st.session_state["respaldo_restauracion"] = {"futuro": futuro, "checkpoint": checkpoint}
+                            st.rerun()
+                elif not restauracion["futuro"].done():
+                    restore_status(uid)
+                else:
+                    st.session_state.pop("respaldo_restauracion")
+                    # Si falló, el error ya se muestra arriba entre los de segundo plano.
+                    if restauracion["futuro"].exception() is not None:
+                        st.warning("Repite la restauración con el mismo archivo para continuar donde quedó.")
+                    else:
+                        restaurados, omitidos = restauracion["futuro"].result()
+                        if os.path.exists(restauracion["checkpoint"]):
+                            os.remove(restauracion["checkpoint"])
+                        st.session_state.pop("perfiles_cache", None)
+                        st.success(f"✅ {restaurados} perfiles restaurados" + (f" ({omitidos} ya lo estaban)." if omitidos else "."))
+
+            with st.expander("📊 Consumo de Firestore"):
+                sesion = session_usage()
+                filas_consumo = []
+                for metrica in METRICAS_CONSUMO:
+                    presupuesto = usage_budget(metrica)
+                    filas_consumo.append({
+                        "Métrica": metrica.capitalize(),
+                        "Esta sesión": sesion[metrica],
+                        "Hoy": usage_today(uid, metrica),
+                        "Límite diario": f"{presupuesto:,}" if presupuesto else "—",
+                    })
+                st.dataframe(pd.DataFrame(filas_consumo), hide_index=True)
+                if _usage_store()["error"]:
+                    st.warning(f"⚠️ El último guardado del consumo falló y se reintentará: {_usage_store()['error']}")
+                if is_admin(uid) and st.toggle("🛡️ Ver consumo por usuario", key="consumo_admin"):
+                    dia = st.date_input("Día (UTC)", value=datetime.date(*time.gmtime()[:3]), key="consumo_dia")
+                    informe = usage_report(dia.strftime("%Y-%m-%d"))
+                    if informe.empty:
+                        st.info("No hay consumo registrado ese día.")
+                    else:
+                        st.dataframe(informe, hide_index=True)
+                        st.caption(
+                            f"Total: {informe['Lecturas'].sum()} lecturas, {informe['Escrituras'].sum()} escrituras, "
+                            f"{informe['Bytes'].sum() / 1_048_576:.1f} MiB"
+                        )
+                    st.markdown("#### ⏳ Límites de frecuencia (este proceso)")
+                    st.dataframe(rate_limit_metrics(), hide_index=True)
 
+            with st.expander("⏱️ Tiempos de la interfaz"):
+                st.caption(
+                    "Duración de cada sección en esta sesión. Las interacciones dentro de un panel "
+                    "sólo vuelven a ejecutar ese panel; la tabla se actualiza en cada recarga completa."
+                )
+                st.dataframe(timing_frame(), hide_index=True)
 
+st.divider()
+st.markdown(
+    """
+    <div style='text-align: left;'>
+        <a href="https://www.roblox.com/es/games/109983668079237/Steal-a-Brainrot" target="_blank" rel="noopener noreferrer">
+            🎮 Jugar Steal a Brainrot en Roblox
+        </a>
+    </div>
+    """,
+    unsafe_allow_html=True,
+)
+record_timing("página completa", _inicio_pagina)
@@ -0,0 +1,134 @@
+"""Carga app.py sin la interfaz, con Firestore en memoria y secrets de prueba.
+
+La aplicación es un único script de Streamlit, así que ``app`` ejecuta todo lo
+anterior a la sección "INTERFAZ STREAMLIT" en un módulo nuevo por prueba.
+"""
+import atexit
+import functools
+import json
+import pathlib
+import sys
+import threading
+import types
+
+import firebase_admin
+import pytest
+import streamlit as st
+from firebase_admin import firestore
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import fake_firestore  # noqa: E402
+
+APP = pathlib.Path(__file__).resolve().parent.parent / "app.py"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    cliente = fake_firestore.Client()
+    monkeypatch.setattr(firestore, "client", lambda *args, **kwargs: cliente)
+    for nombre in ("DELETE_FIELD", "SERVER_TIMESTAMP", "Increment", "transactional"):
+        monkeypatch.setattr(firestore, nombre, getattr(fake_firestore, nombre))
+    monkeypatch.setitem(firebase_admin._apps, "[DEFAULT]", object())
+    return cliente
+
+
+@pytest.fixture
+def secrets(monkeypatch):
+    valores = {
+        "FIREBASE_KEY": {"type": "service_account"},
+        "firebase": {"api_key": "prueba"},
+        "sesion": {"clave": "prueba"},
+    }
+    monkeypatch.setattr(st.secrets, "_secrets", valores)
+    return valores
+
+
+def _load_app():
+    fuente = APP.read_text(encoding="utf-8")
+    corte = fuente.rindex("# ====", 0, fuente.index("# INTERFAZ STREAMLIT"))
+    modulo = types.ModuleType("brainrots_app")
+    modulo.__file__ = str(APP)
+    exec(compile(fuente[:corte], str(APP), "exec"), modulo.__dict__)
+    return modulo
+
+
+def _unload_app(modulo):
+    for cola in modulo._write_queues()["colas"].values():
+        if cola["timer"] is not None:
+            cola["timer"].cancel()
+    modulo._background_runner()["executor"].shutdown(wait=True)
+    uso = modulo._usage_store()
+    if uso["timer"] is not None:
+        uso["timer"].cancel()
+    atexit.unregister(modulo.flush_all_writes)
+    atexit.unregister(modulo.flush_usage)
+
+
+def _own_resource(fn=None, **opciones):
+    """``st.cache_resource`` propio de un módulo, para simular otro proceso."""
+    if fn is None:
+        return _own_resource
+    valores = {}
+    lock = threading.RLock()
+
+    @functools.wraps(fn)
+    def recurso(*args):
+        with lock:
+            if args not in valores:
+                valores[args] = fn(*args)
+            return valores[args]
+
+    recurso.clear = valores.clear
+    return recurso
+
+
+@pytest.fixture
+def app(db, secrets, monkeypatch):
+    monkeypatch.delenv("BRAINROT_REDIS_URL", raising=False)
+    monkeypatch.delenv("BRAINROT_API_PUERTO", raising=False)
+    st.cache_resource.clear()
+    modulo = _load_app()
+    yield modulo
+    _unload_app(modulo)
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def otro_proceso(app, monkeypatch):
+    """Segunda copia de la aplicación, como si corriera en otro proceso.
+
+    Tiene su propia memoria (colas de escritura, modelos decodificados, pool de
+    segundo plano) y comparte con ``app`` Firestore y la caché compartida.
+    """
+    with monkeypatch.context() as m:
+        m.setattr(st, "cache_resource", _own_resource)
+        modulo = _load_app()
+    modulo.shared_cache = app.shared_cache
+    yield modulo
+    _unload_app(modulo)
+
+
+def brainrot(item_id, nombre="Tim Cheese", cuenta="(ninguna)", cantidad=1, total=100, color="-", mutaciones=()):
+    """Pila de prueba en el formato del inventario."""
+    return {
+        "id": item_id,
+        "Brainrot": nombre,
+        "Color": color,
+        "Mutaciones": list(mutaciones),
+        "Cuenta": cuenta,
+        "Total": total,
+        "Cantidad": cantidad,
+    }
+
+
+def publish_catalog(app, tmp_path, monkeypatch, **nuevo):
+    """Escribe una versión nueva del catálogo con un Brainrot más y fuerza su revisión."""
+    with open(app.CATALOGO_ARCHIVO, encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] += 1
+    data["brainrots"].append({"id": max(b["id"] for b in data["brainrots"]) + 1, **nuevo})
+    archivo = tmp_path / "catalogo.json"
+    archivo.write_text(json.dumps(data), encoding="utf-8")
+    monkeypatch.setattr(app, "CATALOGO_ARCHIVO", str(archivo))
+    app._catalog_store()["revisado"] = 0.0
+    return data
@@ -0,0 +1,356 @@
+"""Firestore en memoria con la parte de la API de google-cloud-firestore que usa app.py.
+
+Sirve para las pruebas sin emulador: documentos y subcolecciones, consultas
+con where/order_by/limit/select, collection_group, count(), get_all, batches
+y transacciones, y los centinelas (Increment, DELETE_FIELD, SERVER_TIMESTAMP).
+``Client.lecturas`` y ``Client.escrituras`` cuentan las operaciones que
+Firestore facturaría.
+"""
+import copy
+import datetime
+import itertools
+import threading
+import uuid
+
+
+class Sentinel:
+    def __init__(self, tipo, valor=None):
+        self.tipo = tipo
+        self.valor = valor
+
+
+DELETE_FIELD = Sentinel("borrar")
+SERVER_TIMESTAMP = Sentinel("hora")
+
+
+def Increment(valor):
+    return Sentinel("sumar", valor)
+
+
+class NotFound(Exception):
+    pass
+
+
+_reloj = itertools.count(1)
+
+
+def _ahora():
+    return datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(microseconds=next(_reloj))
+
+
+def _partes(ruta):
+    """Separa una ruta de campo con puntos respetando los nombres entre comillas invertidas."""
+    partes, actual, citado = [], "", False
+    for ch in ruta:
+        if ch == "`":
+            citado = not citado
+        elif ch == "." and not citado:
+            partes.append(actual)
+            actual = ""
+        else:
+            actual += ch
+    partes.append(actual)
+    return partes
+
+
+def _valor(data, ruta):
+    for parte in _partes(ruta):
+        data = data[parte]
+    return data
+
+
+def _aplicar(anterior, nuevo, merge):
+    """Resultado de escribir ``nuevo`` sobre ``anterior`` (set, set con merge o update)."""
+    if isinstance(merge, list):
+        nuevo = {".".join(f"`{p}`" for p in _partes(ruta)): _valor(nuevo, ruta) for ruta in merge}
+        merge = True
+    salida = copy.deepcopy(anterior) if merge and anterior else {}
+    for clave, valor in nuevo.items():
+        partes = _partes(clave) if merge else [clave]
+        destino = salida
+        for parte in partes[:-1]:
+            destino = destino.setdefault(parte, {})
+        clave = partes[-1]
+        if isinstance(valor, Sentinel):
+            if valor.tipo == "sumar":
+                destino[clave] = destino.get(clave, 0) + valor.valor
+            elif valor.tipo == "borrar":
+                destino.pop(clave, None)
+            else:
+                destino[clave] = _ahora()
+        elif isinstance(valor, dict) and (merge and isinstance(destino.get(clave), dict) or _con_centinelas(valor)):
+            destino[clave] = _aplicar(destino.get(clave) if merge else None, valor, True)
+        else:
+            destino[clave] = copy.deepcopy(valor)
+    return salida
+
+
+def _con_centinelas(data):
+    return any(isinstance(v, Sentinel) or isinstance(v, dict) and _con_centinelas(v) for v in data.values())
+
+
+class DocumentSnapshot:
+    def __init__(self, ref, data, update_time, campos=None):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self.create_time = update_time
+        if data is not None and campos is not None:
+            data = {k: v for k, v in data.items() if any(_partes(c)[0] == k for c in campos)}
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, campo):
+        return copy.deepcopy(_valor(self._data, campo))
+
+
+class DocumentReference:
+    def __init__(self, client, ruta):
+        self._client = client
+        self.path = ruta
+        self.id = ruta.rsplit("/", 1)[-1]
+
+    def __eq__(self, otro):
+        return isinstance(otro, DocumentReference) and otro.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, nombre):
+        return CollectionReference(self._client, f"{self.path}/{nombre}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._leer(self, field_paths)
+
+    def set(self, data, merge=False):
+        self._client._escribir([("set", self, data, merge)])
+
+    def update(self, data):
+        self._client._escribir([("update", self, data, True)])
+
+    def delete(self):
+        self._client._escribir([("delete", self, None, False)])
+
+
+class Query:
+    def __init__(self, client, ruta, grupo=False):
+        self._client = client
+        self._ruta = ruta
+        self._grupo = grupo
+        self._filtros = []
+        self._orden = []
+        self._limite = None
+        self._campos = None
+
+    def _copia(self, **cambios):
+        consulta = Query(self._client, self._ruta, self._grupo)
+        consulta._filtros = list(self._filtros)
+        consulta._orden = list(self._orden)
+        consulta._limite = self._limite
+        consulta._campos = self._campos
+        for nombre, valor in cambios.items():
+            setattr(consulta, nombre, valor)
+        return consulta
+
+    def where(self, campo, operador, valor):
+        return self._copia(_filtros=self._filtros + [(campo, operador, valor)])
+
+    def order_by(self, campo, direction="ASCENDING"):
+        return self._copia(_orden=self._orden + [(campo, direction)])
+
+    def limit(self, n):
+        return self._copia(_limite=n)
+
+    def select(self, campos):
+        return self._copia(_campos=list(campos))
+
+    def _coincide(self, ruta, data):
+        partes = ruta.split("/")
+        if self._grupo:
+            if len(partes) < 2 or partes[-2] != self._ruta:
+                return False
+        elif "/".join(partes[:-1]) != self._ruta:
+            return False
+        for campo, operador, valor in self._filtros:
+            try:
+                actual = _valor(data, campo)
+            except (KeyError, TypeError):
+                return False
+            if operador == "in":
+                ok = actual in valor
+            else:
+                ok = {
+                    "==": actual == valor, "!=": actual != valor,
+                    "<": actual < valor, "<=": actual <= valor,
+                    ">": actual > valor, ">=": actual >= valor,
+                }[operador]
+            if not ok:
+                return False
+        return True
+
+    def _resultados(self):
+        with self._client._lock:
+            docs = sorted(self._client._docs.items())
+        encontrados = [(ruta, data, hora) for ruta, (data, hora) in docs if self._coincide(ruta, data)]
+        for campo, direccion in reversed(self._orden):
+            encontrados = [r for r in encontrados if _tiene(r[1], campo)]
+            encontrados.sort(key=lambda r: _valor(r[1], campo), reverse=direccion == "DESCENDING")
+        if self._limite is not None:
+            encontrados = encontrados[:self._limite]
+        return [
+            DocumentSnapshot(DocumentReference(self._client, ruta), copy.deepcopy(data), hora, self._campos)
+            for ruta, data, hora in encontrados
+        ]
+
+    def stream(self, transaction=None):
+        resultados = self._resultados()
+        self._client.lecturas += max(len(resultados), 1)
+        return iter(resultados)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def count(self, alias=None):
+        return _Count(self)
+
+
+def _tiene(data, campo):
+    try:
+        _valor(data, campo)
+    except (KeyError, TypeError):
+        return False
+    return True
+
+
+class _Count:
+    def __init__(self, consulta):
+        self._consulta = consulta
+
+    def get(self, transaction=None):
+        self._consulta._client.lecturas += 1
+        return [[_Agregado(len(self._consulta._resultados()))]]
+
+
+class _Agregado:
+    def __init__(self, valor):
+        self.value = valor
+
+
+class CollectionReference(Query):
+    def __init__(self, client, ruta):
+        super().__init__(client, ruta)
+        self.id = ruta.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        if "/" not in self._ruta:
+            return None
+        return DocumentReference(self._client, self._ruta.rsplit("/", 1)[0])
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._client, f"{self._ruta}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def list_documents(self):
+        prefijo = self._ruta + "/"
+        with self._client._lock:
+            ids = {ruta[len(prefijo):].split("/")[0] for ruta in self._client._docs if ruta.startswith(prefijo)}
+        return [self.document(doc_id) for doc_id in sorted(ids)]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._escrituras = []
+
+    def set(self, ref, data, merge=False):
+        self._escrituras.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._escrituras.append(("update", ref, data, True))
+
+    def delete(self, ref):
+        self._escrituras.append(("delete", ref, None, False))
+
+    def commit(self):
+        if len(self._escrituras) > 500:
+            raise ValueError("Un batch admite como mucho 500 escrituras.")
+        escrituras, self._escrituras = self._escrituras, []
+        self._client._escribir(escrituras)
+
+    def __len__(self):
+        return len(self._escrituras)
+
+
+class Transaction(WriteBatch):
+    """Las escrituras se aplican juntas al terminar la función ``transactional``."""
+
+
+def transactional(fn):
+    def envoltura(transaccion, *args, **kwargs):
+        with transaccion._client._lock:
+            resultado = fn(transaccion, *args, **kwargs)
+            transaccion.commit()
+        return resultado
+    return envoltura
+
+
+class Client:
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.RLock()
+        self.lecturas = 0
+        self.escrituras = 0
+        self.fallar = None
+
+    def collection(self, nombre):
+        return CollectionReference(self, nombre)
+
+    def document(self, ruta):
+        return DocumentReference(self, ruta)
+
+    def collection_group(self, nombre):
+        return Query(self, nombre, grupo=True)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        for ref in refs:
+            yield ref.get(field_paths=field_paths)
+
+    def _leer(self, ref, campos):
+        with self._lock:
+            self.lecturas += 1
+            data, hora = self._docs.get(ref.path, (None, None))
+            return DocumentSnapshot(ref, copy.deepcopy(data), hora, campos)
+
+    def _escribir(self, escrituras):
+        """Aplica las escrituras de una vez; ``fallar`` permite simular errores de red."""
+        if self.fallar is not None:
+            self.fallar(escrituras)
+        with self._lock:
+            for tipo, ref, _, _ in escrituras:
+                if tipo == "update" and ref.path not in self._docs:
+                    raise NotFound(ref.path)
+            for tipo, ref, data, merge in escrituras:
+                self.escrituras += 1
+                if tipo == "delete":
+                    self._docs.pop(ref.path, None)
+                else:
+                    anterior = self._docs.get(ref.path, (None, None))[0]
+                    self._docs[ref.path] = (_aplicar(anterior, data, merge), _ahora())
+
+    def dump(self, prefijo=""):
+        """Copia de los documentos cuya ruta empieza por ``prefijo``."""
+        with self._lock:
+            return {ruta: copy.deepcopy(data) for ruta, (data, _) in self._docs.items() if ruta.startswith(prefijo)}
@@ -0,0 +1,66 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from conftest import brainrot
+
+
+@pytest.fixture
+def api(app):
+    """Servidor de la API en un hilo, como lo arranca start_api_server."""
+    servidor = app.ThreadingHTTPServer(("127.0.0.1", 0), app.ApiHandler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    clave = app.create_api_key("u1")
+
+    def get(ruta):
+        peticion = urllib.request.Request(
+            f"http://127.0.0.1:{servidor.server_port}{ruta}", headers={"Authorization": f"Bearer {clave}"}
+        )
+        with urllib.request.urlopen(peticion) as respuesta:
+            return json.load(respuesta)
+
+    yield get
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def publish_catalog(app, tmp_path, monkeypatch, **nuevo):
+    """Escribe una versión nueva del catálogo con un Brainrot más y fuerza su revisión."""
+    with open(app.CATALOGO_ARCHIVO, encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] += 1
+    data["brainrots"].append({"id": max(b["id"] for b in data["brainrots"]) + 1, **nuevo})
+    archivo = tmp_path / "catalogo.json"
+    archivo.write_text(json.dumps(data), encoding="utf-8")
+    monkeypatch.setattr(app, "CATALOGO_ARCHIVO", str(archivo))
+    app._catalog_store()["revisado"] = 0.0
+    return data
+
+
+def test_api_uses_the_reloaded_catalog(app, api, tmp_path, monkeypatch):
+    app.save_data("u1", "p", [brainrot("a1", "Tim Cheese", total=5)], [])
+    assert [b["Brainrot"] for b in api("/api/v1/perfiles/p/inventario")["items"]] == ["Tim Cheese"]
+    version = api("/api/v1/catalogo")["version"]
+
+    data = publish_catalog(app, tmp_path, monkeypatch, nombre="Brainrot Nuevo", ingreso=777, calidad="Secreto")
+    nuevo_id = data["brainrots"][-1]["id"]
+    app.save_data("u1", "p", [brainrot("a1", "Tim Cheese", total=5), brainrot("b2", "Brainrot Nuevo", total=777)], [])
+
+    # El nuevo Brainrot se guardó codificado con su id de catálogo...
+    base = app._profile_ref("u1", "p").get().to_dict()
+    assert "b2" in base["inv"]["i"] and not base["brainrots"]
+    # ...y el hilo de la API lo resuelve con la versión nueva.
+    items = {b["id"]: b for b in api("/api/v1/perfiles/p/inventario")["items"]}
+    assert items["b2"]["Brainrot"] == "Brainrot Nuevo" != f"Brainrot #{nuevo_id}"
+    assert items["b2"]["Calidad"] == "Secreto"
+    assert api("/api/v1/catalogo")["version"] == version + 1
+
+
+def test_decode_after_reload_names_new_ids(app, tmp_path, monkeypatch):
+    publish_catalog(app, tmp_path, monkeypatch, nombre="Brainrot Nuevo", ingreso=1, calidad="Secreto")
+    documento = app.encode_inventory([brainrot("b2", "Brainrot Nuevo")], [])
+    brainrots, _ = app.decode_inventory(documento)
+    assert (brainrots[0]["Brainrot"], brainrots[0]["Calidad"]) == ("Brainrot Nuevo", "Secreto")
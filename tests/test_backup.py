@@ -0,0 +1,69 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from conftest import brainrot
+
+
+def copia(*lineas):
+    salida = io.BytesIO()
+    with gzip.GzipFile(fileobj=salida, mode="wb") as gz:
+        for linea in lineas:
+            gz.write((linea if isinstance(linea, str) else json.dumps(linea)).encode("utf-8") + b"\n")
+    return io.BytesIO(salida.getvalue())
+
+
+def perfil(items, cuentas=(), **extra):
+    clave = {"uid": "u1", "perfil": "p"}
+    return [
+        {"tipo": "cabecera", "version": 1},
+        dict(clave, tipo="perfil", cuentas=list(cuentas), pilas=len(items), **extra),
+        dict(clave, tipo="pilas", items=items),
+    ]
+
+
+def test_restore_recomputes_quality_and_total(app, db):
+    pila = dict(brainrot("a1", "Tim Cheese", cuenta="Main", total=10**15), Calidad="OG", extra="<script>")
+    app.restore_backup(copia(*perfil([pila], [{"id": 0, "nombre": "Main"}])), "u1")
+
+    (guardada,) = app.load_profile("u1", "p")["brainrots"]
+    catalogo = app.current_catalog()["brainrots"]["Tim Cheese"]
+    assert guardada["Calidad"] == catalogo["quality"] != "OG"
+    assert guardada["Total"] == catalogo["income"]
+    assert "extra" not in guardada
+
+
+@pytest.mark.parametrize("pila, cuentas", [
+    (brainrot("a1", "<img src=x onerror=alert(1)>"), []),
+    (brainrot("a1", color="<script>"), []),
+    (brainrot("a1", mutaciones=["<b>"]), []),
+    (brainrot("a1", cuenta="Fantasma"), []),
+    (brainrot("a1", cantidad=0), []),
+    (brainrot("a1"), [{"id": "x", "nombre": "Main"}]),
+    (brainrot("a1"), [{"id": 0, "nombre": "Main"}, {"id": 0, "nombre": "Alt"}]),
+])
+def test_restore_rejects_items_outside_the_catalog(app, db, pila, cuentas):
+    with pytest.raises(ValueError, match="Línea 3|Línea 2"):
+        app.restore_backup(copia(*perfil([pila], cuentas)), "u1")
+    assert app.load_profile("u1", "p")["brainrots"] == []
+
+
+def test_restore_rejects_malformed_lines(app, db):
+    for lineas in (
+        perfil([brainrot("a1")]) + ["{no es json"],
+        perfil([brainrot("a1")]) + [{"tipo": "otro", "uid": "u1", "perfil": "p"}],
+        perfil([brainrot("a1")], deshacer=[{"k": "add", "b": dict(brainrot("a1"), Brainrot="Nadie")}]),
+        perfil([brainrot("a1")]) + [{"tipo": "historial", "uid": "u1", "perfil": "p", "data": {"h": {"x": 1}}}],
+    ):
+        with pytest.raises(ValueError, match="Línea"):
+            list(app.read_backup(copia(*lineas)))
+
+
+def test_backup_file_streams_to_a_temporary_file(app, db):
+    app.save_data("u1", "p", [brainrot("a1", total=1)], [])
+    with app.backup_file("u1") as archivo:
+        assert not isinstance(archivo, io.BytesIO)
+        (respaldo,) = list(app.read_backup(archivo))
+    assert respaldo["perfil"] == "p" and len(respaldo["brainrots"]) == 1
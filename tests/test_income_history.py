@@ -0,0 +1,53 @@
+import time
+
+from conftest import brainrot
+
+DIA = 86400
+
+
+def registrar(app, total, ahora):
+    assert app.record_income_snapshot("u1", "p", [brainrot("a1", total=total)], ahora=ahora)
+    limite = time.time() + 5
+    while app.background_pending("u1") and time.time() < limite:
+        time.sleep(0.01)
+
+
+def guardado(db):
+    return db.dump("perfiles/u1/historial/p")["perfiles/u1/historial/p"]
+
+
+def test_reading_filters_expired_points_without_writing(app, db):
+    inicio = 1_700_000_000
+    registrar(app, 100, inicio)
+    escrituras = db.escrituras
+    puntos = app.load_income_history("u1", "p", "h", ahora=inicio + 8 * DIA)
+    assert puntos == []
+    assert db.escrituras == escrituras
+    assert len(guardado(db)["h"]) == 1
+
+
+def test_first_snapshot_of_a_day_prunes_expired_points(app, db):
+    inicio = 1_700_000_000
+    registrar(app, 100, inicio)
+    registrar(app, 200, inicio + 3600)
+    assert len(guardado(db)["h"]) == 2
+
+    registrar(app, 300, inicio + 8 * DIA)
+    historial = guardado(db)
+    assert list(historial["h"]) == [app.history_buckets(inicio + 8 * DIA)["h"]]
+    # Los días y las semanas siguen dentro de su retención.
+    assert len(historial["d"]) == 2 and len(historial["w"]) == 2
+
+
+def test_flush_records_a_snapshot(app, db, monkeypatch):
+    monkeypatch.setattr(app, "take_token", lambda tipo, clave: None)
+    monkeypatch.setattr(app, "GUARDADO_DEBOUNCE", 600)
+    monkeypatch.setattr(app, "GUARDADO_MAX_ESPERA", 600)
+    estado = app.load_profile("u1", "p")
+    app.commit_op("u1", "p", estado, {"k": "add", "b": app.op_item(brainrot("a1", total=500))})
+    assert app.flush_writes("u1", "p")
+    limite = time.time() + 5
+    while app.background_pending("u1") and time.time() < limite:
+        time.sleep(0.01)
+    (punto,) = guardado(db)["d"].values()
+    assert punto["t"] == app.item_income(estado["brainrots"][0])
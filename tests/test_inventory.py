@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import brainrot, publish_catalog
+
+
+@pytest.fixture
+def sesion(app):
+    for clave in list(app.st.session_state.keys()):
+        del app.st.session_state[clave]
+    yield app
+    for clave in list(app.st.session_state.keys()):
+        del app.st.session_state[clave]
+
+
+def test_index_is_reused_while_nothing_changes(sesion):
+    brainrots = [brainrot("a1"), brainrot("a2", cuenta="alt")]
+    indice = sesion.get_inventory_index("p", brainrots)
+    assert sesion.get_inventory_index("p", [dict(b) for b in brainrots]) is indice
+
+
+@pytest.mark.parametrize("cambio, filtro", [
+    ({"Color": "Oro"}, {"colores": ["Oro"]}),
+    ({"Mutaciones": ["Lluvia"]}, {"mutaciones": ["Lluvia"]}),
+    ({"Calidad": "Secreto"}, {"rarezas": ["Secreto"]}),
+])
+def test_index_is_rebuilt_when_a_filtered_field_changes(sesion, cambio, filtro):
+    brainrots = [brainrot("a1", color="-"), brainrot("a2")]
+    indice = sesion.get_inventory_index("p", brainrots)
+    # Mismo id, cuenta, total y cantidad: sólo cambia un campo por el que se filtra.
+    editados = [dict(brainrots[0], **cambio), brainrots[1]]
+    nuevo = sesion.get_inventory_index("p", editados)
+    assert nuevo is not indice
+    assert [b["id"] for b in nuevo.filtrar(**filtro)] == ["a1"]
+
+
+def test_index_is_rebuilt_when_the_catalog_changes(sesion, tmp_path, monkeypatch):
+    brainrots = [brainrot("a1")]
+    indice = sesion.get_inventory_index("p", brainrots)
+    publish_catalog(sesion, tmp_path, monkeypatch, nombre="Brainrot Nuevo", ingreso=777, calidad="Secreto")
+    assert sesion.get_inventory_index("p", brainrots) is not indice
+
+
+def test_new_catalog_version_discards_decoded_profiles(app, tmp_path, monkeypatch):
+    app.save_data("u1", "p", [brainrot("a1", "Tim Cheese")], [])
+    app.load_profile("u1", "p")
+    hora = app._profile_ref("u1", "p").get(field_paths=[]).update_time
+    assert app.decoded_profile("u1", "p", hora) is not None
+
+    publish_catalog(app, tmp_path, monkeypatch, nombre="Brainrot Nuevo", ingreso=777, calidad="Secreto")
+    assert app.decoded_profile("u1", "p", hora) is None
@@ -0,0 +1,36 @@
+from conftest import brainrot
+
+
+def poblar(app):
+    for uid, total in (("u1", 300), ("u2", 200), ("u3", 100)):
+        app.save_data(uid, "p", [brainrot("a1", total=total)], [])
+        app.reconcile_leaderboard(uid)
+
+
+def test_users_are_private_by_default_with_a_random_alias(app, db):
+    poblar(app)
+    for uid in ("u1", "u2", "u3"):
+        publico, nombre = app.leaderboard_settings(uid)
+        assert not publico
+        assert nombre.startswith("Jugador-") and uid not in nombre
+    assert app.leaderboard_top("u1", "ingreso") == []
+    assert app.leaderboard_position("u1", "ingreso") == (None, 300)
+
+
+def test_only_public_users_are_ranked(app, db):
+    poblar(app)
+    assert app.set_leaderboard_settings("u2", True, "  Bombardino  ") == "Bombardino"
+    app.set_leaderboard_settings("u3", True, "")
+
+    top = app.leaderboard_top("u1", "ingreso")
+    assert [fila["uid"] for fila in top] == ["u2", "u3"]
+    assert top[0]["nombre"] == "Bombardino" and top[1]["nombre"].startswith("Jugador-")
+    # u1 tiene más ingreso pero es privado: no cuenta para la posición de u2.
+    assert app.leaderboard_position("u2", "ingreso") == (1, 200)
+
+    # Hacerse privado lo saca del top cacheado.
+    app.set_leaderboard_settings("u2", False, "Bombardino")
+    assert [fila["uid"] for fila in app.leaderboard_top("u1", "ingreso")] == ["u3"]
+    # La reconciliación no cambia la elección del usuario.
+    app.reconcile_leaderboard("u2")
+    assert app.leaderboard_settings("u2") == (False, "Bombardino")
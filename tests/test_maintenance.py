@@ -0,0 +1,30 @@
+from conftest import brainrot
+
+
+def resumenes_viejos(app, n):
+    for i in range(n):
+        app.save_data(f"u{i % 3}", f"p{i}", [brainrot("a1", total=100 + i)], [])
+        app._profile_ref(f"u{i % 3}", f"p{i}").set({"resumen": app.firestore.DELETE_FIELD}, merge=True)
+
+
+def test_summaries_are_batched_and_checkpointed_after_commit(app, db, tmp_path):
+    resumenes_viejos(app, 40)
+    checkpoint = tmp_path / "checkpoint"
+    cifras = app.run_maintenance(["cuentas"], hilos=4, checkpoint=str(checkpoint), reportar=lambda texto: None)
+
+    assert cifras["resúmenes"] == 40 and cifras["errores"] == 0
+    assert all(app._profile_ref(f"u{i % 3}", f"p{i}").get().to_dict()["resumen"]["copias"] == 1 for i in range(40))
+    assert len(checkpoint.read_text(encoding="utf-8").splitlines()) == 40
+
+
+def test_failed_summary_batch_is_not_checkpointed(app, db, tmp_path):
+    resumenes_viejos(app, 5)
+    checkpoint = tmp_path / "checkpoint"
+
+    def fallar(escrituras):
+        raise RuntimeError("sin red")
+
+    db.fallar = fallar
+    cifras = app.run_maintenance(["cuentas"], checkpoint=str(checkpoint), reportar=lambda texto: None)
+    assert cifras["errores"] == 5
+    assert not checkpoint.exists() or checkpoint.read_text(encoding="utf-8") == ""
@@ -0,0 +1,139 @@
+import types
+
+import pytest
+
+
+class Reloj:
+    def __init__(self, inicio=1000.0):
+        self.ahora = inicio
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(app, monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(app.time, "monotonic", reloj)
+    return reloj
+
+
+@pytest.fixture
+def firebase(app, monkeypatch):
+    """Sustituye la API de Firebase Auth y cuenta las llamadas que llegan a la red."""
+    llamadas = []
+
+    class Respuesta:
+        def json(self):
+            return {"idToken": "t", "localId": "u1"}
+
+    def post(url, data=None, **kwargs):
+        llamadas.append(data["email"])
+        return Respuesta()
+
+    monkeypatch.setattr(app.requests, "post", post)
+    return llamadas
+
+
+def test_bucket_refills_at_its_rate(app, reloj):
+    cubeta = app.TokenBucket(3, 0.5)
+    assert [cubeta.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert cubeta.take() == pytest.approx(2.0)
+
+    reloj.ahora += 1.0
+    assert cubeta.take() == pytest.approx(1.0)
+    reloj.ahora += 1.0
+    assert cubeta.take() == 0.0
+
+    # La recarga no pasa de la capacidad.
+    reloj.ahora += 3600
+    assert [cubeta.take() for _ in range(4)][-1] == pytest.approx(2.0)
+
+
+def test_take_token_raises_with_wait_and_counts(app, reloj):
+    limite = app.LIMITES["escritura"]
+    for _ in range(limite["capacidad"]):
+        app.take_token("escritura", "u1")
+    with pytest.raises(app.RateLimited) as error:
+        app.take_token("escritura", "u1")
+    assert error.value.espera == pytest.approx(1 / limite["recarga"])
+
+    # Otra clave tiene su propia cubeta.
+    app.take_token("escritura", "u2")
+
+    metricas = app.rate_limit_metrics().set_index("Límite")
+    assert metricas.loc["escritura", "rechazadas"] == 1
+    assert metricas.loc["escritura", "permitidas"] == limite["capacidad"] + 1
+    assert metricas.loc["escritura", "Claves activas"] == 2
+
+
+def test_show_rate_limit_turns_the_error_into_a_warning(app, monkeypatch):
+    avisos = []
+    monkeypatch.setattr(app.st, "warning", avisos.append)
+
+    @app.show_rate_limit
+    def panel():
+        raise app.RateLimited("Demasiadas peticiones seguidas", 3)
+
+    assert panel() is None
+    assert avisos == ["⏳ Demasiadas peticiones seguidas"]
+
+
+def test_login_locks_out_after_capacity(app, reloj, firebase, monkeypatch):
+    monkeypatch.setattr(app, "client_ip", lambda: "203.0.113.7")
+    for _ in range(app.LIMITES["auth"]["capacidad"]):
+        assert "error" not in app.login("a@example.com", "x")
+    respuesta = app.login("a@example.com", "x")
+    assert "espera" in respuesta["error"]["message"]
+    assert len(firebase) == app.LIMITES["auth"]["capacidad"]
+
+    # Pasado el tiempo de una ficha se puede volver a intentar.
+    reloj.ahora += 1 / app.LIMITES["auth"]["recarga"]
+    assert "error" not in app.login("a@example.com", "x")
+
+
+def test_auth_limit_follows_the_email_across_addresses(app, reloj, firebase, monkeypatch):
+    ips = iter(f"198.51.100.{i}" for i in range(100))
+    monkeypatch.setattr(app, "client_ip", lambda: next(ips))
+    for _ in range(app.LIMITES["auth_correo"]["capacidad"]):
+        app.login("Victima@example.com", "x")
+    assert "error" in app.login(" victima@example.com", "x")
+    assert "error" not in app.login("otra@example.com", "x")
+
+
+def test_forwarded_client_trusts_only_configured_proxies(app, secrets):
+    cabeceras = {"X-Forwarded-For": "1.2.3.4, 203.0.113.9, 10.0.0.5"}
+    assert app.forwarded_client("10.0.0.1", cabeceras) == "10.0.0.1"
+
+    secrets["limites"] = {"proxies": ["10.0.0.0/8"]}
+    assert app.forwarded_client("10.0.0.1", cabeceras) == "203.0.113.9"
+    # Un par que no es proxy no puede elegir su dirección con la cabecera.
+    assert app.forwarded_client("198.51.100.1", cabeceras) == "198.51.100.1"
+    assert app.forwarded_client("10.0.0.1", {}) == "10.0.0.1"
+
+
+def test_shared_window_counts_across_processes(app):
+    limite = app.LIMITES["auth"]
+    esperas = [app._shared_window_wait("auth", "203.0.113.7") for _ in range(limite["capacidad"] + 1)]
+    assert esperas[:-1] == [0.0] * limite["capacidad"]
+    assert 0 < esperas[-1] <= limite["capacidad"] / limite["recarga"]
+
+
+def test_local_connections_share_one_bucket(app, monkeypatch):
+    contexto = types.SimpleNamespace(ip_address=None, headers={})
+    monkeypatch.setattr(app.st, "context", contexto)
+    assert app.client_ip() == "desconocida"
+    contexto.ip_address = "::1"
+    assert app.client_ip() == "desconocida"
+    contexto.ip_address = "203.0.113.7"
+    assert app.client_ip() == "203.0.113.7"
+
+
+def test_undeclared_local_proxy_uses_the_last_forwarded_hop(app, monkeypatch):
+    avisos = []
+    monkeypatch.setattr(app.log, "warning", lambda mensaje, *args: avisos.append(mensaje))
+    contexto = types.SimpleNamespace(ip_address=None, headers={"X-Forwarded-For": "1.2.3.4, 203.0.113.9"})
+    monkeypatch.setattr(app.st, "context", contexto)
+    assert app.client_ip() == "203.0.113.9"
+    assert app.client_ip() == "203.0.113.9"
+    assert len(avisos) == 1 and "proxies" in avisos[0]
@@ -0,0 +1,67 @@
+import base64
+import json
+import sys
+import types
+
+import pytest
+
+
+@pytest.fixture
+def navegador(app, monkeypatch):
+    """Cookies del navegador y session_state de una sesión nueva."""
+    cookies = {}
+    monkeypatch.setattr(app.st, "context", types.SimpleNamespace(cookies=cookies))
+    for clave in list(app.st.session_state.keys()):
+        del app.st.session_state[clave]
+    yield cookies
+    for clave in list(app.st.session_state.keys()):
+        del app.st.session_state[clave]
+
+
+def payload(cookie):
+    cuerpo = cookie.partition(".")[0]
+    return json.loads(base64.urlsafe_b64decode(cuerpo + "=" * (-len(cuerpo) % 4)))
+
+
+def test_cookie_carries_no_firebase_tokens(app, navegador):
+    app.save_session_token("u1", "a@example.com", "id-secreto", "refresh-secreto")
+    cookie = app.st.session_state["cookie_sesion"]
+    assert set(payload(cookie)) == {"uid", "email", "sid", "exp"}
+    assert "secreto" not in cookie
+
+    # Otro proceso (sesión nueva) restaura la sesión y recupera los tokens de la caché compartida.
+    navegador[app.SESION_COOKIE] = cookie
+    del app.st.session_state["user"]
+    assert app.load_session_token()
+    assert app.st.session_state["user"]["refresh_token"] == "refresh-secreto"
+
+
+def test_logout_revokes_the_cookie(app, navegador):
+    app.save_session_token("u1", "a@example.com", "id", "refresh")
+    cookie = app.st.session_state["cookie_sesion"]
+    app.clear_session_token()
+    assert app.cache_get_json(f"sesion:{payload(cookie)['sid']}") == {"cerrada": True}
+
+    navegador[app.SESION_COOKIE] = cookie
+    del app.st.session_state["sesion_cerrada"]
+    assert not app.load_session_token()
+
+
+def test_tampered_or_old_cookies_are_rejected(app, navegador):
+    app.save_session_token("u1", "a@example.com")
+    cookie = app.st.session_state.pop("cookie_sesion")
+    del app.st.session_state["user"]
+
+    navegador[app.SESION_COOKIE] = cookie[:-1] + ("0" if cookie[-1] != "0" else "1")
+    assert not app.load_session_token()
+    # Las cookies anteriores, sin id de sesión, obligan a iniciar sesión de nuevo.
+    navegador[app.SESION_COOKIE] = app.sign_session({"uid": "u1", "email": "a@example.com", "exp": 2**40})
+    assert not app.load_session_token()
+
+
+def test_configured_redis_without_package_fails_loudly(app, monkeypatch):
+    monkeypatch.setenv("BRAINROT_REDIS_URL", "redis://localhost:6379/0")
+    monkeypatch.setitem(sys.modules, "redis", None)
+    app.st.cache_resource.clear()
+    with pytest.raises(RuntimeError, match="redis"):
+        app.shared_cache()
@@ -0,0 +1,136 @@
+import json
+import pathlib
+import time
+
+from conftest import brainrot
+
+
+def inventario(app, n):
+    nombres = [nombre for nombre in app.current_catalog()["brainrot_nombres"] if nombre]
+    colores = list(app.COLORES)
+    return [
+        dict(brainrot(f"{i:012x}", nombres[i % len(nombres)], f"c{i % 7}", 1 + i % 3, total=1000 + i), Color=colores[i % len(colores)])
+        for i in range(n)
+    ]
+
+
+def cuentas():
+    return [{"id": i, "nombre": f"c{i}"} for i in range(7)]
+
+
+def campos(brainrots):
+    return sorted((b["id"], b["Brainrot"], b["Color"], b["Cuenta"], b["Total"], b["Cantidad"]) for b in brainrots)
+
+
+def test_large_profile_round_trip(app, db):
+    brainrots = inventario(app, 100_000)
+    inicio = time.perf_counter()
+    app.save_data("u1", "grande", brainrots, cuentas())
+    estado = app.load_profile("u1", "grande")
+    assert time.perf_counter() - inicio < 30
+
+    base = db.dump("perfiles/u1/data/grande")["perfiles/u1/data/grande"]
+    assert len(base["fragmentos"]) == app.shard_count(len(brainrots)) == 64
+    assert base["inv"]["i"] == []
+    assert campos(estado["brainrots"]) == campos(brainrots)
+    assert base["resumen"]["pilas"] == 100_000
+
+
+def test_small_profile_stays_in_base_document(app, db):
+    app.save_data("u1", "p", inventario(app, 10), cuentas())
+    docs = db.dump("perfiles/u1/data/p")
+    assert list(docs) == ["perfiles/u1/data/p"]
+    assert "fragmentos" not in docs["perfiles/u1/data/p"]
+
+
+def test_save_rewrites_only_changed_shards(app, db):
+    brainrots = inventario(app, 10_000)
+    app.save_data("u1", "p", brainrots, cuentas())
+    antes = set(db.dump("perfiles/u1/data/p/fragmentos"))
+
+    brainrots[0] = dict(brainrots[0], Cantidad=50)
+    escrituras = db.escrituras
+    app.save_data("u1", "p", brainrots, cuentas())
+    despues = set(db.dump("perfiles/u1/data/p/fragmentos"))
+
+    assert len(despues - antes) == 1
+    assert len(antes - despues) == 1
+    # Fragmento nuevo, documento base (con la clasificación en el mismo batch) y fragmento viejo borrado.
+    assert db.escrituras - escrituras <= 5
+    assert campos(app.load_profile("u1", "p")["brainrots"]) == campos(brainrots)
+
+
+def test_stale_manifest_is_reread(app, db):
+    brainrots = inventario(app, 10_000)
+    app.save_data("u1", "p", brainrots, cuentas())
+    ref = app._profile_ref("u1", "p")
+    viejo = ref.get()
+
+    brainrots[1] = dict(brainrots[1], Cantidad=9)
+    app.save_data("u1", "p", brainrots, cuentas())
+
+    estado = app._profile_state(ref, viejo)
+    assert campos(estado["brainrots"]) == campos(brainrots)
+
+
+def test_unchanged_profile_is_served_without_payload_reads(app, db):
+    app.save_data("u1", "p", inventario(app, 10_000), cuentas())
+    app.load_profile("u1", "p")
+
+    lecturas = db.lecturas
+    estado = app.load_profile("u1", "p")
+    # Metadatos del documento y la consulta de operaciones nuevas.
+    assert db.lecturas - lecturas == 2
+    assert len(estado["brainrots"]) == 10_000
+
+    # La copia servida no comparte listas con el modelo guardado.
+    estado["brainrots"].clear()
+    assert len(app.load_profile("u1", "p")["brainrots"]) == 10_000
+
+
+def test_changed_profile_is_reloaded(app, db):
+    brainrots = inventario(app, 100)
+    app.save_data("u1", "p", brainrots, cuentas())
+    app.load_profile("u1", "p")
+
+    app.save_data("u1", "p", brainrots[:50], cuentas())
+    assert len(app.load_profile("u1", "p")["brainrots"]) == 50
+
+
+def test_prefetch_downloads_only_changed_profiles(app, db):
+    for perfil in ("a", "b", "c"):
+        app.save_data("u1", perfil, inventario(app, 20), cuentas())
+    estados, versiones = app.prefetch_profiles("u1", ["a", "b", "c"])
+    assert {perfil: len(estado["brainrots"]) for perfil, estado in estados.items()} == {"a": 20, "b": 20, "c": 20}
+    assert set(versiones) == {"a", "b", "c"}
+
+    app.save_data("u1", "b", inventario(app, 5), cuentas())
+    lecturas = db.lecturas
+    estados, versiones = app.prefetch_profiles("u1", ["a", "b", "c"])
+    # Tres lecturas de metadatos, la consulta de operaciones nuevas de los dos
+    # sin cambios y una sola descarga completa (documento y registro de operaciones).
+    assert db.lecturas - lecturas == 7
+    assert len(estados["b"]["brainrots"]) == 5
+    assert versiones["b"] == app.profile_version("u1", "b")
+
+
+def test_prefetch_of_missing_profile_is_empty(app):
+    estados, _ = app.prefetch_profiles("u1", ["nuevo"])
+    assert estados["nuevo"] == app.empty_profile_state()
+
+
+def test_new_catalog_version_redecodes_unchanged_profile(app, tmp_path, monkeypatch):
+    app.save_data("u1", "p", [brainrot("a1", "Tim Cheese")], cuentas())
+    assert app.load_profile("u1", "p")["brainrots"][0]["Calidad"] == "Común"
+
+    data = json.loads(pathlib.Path(app.CATALOGO_ARCHIVO).read_text(encoding="utf-8"))
+    data["version"] += 1
+    for entrada in data["brainrots"]:
+        if entrada["nombre"] == "Tim Cheese":
+            entrada["calidad"] = "Mítico"
+    archivo = tmp_path / "catalogo.json"
+    archivo.write_text(json.dumps(data), encoding="utf-8")
+    monkeypatch.setattr(app, "CATALOGO_ARCHIVO", str(archivo))
+    app._catalog_store()["revisado"] = 0.0
+
+    assert app.load_profile("u1", "p")["brainrots"][0]["Calidad"] == "Mítico"
@@ -0,0 +1,18 @@
+from conftest import brainrot
+
+
+def test_snapshot_escapes_every_stored_field(app):
+    carga = "<script>alert(1)</script>"
+    pila = dict(
+        brainrot("a1", nombre=carga, cuenta=carga, color=carga, mutaciones=[carga]),
+        Calidad="x' onmouseover='alert(1)",
+    )
+    fragmento = app.share_fragment("<b>perfil</b>", [pila])
+    assert "<script" not in fragmento and "<b>perfil" not in fragmento
+    assert "onmouseover='" not in fragmento
+    assert "rarity-desconocida" in fragmento
+
+
+def test_known_badges_keep_their_classes(app):
+    assert app.rarity_badge_html("Brainrot God") == "<span class='rarity-badge rarity-brainrot-god'>Brainrot God</span>"
+    assert "color-dorado" in app.color_badge_html("🟡 Dorado")
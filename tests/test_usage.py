@@ -0,0 +1,40 @@
+import time
+
+from conftest import brainrot
+
+
+def esperar(app, uid="u1"):
+    limite = time.time() + 5
+    while app.background_pending(uid) and time.time() < limite:
+        time.sleep(0.01)
+
+
+def test_background_tasks_charge_the_session_that_queued_them(app, db):
+    app.save_data("u1", "p", [brainrot("a1")], [])
+    token = app._sesion_consumo.set("sesion-1")
+    try:
+        futuro = app.submit_background("u1", "precargar", app.prefetch_profiles, "u1", ["p"])
+    finally:
+        app._sesion_consumo.reset(token)
+    futuro.result(timeout=5)
+    assert app.session_usage("sesion-1")["lecturas"] > 0
+    assert app.session_usage("otra")["lecturas"] == 0
+
+
+def test_deferred_flush_is_charged_to_the_committing_session(app, db, monkeypatch):
+    monkeypatch.setattr(app, "take_token", lambda tipo, clave: None)
+    monkeypatch.setattr(app, "GUARDADO_DEBOUNCE", 600)
+    monkeypatch.setattr(app, "GUARDADO_MAX_ESPERA", 600)
+    estado = app.load_profile("u1", "p")
+    token = app._sesion_consumo.set("sesion-1")
+    try:
+        app.commit_op("u1", "p", estado, {"k": "add", "b": app.op_item(brainrot("a1"))})
+    finally:
+        app._sesion_consumo.reset(token)
+    antes = app.session_usage("sesion-1")["escrituras"]
+
+    # El temporizador del guardado corre sin sesión.
+    app._submit_flush("u1", "p")
+    esperar(app)
+    assert app.pending_write_count("u1", "p") == 0
+    assert app.session_usage("sesion-1")["escrituras"] > antes
@@ -0,0 +1,315 @@
+import io
+import threading
+import time
+
+import pytest
+
+from conftest import brainrot
+
+
+@pytest.fixture
+def cola(app, monkeypatch):
+    """Sin límite de frecuencia ni guardados automáticos: las pruebas llaman a flush_writes."""
+    monkeypatch.setattr(app, "take_token", lambda tipo, clave: None)
+    monkeypatch.setattr(app, "GUARDADO_DEBOUNCE", 600)
+    monkeypatch.setattr(app, "GUARDADO_MAX_ESPERA", 600)
+    return app
+
+
+def alta(app, i):
+    return {"k": "add", "b": app.op_item(brainrot(f"{i:012x}", total=i + 1))}
+
+
+def base(db):
+    return db.dump("perfiles/u1/data/p")["perfiles/u1/data/p"]
+
+
+def guardadas(db):
+    return sorted(ruta.rsplit("/", 1)[1] for ruta in db.dump("perfiles/u1/data/p/ops/"))
+
+
+def copias(estado):
+    return sum(b["Cantidad"] for b in estado["brainrots"])
+
+
+def crash(app):
+    """Lo que pierde un proceso que muere: la cola y los modelos decodificados."""
+    app.discard_writes("u1", "p")
+    app.forget_decoded_profile("u1", "p")
+
+
+def test_committed_ops_survive_a_crash_before_flush(cola, db):
+    cola.save_data("u1", "p", [], [])
+    estado = cola.load_profile("u1", "p")
+    for i in range(5):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+    assert len(guardadas(db)) == 5
+    assert "op_head" not in base(db)
+
+    crash(cola)
+    assert copias(cola.load_profile("u1", "p")) == 5
+
+
+def test_failed_op_write_raises_and_leaves_state(cola, db):
+    estado = cola.load_profile("u1", "p")
+    cola.commit_op("u1", "p", estado, alta(cola, 0))
+
+    def fallar(escrituras):
+        raise RuntimeError("sin red")
+
+    db.fallar = fallar
+    with pytest.raises(cola.SaveFailed):
+        cola.commit_op("u1", "p", estado, alta(cola, 1))
+    assert copias(estado) == 1
+    assert len(estado["deshacer"]) == 1
+    assert cola.pending_write_count("u1", "p") == 1
+
+
+def test_failed_base_update_is_retried(cola, db):
+    estado = cola.load_profile("u1", "p")
+    for i in range(3):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+
+    def fallar(escrituras):
+        raise RuntimeError("sin red")
+
+    db.fallar = fallar
+    assert not cola.flush_writes("u1", "p")
+    assert cola.pending_write_count("u1", "p") == 3
+
+    db.fallar = None
+    assert cola.flush_writes("u1", "p")
+    assert base(db)["op_head"] == guardadas(db)[-1]
+    assert len(base(db)["deshacer"]) == 3
+
+
+def ajena(app, i, hace=0.0):
+    """Operación que otro proceso escribió hace ``hace`` segundos."""
+    op_id = f"{app.time.time_ns() - int(hace * 1e9):020d}-ajena{i}"
+    app._profile_ref("u1", "p").collection("ops").document(op_id).set({"i": op_id, "op": alta(app, 1000 + i), "modo": "do"})
+    return op_id
+
+
+def test_op_from_another_process_invalidates_the_decoded_model(cola, db):
+    cola.save_data("u1", "p", [brainrot("a1")], [])
+    assert copias(cola.load_profile("u1", "p")) == 1
+    version = cola.profile_version("u1", "p")
+
+    # Otro proceso guarda operaciones sin llegar a actualizar el documento base.
+    for i in range(4):
+        ajena(cola, i)
+    assert copias(cola.load_profile("u1", "p")) == 5
+    estados, _ = cola.prefetch_profiles("u1", ["p"])
+    assert copias(estados["p"]) == 5
+
+    # commit_op avisa a las sesiones de los demás procesos con la versión compartida.
+    estado = cola.load_profile("u1", "p")
+    cola.commit_op("u1", "p", estado, alta(cola, 9))
+    assert cola.profile_version("u1", "p") > version
+
+
+def test_compaction_snapshots_the_stored_state(cola, db, monkeypatch):
+    monkeypatch.setattr(cola, "COMPACTAR_MARGEN", 0)
+    estado = cola.load_profile("u1", "p")
+    for i in range(cola.COMPACTAR_CADA):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+    ajena(cola, 0)
+    ultima = guardadas(db)[-1]
+
+    assert cola.flush_writes("u1", "p")
+    assert base(db)["op_base"] > ultima
+    # Sólo quedan las operaciones a las que apunta la pila de deshacer.
+    assert guardadas(db) == sorted(base(db)["deshacer"])
+    assert estado["pendientes"] == 0
+
+    # La instantánea incluye la operación del otro proceso, que este nunca aplicó.
+    assert base(db)["resumen"]["copias"] == cola.COMPACTAR_CADA + 1
+    crash(cola)
+    assert copias(cola.load_profile("u1", "p")) == cola.COMPACTAR_CADA + 1
+
+
+def test_compaction_leaves_recent_ops_in_the_log(cola, db):
+    vieja = ajena(cola, 0, hace=2 * cola.COMPACTAR_MARGEN)
+    estado = cola.load_profile("u1", "p")
+    for i in range(cola.COMPACTAR_CADA):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+
+    recientes = guardadas(db)[1:]
+    assert cola.flush_writes("u1", "p")
+    assert vieja < base(db)["op_base"] < recientes[0]
+    assert guardadas(db) == recientes
+    assert base(db)["resumen"]["copias"] == cola.COMPACTAR_CADA + 1
+    crash(cola)
+    assert copias(cola.load_profile("u1", "p")) == cola.COMPACTAR_CADA + 1
+
+
+def test_compaction_loses_to_a_concurrent_snapshot(cola, db, monkeypatch):
+    monkeypatch.setattr(cola, "COMPACTAR_MARGEN", 0)
+    estado = cola.load_profile("u1", "p")
+    for i in range(cola.COMPACTAR_CADA):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+    otra = cola._stored_profile
+
+    def compactada_en_medio(ref, doc):
+        resultado = otra(ref, doc)
+        ref.set({"op_base": "99999999999999999999"}, merge=True)
+        return resultado
+
+    monkeypatch.setattr(cola, "_stored_profile", compactada_en_medio)
+    assert cola.flush_writes("u1", "p")
+    assert base(db)["op_base"] == "99999999999999999999"
+    assert len(guardadas(db)) == cola.COMPACTAR_CADA
+
+
+def test_late_flush_does_not_move_op_head_back(cola, db):
+    estado = cola.load_profile("u1", "p")
+    cola.commit_op("u1", "p", estado, alta(cola, 0))
+    futuro = f"{cola.time.time_ns() + 10**12:020d}-otro"
+    cola._profile_ref("u1", "p").set({"op_head": futuro, "guardado": futuro, "resumen": {"copias": 7}, "deshacer": []}, merge=True)
+
+    assert cola.flush_writes("u1", "p")
+    assert base(db)["op_head"] == futuro
+    assert base(db)["deshacer"] == []
+    # El resumen del otro proceso no incluía esta operación: se recalcula desde el registro.
+    assert base(db)["resumen"]["copias"] == 1
+
+
+def test_undo_stacks_store_only_op_ids(cola, db, monkeypatch):
+    monkeypatch.setattr(cola, "COMPACTAR_MARGEN", 0)
+    estado = cola.load_profile("u1", "p")
+    for i in range(cola.LIMITE_DESHACER + 5):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+    assert cola.flush_writes("u1", "p")
+    pila = base(db)["deshacer"]
+    assert len(pila) == cola.LIMITE_DESHACER and all(isinstance(e, str) for e in pila)
+    # Las operaciones que salieron de la pila se borran al compactar.
+    assert guardadas(db) == sorted(pila)
+
+    # Otro proceso deshace leyendo la operación del registro.
+    crash(cola)
+    estado = cola.load_profile("u1", "p")
+    assert estado["operaciones"] == {}
+    deshecha = cola.undo_last("u1", "p", estado)
+    assert deshecha == alta(cola, cola.LIMITE_DESHACER + 4)
+    assert copias(estado) == cola.LIMITE_DESHACER + 4
+    assert estado["rehacer"] == [pila[-1]]
+    assert cola.redo_last("u1", "p", estado) == deshecha
+    assert copias(estado) == cola.LIMITE_DESHACER + 5
+
+
+def test_stack_entry_of_a_deleted_op_is_skipped(cola, db):
+    estado = cola.load_profile("u1", "p")
+    cola.commit_op("u1", "p", estado, alta(cola, 0))
+    cola.commit_op("u1", "p", estado, alta(cola, 1))
+    assert cola.flush_writes("u1", "p")
+    crash(cola)
+    estado = cola.load_profile("u1", "p")
+    cola._profile_ref("u1", "p").collection("ops").document(estado["deshacer"][-1]).delete()
+
+    assert cola.stack_top("u1", "p", estado, "deshacer") == alta(cola, 0)
+    assert len(estado["deshacer"]) == 1
+
+
+def test_backup_round_trip_keeps_undo_history(cola, db):
+    estado = cola.load_profile("u1", "p")
+    for i in range(3):
+        cola.commit_op("u1", "p", estado, alta(cola, i))
+    cola.undo_last("u1", "p", estado)
+    salida = io.BytesIO()
+    assert cola.export_backup("u1", salida) == 1
+
+    (respaldo,) = list(cola.read_backup(io.BytesIO(salida.getvalue())))
+    # Al leer la copia Calidad y Total salen del catálogo.
+    catalogo = cola.current_catalog()
+    validadas = [cola.backup_op(alta(cola, i), catalogo) for i in range(3)]
+    assert respaldo["deshacer"] == validadas[:2]
+    assert respaldo["rehacer"] == validadas[2:]
+
+    cola.restore_profile("u1", "p", respaldo)
+    crash(cola)
+    estado = cola.load_profile("u1", "p")
+    assert copias(estado) == 2
+    assert all(isinstance(e, str) for e in estado["deshacer"] + estado["rehacer"])
+    assert cola.redo_last("u1", "p", estado) == validadas[2]
+    assert copias(estado) == 3
+
+
+@pytest.fixture
+def otro(otro_proceso, monkeypatch):
+    """El mismo perfil abierto en otro proceso, con la misma configuración que ``cola``."""
+    monkeypatch.setattr(otro_proceso, "take_token", lambda tipo, clave: None)
+    monkeypatch.setattr(otro_proceso, "GUARDADO_DEBOUNCE", 600)
+    monkeypatch.setattr(otro_proceso, "GUARDADO_MAX_ESPERA", 600)
+    return otro_proceso
+
+
+@pytest.mark.parametrize("primero", ["a", "b"])
+def test_two_processes_writing_the_same_profile(cola, otro, db, primero):
+    cola.save_data("u1", "p", [], [])
+    estado_a = cola.load_profile("u1", "p")
+    estado_b = otro.load_profile("u1", "p")
+    for i in range(3):
+        cola.commit_op("u1", "p", estado_a, alta(cola, i))
+        otro.commit_op("u1", "p", estado_b, alta(otro, 10 + i))
+    # Cada proceso sólo conoce sus operaciones hasta que las guarda.
+    assert copias(estado_a) == copias(estado_b) == 3
+
+    procesos = [cola, otro] if primero == "a" else [otro, cola]
+    for proceso in procesos:
+        assert proceso.flush_writes("u1", "p")
+    assert base(db)["op_head"] == guardadas(db)[-1]
+    assert base(db)["resumen"]["copias"] == 6
+
+    # Ninguno sirve su estado local incompleto una vez vacía la cola.
+    for proceso in (cola, otro):
+        assert copias(proceso.load_profile("u1", "p")) == 6
+        assert proceso.pending_state("u1", "p") is None
+
+
+def test_a_stale_state_keeps_recomputing_the_summary(cola, otro, db):
+    cola.save_data("u1", "p", [], [])
+    estado_a = cola.load_profile("u1", "p")
+    estado_b = otro.load_profile("u1", "p")
+    otro.commit_op("u1", "p", estado_b, alta(otro, 0))
+    assert otro.flush_writes("u1", "p")
+
+    # A guarda dos veces sobre un estado al que le falta la operación de B.
+    cola.commit_op("u1", "p", estado_a, alta(cola, 1))
+    assert cola.flush_writes("u1", "p")
+    cola.commit_op("u1", "p", estado_a, alta(cola, 2))
+    assert cola.flush_writes("u1", "p")
+    assert copias(estado_a) == 2
+    assert base(db)["resumen"]["copias"] == 3
+    assert not cola._is_own_write("u1", "p", estado_a, cola.profile_version("u1", "p"))
+
+
+def test_concurrent_writers_with_background_flushes_and_compaction(cola, otro, db, monkeypatch):
+    for proceso in (cola, otro):
+        monkeypatch.setattr(proceso, "GUARDADO_DEBOUNCE", 0.02)
+        monkeypatch.setattr(proceso, "GUARDADO_MAX_ESPERA", 0.1)
+        monkeypatch.setattr(proceso, "COMPACTAR_CADA", 5)
+        monkeypatch.setattr(proceso, "COMPACTAR_MARGEN", 0.3)
+    cola.save_data("u1", "p", [], [])
+    escritas = []
+
+    def escribir(proceso, desde):
+        estado = proceso.load_profile("u1", "p")
+        for i in range(desde, desde + 40):
+            escritas.append(proceso.commit_op("u1", "p", estado, alta(proceso, i)))
+            time.sleep(0.02)
+
+    hilos = [threading.Thread(target=escribir, args=(proceso, desde)) for proceso, desde in ((cola, 0), (otro, 100))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    for proceso in (cola, otro):
+        proceso.flush_all_writes()
+
+    # Hubo compactaciones, y las operaciones que no entraron en una instantánea siguen en el registro.
+    assert base(db)["op_base"] > "0"
+    assert {i for i in escritas if i > base(db)["op_base"]} <= set(guardadas(db))
+    assert base(db)["resumen"]["copias"] == 80
+    for proceso in (cola, otro):
+        crash(proceso)
+    assert copias(cola.load_profile("u1", "p")) == 80